@@ -0,0 +1,128 @@
+import os
+import json
+import sqlite3
+import threading
+from time import time
+from dotenv import load_dotenv
+load_dotenv()
+
+# local catalog of validated titles, filled offline by app.ingest from provider dumps
+CATALOG_PATH = os.getenv("CATALOG_PATH", "/tmp/shows5u_catalog.sqlite3")
+
+FIELDS = ("title", "description", "genres", "year", "image_url", "url")
+
+
+class Catalog:
+    """SQLite file keyed by (content_type, lowercased title), plus the chunks app.ingest has finished."""
+
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS titles ("
+                "content_type TEXT NOT NULL, key TEXT NOT NULL, title TEXT NOT NULL, description TEXT, "
+                "genres TEXT, year, image_url TEXT, url TEXT, source TEXT, updated REAL NOT NULL, seq INTEGER, "
+                "PRIMARY KEY (content_type, key))"
+            )
+            if "seq" not in {column[1] for column in conn.execute("PRAGMA table_info(titles)")}:
+                # catalogs written before the write sequence existed, indexed on the first refresh
+                conn.execute("ALTER TABLE titles ADD COLUMN seq INTEGER")
+                conn.execute("UPDATE titles SET seq = 1")
+                conn.commit()
+            conn.execute("CREATE INDEX IF NOT EXISTS titles_seq_idx ON titles (seq)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ingested_chunks ("
+                "source TEXT NOT NULL, chunk INTEGER NOT NULL, records INTEGER NOT NULL, done REAL NOT NULL, "
+                "PRIMARY KEY (source, chunk))"
+            )
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _row_to_result(row) -> dict:
+        result = dict(zip(FIELDS, row))
+        result["genres"] = json.loads(result["genres"] or "[]")
+        return result
+
+    def upsert_many(self, content_type: str, results: list[dict], source: str = None):
+        """Write results as one batch, numbered after every batch committed before it."""
+        if not results:
+            return
+        now = time()
+        with self._lock:
+            conn = self._connection()
+            # the sequence is read under the write lock, so batches commit in sequence order
+            # even across ingest processes, unlike their timestamps
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM titles").fetchone()[0]
+                conn.executemany(
+                    "INSERT OR REPLACE INTO titles (content_type, key, title, description, genres, year, image_url, url, source, updated, seq) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (content_type, result["title"].lower(), result["title"], result["description"], json.dumps(result["genres"]),
+                         result["year"], result["image_url"], result["url"], source, now, seq)
+                        for result in results
+                    ],
+                )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def get_many(self, content_type: str, titles: list[str]) -> dict[str, dict]:
+        """Lowercased title -> result for the titles in the catalog."""
+        keys = list({title.lower() for title in titles})
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT key, {', '.join(FIELDS)} FROM titles WHERE content_type = ? AND key IN ({placeholders})",
+                (content_type, *keys),
+            ).fetchall()
+        return {row[0]: self._row_to_result(row[1:]) for row in rows}
+
+    def titles_since(self, seq: int = 0):
+        """(content_type, title, seq) for every title written in a batch after seq, oldest first."""
+        with self._lock:
+            return self._connection().execute(
+                "SELECT content_type, title, seq FROM titles WHERE seq > ? ORDER BY seq", (seq,)
+            ).fetchall()
+
+    def count(self, content_type: str = None) -> int:
+        with self._lock:
+            conn = self._connection()
+            if content_type is None:
+                return conn.execute("SELECT COUNT(*) FROM titles").fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM titles WHERE content_type = ?", (content_type,)).fetchone()[0]
+
+    def done_chunks(self, source: str) -> set[int]:
+        with self._lock:
+            rows = self._connection().execute("SELECT chunk FROM ingested_chunks WHERE source = ?", (source,)).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_chunk_done(self, source: str, chunk: int, records: int):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO ingested_chunks (source, chunk, records, done) VALUES (?, ?, ?, ?)",
+                (source, chunk, records, time()),
+            )
+            conn.commit()
+
+    def reset_source(self, source: str):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM ingested_chunks WHERE source = ?", (source,))
+            conn.commit()
+
+
+catalog = Catalog()
@@ -1,48 +1,56 @@
 from datetime import datetime
-from sqlalchemy.dialects.postgresql import insert  # PostgreSQL-specific import
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy import select, delete, and_
 from sqlalchemy.exc import IntegrityError
 from app.extensions import db
 from app.models import PopularRecommendation, UserRecommendation
 from sqlalchemy.orm import load_only
 from sqlalchemy import func
-
-def upsert_popular_recommendations(content_type: str, entries: list):
+from app.metrics import traced
+from app.constants import FORBIDDEN_GENRES
+
+
+def insert(model):
+    # PostgreSQL in production, SQLite for local benchmarks, both support ON CONFLICT DO UPDATE
+    if db.engine.dialect.name == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+
+def popular_values(content_type: str, entries: list, current_time: datetime = None) -> list:
+    """One popular_recommendations row per entry with genres, counted once."""
+    current_time = current_time or datetime.utcnow()
+    return [
+        {
+            "title": entry["title"],
+            "image_url": entry["image_url"],
+            "url": entry["url"],
+            "content_type": content_type,
+            "recommendation_count": 1,
+            "genres": ", ".join(entry["genres"]),
+            "last_recommended": current_time,
+        }
+        for entry in entries if entry['genres'] and len(set(entry['genres']).intersection(FORBIDDEN_GENRES)) == 0
+    ]
+
+
+@traced("db", op="upsert_popular_counts")
+def upsert_popular_counts(values: list):
     """
-    Bulk inserts or updates popular recommendations for the given content type.
+    Inserts popular recommendation rows or adds their recommendation_count to the existing ones.
 
-    :param content_type: The type of content ('anime', 'movie', 'series').
-    :param entries: List of dictionaries containing keys "title", "image_url", and "url".
+    :param values: Rows as built by popular_values, at most one per (title, content_type).
     """
-    forbidden_genres = {'Hentai'}
-    current_time = datetime.utcnow()
+    if not values:
+        return
     try:
-
-        values = [
-            {
-                "title": entry["title"],
-                "image_url": entry["image_url"],
-                "url": entry["url"],
-                "content_type": content_type,
-                "recommendation_count": 1,
-                "genres": ", ".join(entry["genres"]),
-                "last_recommended": current_time,
-            }
-            for entry in entries if entry['genres'] and len(set(entry['genres']).intersection(forbidden_genres)) == 0
-        ]
-        if not values:
-            return
-
-        stmt = (
-            insert(PopularRecommendation)
-            .values(values)
-            .on_conflict_do_update(
-                index_elements=["title", "content_type"],
-                set_={
-                    "recommendation_count": PopularRecommendation.recommendation_count + 1,
-                    "last_recommended": current_time,
-                },
-            )
+        stmt = insert(PopularRecommendation).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["title", "content_type"],
+            set_={
+                "recommendation_count": PopularRecommendation.recommendation_count + stmt.excluded.recommendation_count,
+                "last_recommended": stmt.excluded.last_recommended,
+            },
         )
         db.session.execute(stmt)
         db.session.commit()
@@ -51,6 +59,18 @@ def upsert_popular_recommendations(content_type: str, entries: list):
         raise
 
 
+@traced("db", op="upsert_popular_recommendations")
+def upsert_popular_recommendations(content_type: str, entries: list):
+    """
+    Bulk inserts or updates popular recommendations for the given content type.
+
+    :param content_type: The type of content ('anime', 'movie', 'series').
+    :param entries: List of dictionaries containing keys "title", "image_url", and "url".
+    """
+    upsert_popular_counts(popular_values(content_type, entries))
+
+
+@traced("db", op="get_top_n_popular_titles")
 def get_top_n_popular_titles(content_type: str, n: int = 12):
     """
     Retrieves the top N most popular titles based on recommendation count, filtered by content type.
@@ -68,6 +88,7 @@ def get_top_n_popular_titles(content_type: str, n: int = 12):
     return db.session.scalars(stmt).all()
 
 
+@traced("db", op="delete_old_recommendations")
 def delete_old_recommendations(date_threshold: datetime):
     """
     Deletes records where last_recommended is older than the specified date.
@@ -82,6 +103,7 @@ def delete_old_recommendations(date_threshold: datetime):
     db.session.commit()
     return result.rowcount
 
+@traced("db", op="upsert_user_recommendation")
 def upsert_user_recommendation(user_id: str, title: str, content_type: str, rating: float, url: str, image_url: str, genres: str, comment: str = None, seen: bool = None):
     """
     Inserts or updates a user recommendation. Updates comment, seen, and rating if the record exists.
@@ -122,6 +144,7 @@ def upsert_user_recommendation(user_id: str, title: str, content_type: str, rati
         db.session.rollback()
         raise
 
+@traced("db", op="delete_user_recommendation")
 def delete_user_recommendation(user_id: str, title: str, content_type: str):
     """
     Deletes a user recommendation based on user_id, title (case-insensitive), and content_type.
@@ -138,6 +161,7 @@ def delete_user_recommendation(user_id: str, title: str, content_type: str):
     db.session.commit()
     return result.rowcount
 
+@traced("db", op="get_user_recommendations")
 def get_user_recommendations(user_id: str, content_type: str = None, cols: tuple = tuple()):
     """
     Retrieves full row objects for all recommendations of a given user,
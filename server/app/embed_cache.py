@@ -0,0 +1,274 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from time import time
+import numpy as np
+import redis
+from dotenv import load_dotenv
+from app.metrics import Gauge
+load_dotenv()
+
+# embeddings are deterministic per (model, text), so they are cached by content hash
+# and stored as raw float bytes (16KB per 4096-dim float32 vector vs ~80KB of JSON)
+EMBED_CACHE_BACKEND = os.getenv("EMBED_CACHE_BACKEND", "disk")  # "disk", "redis" or "none"
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "/tmp/shows5u_embeddings.sqlite3")
+EMBED_CACHE_DTYPE = os.getenv("EMBED_CACHE_DTYPE", "float32")
+EMBED_CACHE_TTL = int(os.getenv("EMBED_CACHE_TTL", 60 * 60 * 24 * 30))
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", 20000))
+EMBED_BATCH_SIZE = 96  # max texts per Cohere embed call
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+class DiskEmbeddingStore:
+    """SQLite file shared by every worker on the host, evicted by TTL then least recently used."""
+
+    def __init__(self, path: str = EMBED_CACHE_PATH, ttl: int = EMBED_CACHE_TTL, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed REAL NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed_idx ON embeddings (accessed)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        if not keys:
+            return {}
+        now = time()
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders}) AND expires > ?",
+                (*keys, now),
+            ).fetchall()
+            if rows:
+                conn.executemany("UPDATE embeddings SET accessed = ? WHERE key = ?", [(now, key) for key, _ in rows])
+                conn.commit()
+        return dict(rows)
+
+    def set_many(self, items: dict[str, bytes]):
+        if not items:
+            return
+        now = time()
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, accessed, expires) VALUES (?, ?, ?, ?)",
+                [(key, blob, now, now + self.ttl) for key, blob in items.items()],
+            )
+            conn.execute("DELETE FROM embeddings WHERE expires <= ?", (now,))
+            overflow = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY accessed LIMIT ?)",
+                    (overflow,),
+                )
+            conn.commit()
+
+    def update(self, key: str, change) -> bool:
+        """
+        Replace key's value (None for absent or expired) with change(value), or leave it
+        when change returns None. Read and write happen under the database write lock, so
+        change must not block.
+        """
+        now = time()
+        with self._lock:
+            conn = self._connection()
+            # takes the write lock before the read, so other processes can't write in between
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT vector FROM embeddings WHERE key = ? AND expires > ?", (key, now)).fetchone()
+                value = change(row[0] if row else None)
+                if value is None:
+                    conn.rollback()
+                    return True
+                conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, accessed, expires) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now + self.ttl),
+                )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return True
+
+    def delete_many(self, keys: list[str]):
+        if not keys:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.execute(f"DELETE FROM embeddings WHERE key IN ({','.join('?' * len(keys))})", keys)
+            conn.commit()
+
+
+class RedisEmbeddingStore:
+    """Binary values with a sliding TTL, pair with maxmemory-policy allkeys-lru on the server."""
+
+    def __init__(self, prefix: str = "embed", ttl: int = EMBED_CACHE_TTL, write_attempts: int = 5):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.write_attempts = write_attempts
+        self.client = redis.Redis(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            username="default",
+            password=os.getenv("REDIS_PASSWORD"),
+        )
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        if not keys:
+            return {}
+        redis_keys = [f"{self.prefix}:{key}" for key in keys]
+        values = self.client.mget(redis_keys)
+        hits = {key: value for key, value in zip(keys, values) if value is not None}
+        if hits:
+            with self.client.pipeline(transaction=False) as pipe:
+                for key in hits:
+                    pipe.expire(f"{self.prefix}:{key}", self.ttl)
+                pipe.execute()
+        return hits
+
+    def set_many(self, items: dict[str, bytes]):
+        if not items:
+            return
+        with self.client.pipeline(transaction=False) as pipe:
+            for key, blob in items.items():
+                pipe.set(f"{self.prefix}:{key}", blob, ex=self.ttl)
+            pipe.execute()
+
+    def update(self, key: str, change) -> bool:
+        """
+        Replace key's value (None for absent) with change(value) in a WATCH transaction, or
+        leave it when change returns None. Retried when another client writes in between,
+        returns False if it kept conflicting.
+        """
+        redis_key = f"{self.prefix}:{key}"
+        with self.client.pipeline() as pipe:
+            for _ in range(self.write_attempts):
+                try:
+                    pipe.watch(redis_key)
+                    value = change(pipe.get(redis_key))
+                    if value is None:
+                        pipe.unwatch()
+                        return True
+                    pipe.multi()
+                    pipe.set(redis_key, value, ex=self.ttl)
+                    pipe.execute()
+                    return True
+                except redis.WatchError:
+                    continue
+        return False
+
+    def delete_many(self, keys: list[str]):
+        if keys:
+            self.client.delete(*[f"{self.prefix}:{key}" for key in keys])
+
+
+class EmbeddingCache:
+
+    def __init__(self, store=None, dtype: str = EMBED_CACHE_DTYPE):
+        self.store = store
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.bytes_saved = 0  # JSON vector bytes not downloaded from Cohere thanks to hits
+        self._json_bytes_per_vector = 0
+
+    def key(self, model: str, text: str) -> str:
+        raw = f"{model}\0{self.dtype.str}\0{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_or_compute(self, texts: list[str], model: str, compute) -> np.ndarray:
+        """
+        Return an (N, D) float32 matrix for texts. Only misses are passed to
+        compute (deduplicated, in batches of EMBED_BATCH_SIZE).
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        keys = [self.key(model, text) for text in texts]
+        cached = {}
+        if self.store is not None:
+            try:
+                cached = self.store.get_many(list(dict.fromkeys(keys)))
+            except Exception as e:
+                self.errors += 1
+                print(f"Error reading embedding cache: {e}")
+
+        vectors = {key: np.frombuffer(blob, dtype=self.dtype) for key, blob in cached.items()}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+
+        if missing:
+            missing_keys = list(missing)
+            computed = []
+            for i in range(0, len(missing_keys), EMBED_BATCH_SIZE):
+                computed += compute([missing[key] for key in missing_keys[i:i + EMBED_BATCH_SIZE]])
+            self._json_bytes_per_vector = len(json.dumps(computed[0]))
+            for key, vector in zip(missing_keys, computed):
+                vectors[key] = np.asarray(vector, dtype=self.dtype)
+            if self.store is not None:
+                try:
+                    self.store.set_many({key: vectors[key].tobytes() for key in missing_keys})
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Error writing embedding cache: {e}")
+        elif not self._json_bytes_per_vector:
+            self._json_bytes_per_vector = len(json.dumps(vectors[keys[0]].tolist()))
+
+        n_hits = sum(1 for key in keys if key in cached)
+        with self._lock:
+            self.hits += n_hits
+            self.misses += len(keys) - n_hits
+            self.bytes_saved += n_hits * self._json_bytes_per_vector
+
+        return np.stack([vectors[key] for key in keys]).astype(np.float32, copy=False)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "errors": self.errors,
+            }
+
+
+def create_embedding_store(backend: str = EMBED_CACHE_BACKEND):
+    if backend == "redis":
+        return RedisEmbeddingStore()
+    if backend == "disk":
+        return DiskEmbeddingStore()
+    return None
+
+
+embedding_cache = EmbeddingCache(create_embedding_store())
+
+Gauge(
+    "shows5u_embedding_cache",
+    "Embedding cache hits, misses, hit_rate, bytes_saved and errors since start.",
+    lambda: {(("stat", k),): v for k, v in embedding_cache.metrics().items()},
+)
@@ -0,0 +1,209 @@
+import os
+import atexit
+import asyncio
+import threading
+from dotenv import load_dotenv
+from app.utils import embedding_id
+from app.embed_cache import EMBED_BATCH_SIZE
+from app.vector_store import get_vector_store
+from app.profile import update_profile, set_profile_embedding
+from app.recommend import store_embeddings
+from app.runner import get_runner, run_in_background, SERVERLESS
+from app.metrics import Counter, Gauge
+load_dotenv()
+
+# write-behind profile updates and embeddings for /preference. requests only save the rating
+# and enqueue the change, a job on the runner applies each user's queued changes to their
+# profile in one write, then embeds queued descriptions in batches of up to EMBED_BATCH_SIZE,
+# upserts them, and fills the embedding into the profiles of the users who rated them
+EMBED_QUEUE_ENABLED = os.getenv("EMBED_QUEUE_ENABLED", "1") == "1"
+EMBED_QUEUE_INTERVAL = float(os.getenv("EMBED_QUEUE_INTERVAL", 2))
+EMBED_QUEUE_MAX_ATTEMPTS = int(os.getenv("EMBED_QUEUE_MAX_ATTEMPTS", 5))
+
+embed_queue_items = Counter("shows5u_embed_queue_items_total", "Titles handled by the embedding write-behind queue, by outcome.")
+
+
+class PendingEmbedding:
+
+    def __init__(self, content_type: str, title: str, description: str):
+        self.content_type = content_type
+        self.title = title
+        self.description = description
+        self.users = set()  # profiles waiting for the vector
+        self.attempts = 0
+
+
+class EmbeddingQueue:
+    """
+    Pending embeddings keyed by vector id, so a title rated by many users (or re-rated)
+    is embedded once with its latest description. flush() drains it a batch at a time,
+    skipping ids the vector store already has; a failed batch is requeued until
+    EMBED_QUEUE_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, batch_size: int = EMBED_BATCH_SIZE, max_attempts: int = EMBED_QUEUE_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.pending = {}  # id -> PendingEmbedding, in insertion order
+        self.changes = {}  # (user_id, content_type) -> [(title, rating, genres, seen)], in order
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add_change(self, user_id: str, content_type: str, title: str, rating, genres=None, seen=None):
+        """Queue a profile change, a falsy rating removes the title."""
+        with self._lock:
+            self.changes.setdefault((user_id, content_type), []).append((title, rating, genres, seen))
+
+    def add(self, content_type: str, title: str, description: str, user_id: str = None) -> bool:
+        """Queue a title, returns True once a full batch is waiting."""
+        item_id = embedding_id(content_type, title)
+        with self._lock:
+            item = self.pending.get(item_id)
+            if item is None:
+                item = self.pending[item_id] = PendingEmbedding(content_type, title, description)
+            else:
+                item.description = description
+            if user_id:
+                item.users.add(user_id)
+            return len(self.pending) >= self.batch_size
+
+    def _take(self) -> dict:
+        with self._lock:
+            ids = list(self.pending)[:self.batch_size]
+            return {item_id: self.pending.pop(item_id) for item_id in ids}
+
+    def _requeue(self, batch: dict):
+        with self._lock:
+            for item_id, item in batch.items():
+                item.attempts += 1
+                if item.attempts >= self.max_attempts:
+                    print(f"Giving up on embedding {item_id} after {item.attempts} attempts")
+                    embed_queue_items.inc(outcome="dropped")
+                    continue
+                newer = self.pending.get(item_id)
+                if newer is not None:
+                    # queued again while in flight, keep the newer description
+                    newer.users |= item.users
+                    newer.attempts = max(newer.attempts, item.attempts)
+                else:
+                    self.pending[item_id] = item
+                embed_queue_items.inc(outcome="retried")
+
+    def _flush_changes(self):
+        with self._lock:
+            changes, self.changes = self.changes, {}
+            pending = set(self.pending)
+        if not changes:
+            return
+        # vectors of titles still waiting to be embedded are filled in by their batch
+        ids = {
+            embedding_id(content_type, title)
+            for (_, content_type), user_changes in changes.items()
+            for title, rating, _, _ in user_changes if rating
+        } - pending
+        try:
+            vectors = get_vector_store().fetch(list(ids)) if ids else {}
+        except Exception as e:
+            print(f"Error fetching vectors for {len(changes)} queued profile changes: {e}")
+            vectors = {}
+        for (user_id, content_type), user_changes in changes.items():
+            update_profile(user_id, content_type, user_changes, vectors)
+
+    def _flush_batch(self, batch: dict):
+        store = get_vector_store()
+        vectors = store.fetch(list(batch))
+        missing = [item_id for item_id in batch if item_id not in vectors]
+        if missing:
+            items = [batch[item_id] for item_id in missing]
+            embeddings = store_embeddings(
+                [item.content_type for item in items],
+                [item.title for item in items],
+                [item.description for item in items],
+            )
+            vectors.update(zip(missing, embeddings))
+        embed_queue_items.inc(len(batch) - len(missing), outcome="stored")
+        embed_queue_items.inc(len(missing), outcome="embedded")
+        for item_id, item in batch.items():
+            for user_id in item.users:
+                set_profile_embedding(user_id, item.content_type, item.title, vectors.get(item_id))
+
+    def flush(self, wait: bool = True) -> int:
+        """
+        Apply the queued profile changes and embed everything queued so far, returns the
+        number of titles embedded. Without wait, a flush already running is left to it.
+        """
+        if not self._flush_lock.acquire(blocking=wait):
+            return 0
+        flushed = 0
+        try:
+            self._flush_changes()
+            while batch := self._take():
+                try:
+                    self._flush_batch(batch)
+                except Exception as e:
+                    # the rest waits for the next run, which is also the retry backoff
+                    print(f"Error flushing {len(batch)} queued embeddings: {e}")
+                    self._requeue(batch)
+                    break
+                flushed += len(batch)
+        finally:
+            self._flush_lock.release()
+        return flushed
+
+
+embedding_queue = EmbeddingQueue()
+
+_started_pid = None
+
+
+async def run_flush():
+    # cohere and the vector store clients are blocking
+    await asyncio.to_thread(embedding_queue.flush, False)
+
+
+def _flush_at_exit():
+    try:
+        embedding_queue.flush()
+    except Exception as e:
+        print(f"Error flushing queued embeddings at exit: {e}")
+
+
+def ensure_flush_job():
+    """Schedule run_flush on this process's runner, once per process, safe to call per request."""
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    _started_pid = os.getpid()
+    get_runner().call_every(EMBED_QUEUE_INTERVAL, run_flush)
+    # registered after the runner's own atexit hook, so it runs first
+    atexit.register(_flush_at_exit)
+
+
+def queue_preference(user_id: str, content_type: str, title: str, rating, genres=None, seen=None, description: str = None):
+    """
+    Apply a saved /preference change to user_id's profile in the background, a falsy rating
+    removes the title. A description is embedded and stored first, then added to the profile.
+    """
+    # a frozen serverless process would never flush the queue
+    if not EMBED_QUEUE_ENABLED or SERVERLESS:
+        item_id = embedding_id(content_type, title)
+        if rating and description:
+            vectors = {item_id: store_embeddings([content_type], [title], [description])[0]}
+        else:
+            vectors = get_vector_store().fetch([item_id]) if rating else {}
+        update_profile(user_id, content_type, [(title, rating, genres, seen)], vectors)
+        return
+    ensure_flush_job()
+    embedding_queue.add_change(user_id, content_type, title, rating, genres, seen)
+    if rating and description and embedding_queue.add(content_type, title, description, user_id):
+        run_in_background(run_flush())
+
+
+Gauge(
+    "shows5u_embed_queue_depth",
+    "Titles waiting in the embedding write-behind queue.",
+    lambda: len(embedding_queue),
+)
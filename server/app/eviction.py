@@ -0,0 +1,49 @@
+import os
+from dotenv import load_dotenv
+from app.redis import redis_client, auto_cleanup, track_untracked
+from app.runner import get_runner
+from app.metrics import Counter
+load_dotenv()
+
+# keeps redis under its memory budget by evicting the least recently used metadata.
+# every worker schedules the job, a short lock lets only one of them run it per interval
+EVICTION_ENABLED = os.getenv("EVICTION_ENABLED", "1") == "1"
+EVICTION_INTERVAL = float(os.getenv("EVICTION_INTERVAL", 60))
+EVICTION_MAX_MEMORY = float(os.getenv("EVICTION_MAX_MEMORY", 3e7))
+EVICTION_HIGH_WATERMARK = float(os.getenv("EVICTION_HIGH_WATERMARK", 0.8))
+EVICTION_LOW_WATERMARK = float(os.getenv("EVICTION_LOW_WATERMARK", 0.7))
+EVICTION_BATCH = int(os.getenv("EVICTION_BATCH", 100))
+EVICTION_MAX_BATCHES = int(os.getenv("EVICTION_MAX_BATCHES", 50))
+
+evicted_keys = Counter("shows5u_evicted_keys_total", "Metadata keys evicted from redis by the scheduled eviction job.")
+
+_started_pid = None
+_scan_cursor = 0
+
+
+async def run_eviction():
+    global _scan_cursor
+    async with redis_client() as r:
+        if not await r.set("lock:eviction", os.getpid(), nx=True, ex=max(1, int(EVICTION_INTERVAL))):
+            return
+        # one SCAN batch per run picks up keys cached before recency tracking
+        _scan_cursor = await track_untracked(r, _scan_cursor)
+        evicted = await auto_cleanup(
+            r,
+            max_memory=EVICTION_MAX_MEMORY,
+            high_watermark=EVICTION_HIGH_WATERMARK,
+            low_watermark=EVICTION_LOW_WATERMARK,
+            batch=EVICTION_BATCH,
+            max_batches=EVICTION_MAX_BATCHES,
+        )
+    if evicted:
+        evicted_keys.inc(evicted)
+
+
+def ensure_eviction_job():
+    """Schedule run_eviction on this process's runner, once per process, safe to call per request."""
+    global _started_pid
+    if not EVICTION_ENABLED or _started_pid == os.getpid():
+        return
+    _started_pid = os.getpid()
+    get_runner().call_every(EVICTION_INTERVAL, run_eviction)
@@ -0,0 +1,46 @@
+import os
+import asyncio
+import weakref
+import aiohttp
+from dotenv import load_dotenv
+load_dotenv()
+
+# one pooled session per event loop, shared by every validator running on it
+# so keep-alive connections and resolved hosts survive across titles
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", 100))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 20))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", 300))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", 30))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+
+_sessions = weakref.WeakKeyDictionary()
+
+
+def create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_LIMIT,
+        limit_per_host=HTTP_LIMIT_PER_HOST,
+        use_dns_cache=True,
+        ttl_dns_cache=HTTP_DNS_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE,
+    )
+    timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT, sock_connect=HTTP_CONNECT_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the shared session for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = create_session()
+        _sessions[loop] = session
+    return session
+
+
+async def close_session():
+    """Close the running loop's session. Call before the loop itself shuts down."""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
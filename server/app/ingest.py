@@ -0,0 +1,281 @@
+"""
+Offline catalog ingestion from provider dumps, so popular titles are resolved
+without a provider call or an embed call at request time.
+
+    python -m app.ingest dumps/jikan_anime.json --format jikan --workers 4
+    python -m app.ingest dumps/tmdb_movies.jsonl --format tmdb --content-type movie
+
+Records are normalized to the validators' result shape, filtered like validated
+results, then written in chunks to the catalog, the redis metadata cache and the
+vector store (embeddings go through the embedding cache in batches of 96). The dump
+is streamed and parsed once, chunks are handed to the workers with at most two per
+worker in flight, so memory stays bounded, and finished chunks are recorded so a rerun
+resumes where it stopped.
+"""
+import os
+import re
+import csv
+import json
+import hashlib
+import argparse
+import multiprocessing
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dotenv import load_dotenv
+from app.catalog import catalog
+from app.validate_anime import ValidateAnime
+from app.validate_movies import ValidateMovies
+from app.validate_handler import clean_result
+from app.recommend import store_embeddings
+from app.redis import write_cache, run_with_client
+from app.runner import run_sync
+load_dotenv()
+
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", 500))
+INGEST_READ_SIZE = 1 << 20  # bytes read at a time from a JSON array dump
+# where the records start in a wrapped dump: {"data": [...]}, {"data": {"Page": {"media": [...]}}}
+RECORDS_START = re.compile(r'"(?:data|results|media|items)"\s*:\s*\[')
+
+
+def from_csv(row: dict, content_type: str):
+    genres = row.get("genres") or ""
+    return {
+        "title": row["title"],
+        "description": row.get("description"),
+        "genres": [genre.strip() for genre in genres.replace("|", ",").split(",") if genre.strip()],
+        "year": row.get("year"),
+        "image_url": row.get("image_url"),
+        "url": row.get("url"),
+    }
+
+
+# format -> (content type it implies, normalizer(record, content_type))
+FORMATS = {
+    "jikan": ("anime", lambda record, content_type: ValidateAnime.from_jikan(record)),
+    "anilist": ("anime", lambda record, content_type: ValidateAnime.from_anilist(record)),
+    "kitsu": ("anime", lambda record, content_type: ValidateAnime.from_kitsu(record)),
+    "omdb": (None, lambda record, content_type: ValidateMovies.from_omdb(record)),
+    "tmdb": (None, lambda record, content_type: ValidateMovies.from_tmdb(record, "movie" if content_type == "movie" else "tv")),
+    "csv": (None, from_csv),
+}
+
+
+def _find_records(data):
+    # API responses wrap the records: {"data": [...]}, {"results": [...]}, {"data": {"Page": {"media": [...]}}}
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        for key in ("data", "results", "media", "Page", "items"):
+            if key in data:
+                records = _find_records(data[key])
+                if records is not None:
+                    return records
+        return [data]
+    return None
+
+
+def _unwrap(data):
+    if isinstance(data, dict) and ("data" in data or "results" in data):
+        return _find_records(data) or []
+    return [data]
+
+
+def _iter_json_array(f, buffer: str, pos: int):
+    """Stream the elements of the JSON array opened at buffer[pos - 1] without loading the file."""
+    decoder = json.JSONDecoder()
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer):
+            if buffer[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                pos = end
+                yield record
+                continue
+        elif eof:
+            raise json.JSONDecodeError("Unterminated array", buffer, pos)
+        # the only place the consumed part of the buffer is dropped
+        more = f.read(INGEST_READ_SIZE)
+        eof = not more
+        buffer, pos = buffer[pos:] + more, 0
+
+
+def _iter_wrapped_array(f):
+    """Stream the records of a JSON document spread over many lines, like _find_records without loading it."""
+    buffer = ""
+    while more := f.read(INGEST_READ_SIZE):
+        buffer += more
+        match = RECORDS_START.search(buffer)
+        if match:
+            yield from _iter_json_array(f, buffer, match.end())
+            return
+        # enough to hold a key split across two reads
+        buffer = buffer[-64:]
+    # no records array, the document is one record
+    f.seek(0)
+    yield from _find_records(json.load(f)) or []
+
+
+def iter_records(path: str, fmt: str):
+    """Yield raw records from a CSV, JSON lines or JSON dump."""
+    with open(path, newline="" if fmt == "csv" else None, encoding="utf-8") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+            return
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        if head == "[":
+            yield from _iter_json_array(f, "", 0)
+            return
+        f.seek(0)
+        lines = (line for line in f if line.strip())
+        first = next(lines, None)
+        if first is None:
+            return
+        try:
+            # one record (or one wrapped page) per line, or one document spread over many lines
+            yield from _unwrap(json.loads(first))
+        except json.JSONDecodeError:
+            f.seek(0)
+            yield from _iter_wrapped_array(f)
+            return
+        for line in lines:
+            yield from _unwrap(json.loads(line))
+
+
+def iter_chunks(path: str, fmt: str, chunk_size: int):
+    chunk = []
+    for record in iter_records(path, fmt):
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def normalize(records: list, fmt: str, content_type: str):
+    """Validated-shaped results, deduplicated by title, and the number of records dropped."""
+    normalizer = FORMATS[fmt][1]
+    results = {}
+    for record in records:
+        try:
+            result = clean_result(normalizer(record, content_type), content_type)
+        except (KeyError, TypeError, ValueError, AttributeError, IndexError):
+            result = None
+        if result and result["title"]:
+            results[result["title"].lower()] = result
+    return list(results.values()), len(records) - len(results)
+
+
+def ingest_chunk(records: list, fmt: str, content_type: str, source: str, cache: bool = True, vectors: bool = True) -> dict:
+    results, dropped = normalize(records, fmt, content_type)
+    stats = {"records": len(records), "dropped": dropped, "cached": 0, "embedded": 0}
+    catalog.upsert_many(content_type, results, source=source)
+    if cache and results:
+        counts = run_sync(run_with_client(write_cache, content_type, results=results))
+        stats["cached"] = counts["metadata"]["written"]
+    # cohere rejects empty texts, titles without a description get no vector
+    described = [result for result in results if result["description"]]
+    if vectors and described:
+        store_embeddings(
+            [content_type] * len(described),
+            [result["title"] for result in described],
+            [result["description"] for result in described],
+        )
+        stats["embedded"] = len(described)
+    return stats
+
+
+def ingest_indexed_chunk(index: int, records: list, fmt: str, content_type: str, source: str,
+                         cache: bool = True, vectors: bool = True):
+    """Ingest chunk number index and mark it done, runs in a worker process. Returns its stats, None if it failed."""
+    try:
+        stats = ingest_chunk(records, fmt, content_type, source, cache, vectors)
+    except Exception as e:
+        # left unmarked, the next run retries it
+        print(f"Error ingesting chunk {index}: {e}")
+        return None
+    catalog.mark_chunk_done(source, index, len(records))
+    print(f"[pid {os.getpid()}] chunk {index}: {stats}")
+    return stats
+
+
+def source_id(path: str, fmt: str, content_type: str, chunk_size: int) -> str:
+    # chunk numbers only mean something for the same file, format and chunk size
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}:{fmt}:{content_type}:{chunk_size}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def ingest(path: str, fmt: str, content_type: str = None, workers: int = 1, chunk_size: int = INGEST_CHUNK_SIZE,
+           cache: bool = True, vectors: bool = True, restart: bool = False) -> dict:
+    if fmt not in FORMATS:
+        raise ValueError(f"Format '{fmt}' is not supported.")
+    content_type = FORMATS[fmt][0] or content_type
+    if content_type not in ("anime", "movie", "series"):
+        raise ValueError(f"--content-type is required for {fmt} dumps (anime, movie or series).")
+    source = source_id(path, fmt, content_type, chunk_size)
+    if restart:
+        catalog.reset_source(source)
+
+    done = catalog.done_chunks(source)
+    totals = {"chunks": 0, "resumed": 0, "records": 0, "dropped": 0, "cached": 0, "embedded": 0}
+
+    def add(stats):
+        if stats is not None:
+            totals["chunks"] += 1
+            for key in ("records", "dropped", "cached", "embedded"):
+                totals[key] += stats[key]
+
+    chunks = enumerate(iter_chunks(path, fmt, chunk_size))
+    if workers <= 1:
+        for index, records in chunks:
+            if index in done:
+                totals["resumed"] += 1
+                continue
+            add(ingest_indexed_chunk(index, records, fmt, content_type, source, cache, vectors))
+        return totals
+
+    # the dump is parsed here once, workers only normalize and write
+    # spawn, the parent may already hold sqlite connections or a loop thread
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = set()
+        for index, records in chunks:
+            if index in done:
+                totals["resumed"] += 1
+                continue
+            if len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    add(future.result())
+            pending.add(pool.submit(ingest_indexed_chunk, index, records, fmt, content_type, source, cache, vectors))
+        for future in pending:
+            add(future.result())
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load a provider dump into the catalog, metadata cache and vector store.")
+    parser.add_argument("path")
+    parser.add_argument("--format", required=True, choices=sorted(FORMATS))
+    parser.add_argument("--content-type", choices=["anime", "movie", "series"])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    parser.add_argument("--skip-cache", action="store_true", help="don't write the redis metadata cache")
+    parser.add_argument("--skip-vectors", action="store_true", help="don't embed or write the vector store")
+    parser.add_argument("--restart", action="store_true", help="forget finished chunks and ingest everything again")
+    args = parser.parse_args()
+
+    start = perf_counter()
+    totals = ingest(args.path, args.format, args.content_type, args.workers, args.chunk_size,
+                    cache=not args.skip_cache, vectors=not args.skip_vectors, restart=args.restart)
+    print(f"{totals} in {perf_counter() - start:.1f}s, catalog has {catalog.count()} titles")
@@ -1,16 +1,69 @@
 from abc import ABC, abstractmethod
 import cohere
 import os
+import json
 import asyncio
-from random import randint
+from collections import deque
+from random import randint, uniform
+from time import perf_counter
+import numpy as np
 from dotenv import load_dotenv
 from app.redis import get_titles, redis_client
+from app.runner import run_sync
+from app.metrics import traced, record_cache, llm_retries, llm_hedges, llm_cancelled
+from app.prompt_cache import prompt_cache, PROMPT_CACHE_ENABLED
+from app.recommend import get_embeddings
+from app.singleflight import SingleFlight
 load_dotenv()
+
+LLM_ADAPTIVE = os.getenv("LLM_ADAPTIVE", "1") == "1"
+LLM_TARGET_TITLES = int(os.getenv("LLM_TARGET_TITLES", 40))
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 90))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", 6))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.25))
+LLM_BACKOFF_CAP = float(os.getenv("LLM_BACKOFF_CAP", 4))
+LLM_SINGLEFLIGHT_TTL = float(os.getenv("LLM_SINGLEFLIGHT_TTL", 30))
+# the semantic prompt cache lookup (a prompt embed) runs alongside generation, bounded by
+# PROMPT_EMBED_TIMEOUT, and a hit cancels the LLM calls. PROMPT_CACHE_WAIT delays generation
+# by up to that many seconds for the lookup, fewer LLM calls started for hits, slower misses
+PROMPT_CACHE_WAIT = float(os.getenv("PROMPT_CACHE_WAIT", 0))
+PROMPT_EMBED_TIMEOUT = float(os.getenv("PROMPT_EMBED_TIMEOUT", 2))
 # idea for implementing comments + rating
 # good rating means find similar descriptions
 # comment is isolated from anime, use it as an additional way to match anime descritpions
 
 
+class LatencyTracker:
+    """Rolling window of successful call latencies, used to pick the hedge delay."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float, default: float) -> float:
+        if len(self.samples) < self.min_samples:
+            return default
+        return float(np.percentile(self.samples, q))
+
+
+llm_latency = LatencyTracker()
+# identical (prompt, content_type) requests arriving together share one fan-out
+generation_flight = SingleFlight(
+    "generate",
+    lock_ttl=LLM_SINGLEFLIGHT_TTL,
+    encode=lambda titles: json.dumps(sorted(titles)),
+    decode=lambda data: set(json.loads(data)),
+)
+
+
+def backoff_delay(attempt: int) -> float:
+    # full jitter, spreads retries out so parallel calls don't hit a rate limit in lockstep
+    return uniform(0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
 class LLMModel(ABC):
     
     def __init__(self, content_type):
@@ -41,6 +94,7 @@ class CohereModel(LLMModel):
         )
         retries = 5
         for i in range(retries):
+            start = perf_counter()
             try:
                 response = await self.client.chat(
                     message=message,
@@ -50,9 +104,13 @@ class CohereModel(LLMModel):
                     temperature=0.9,
                     p=0.9
                 )
+                llm_latency.record(perf_counter() - start)
                 return response.text.strip().lower()
             except Exception as e:
                 print(f'Error: {e}')
+                llm_retries.inc()
+                if i < retries - 1:
+                    await asyncio.sleep(backoff_delay(i))
         raise ValueError
             
         
@@ -67,22 +125,192 @@ class ModelHandler:
         else:
             raise ValueError(f"Model '{model_name}' is not supported.")
     
-    async def generate_multiple(self, prompt: str, n_calls: int = 10):
+    @staticmethod
+    def clean(result: str) -> set[str]:
+        return {title.strip().rstrip('!') for title in result.split('; ')}
+
+    @traced("llm_generate")
+    async def generate_multiple(self, prompt: str, n_calls: int = 10, adaptive: bool = LLM_ADAPTIVE, target_titles: int = LLM_TARGET_TITLES):
+        # cache hits don't need the single-flight lock
         async with redis_client() as r:
             cached_titles = await get_titles(r, prompt, self.content_type)
         if cached_titles:
             return cached_titles
+        key = f"{self.content_type}:{prompt.lower()}"
+        titles = await generation_flight.do(key, lambda: self._generate_multiple(prompt, n_calls, adaptive, target_titles))
+        # callers share the result, each gets its own copy to modify
+        return set(titles)
+
+    async def _generate_multiple(self, prompt: str, n_calls: int, adaptive: bool, target_titles: int):
+        lookup = None
+        if PROMPT_CACHE_ENABLED:
+            cached_titles, lookup = await self.start_similar_lookup(prompt)
+            if cached_titles:
+                return cached_titles
+
+        generation = asyncio.create_task(self.generate_titles(prompt, n_calls, adaptive, target_titles))
+        if lookup is not None:
+            await asyncio.wait({lookup, generation}, return_when=asyncio.FIRST_COMPLETED)
+            cached_titles = lookup.result()[1] if lookup.done() else None
+            if cached_titles:
+                generation.cancel()
+                return cached_titles
+        aggregated_results = await generation
+        self.remember_prompt(prompt, lookup, aggregated_results)
+        return aggregated_results
+
+    async def generate_titles(self, prompt: str, n_calls: int, adaptive: bool, target_titles: int) -> set[str]:
+        if adaptive:
+            return await self.generate_adaptive(prompt, n_calls, target_titles)
         coroutines = [self.model.generate(prompt) for _ in range(n_calls)]
         results = await asyncio.gather(*coroutines)
-        cleaned_results = [{title.strip().rstrip('!') for title in result.split('; ')} for result in results]
-        aggregated_results = set().union(*cleaned_results)
+        cleaned_results = [self.clean(result) for result in results]
+        return set().union(*cleaned_results)
+
+    async def start_similar_lookup(self, prompt: str):
+        """
+        Start get_similar_titles and wait up to PROMPT_CACHE_WAIT for it. Returns the cached
+        titles it found in that time, if any, and its task.
+        """
+        lookup = asyncio.create_task(self.get_similar_titles(prompt))
+        if PROMPT_CACHE_WAIT > 0:
+            await asyncio.wait({lookup}, timeout=PROMPT_CACHE_WAIT)
+        return (lookup.result()[1] if lookup.done() else None), lookup
+
+    def remember_prompt(self, prompt: str, lookup, titles: set):
+        """Match later prompts against this one, if its embedding was ready by the time its titles were."""
+        if lookup is None or not titles:
+            return
+        if not lookup.done():
+            lookup.cancel()
+            return
+        prompt_embedding = lookup.result()[0]
+        # the titles are written under this prompt by cache_titles once the request finishes
+        if prompt_embedding is not None:
+            prompt_cache.add(self.content_type, prompt.lower(), prompt_embedding)
+
+    async def get_similar_titles(self, prompt: str):
+        """Embed the prompt and reuse the titles cached for the nearest earlier prompt, if close enough."""
+        try:
+            prompt_embedding = (await asyncio.wait_for(asyncio.to_thread(get_embeddings, [prompt]), PROMPT_EMBED_TIMEOUT))[0]
+        except Exception as e:
+            print(f"Error embedding prompt: {e!r}")
+            return None, None
+        similar_prompt = prompt_cache.lookup(self.content_type, prompt_embedding)
+        cached_titles = None
+        if similar_prompt:
+            async with redis_client() as r:
+                cached_titles = await get_titles(r, similar_prompt, self.content_type)
+            if not cached_titles:
+                # expired or evicted in redis, stop matching against it
+                prompt_cache.remove(self.content_type, similar_prompt)
+        record_cache("titles_semantic", int(bool(cached_titles)), int(not cached_titles))
+        return prompt_embedding, cached_titles
+
+    async def generate_hedged(self, prompt: str, delay: float) -> str:
+        """One generate call, plus a backup started if it runs past delay. First success wins."""
+        tasks = {asyncio.create_task(self.model.generate(prompt))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                llm_hedges.inc()
+                tasks.add(asyncio.create_task(self.model.generate(prompt)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+                llm_cancelled.inc()
+
+    async def generate_adaptive(self, prompt: str, n_calls: int, target_titles: int) -> set[str]:
+        """
+        Fan out n_calls hedged calls and return as soon as the union of titles reaches
+        target_titles, cancelling whatever is still running. Failed calls are skipped.
+        """
+        aggregated_results = set()
+        async for titles in self.iter_adaptive(prompt, n_calls, target_titles):
+            aggregated_results |= titles
         return aggregated_results
-        
+
+    async def iter_adaptive(self, prompt: str, n_calls: int, target_titles: int):
+        """generate_adaptive as it goes: yields each finished call's titles."""
+        delay = llm_latency.percentile(LLM_HEDGE_PERCENTILE, LLM_HEDGE_DEFAULT_DELAY)
+        tasks = [asyncio.create_task(self.generate_hedged(prompt, delay)) for _ in range(n_calls)]
+        aggregated_results = set()
+        error = None
+        try:
+            for future in asyncio.as_completed(tasks):
+                try:
+                    result = await future
+                except Exception as e:
+                    error = e
+                    continue
+                titles = self.clean(result)
+                aggregated_results |= titles
+                yield titles
+                if len(aggregated_results) >= target_titles:
+                    break
+        finally:
+            # generate_hedged counts the model calls this cancels
+            for task in tasks:
+                task.cancel()
+        if not aggregated_results and error is not None:
+            raise error
+
+    async def iter_generate(self, prompt: str, n_calls: int = 10, target_titles: int = LLM_TARGET_TITLES):
+        """
+        Streaming form of generate_multiple: yields sets of titles not seen before, one per
+        finished LLM call, so validation can start on the first call's titles. Cached titles
+        come as one set. Not coalesced with identical requests, each stream runs its own calls.
+        """
+        async with redis_client() as r:
+            cached_titles = await get_titles(r, prompt, self.content_type)
+        if cached_titles:
+            yield set(cached_titles)
+            return
+
+        lookup = None
+        if PROMPT_CACHE_ENABLED:
+            cached_titles, lookup = await self.start_similar_lookup(prompt)
+            if cached_titles:
+                yield set(cached_titles)
+                return
+
+        aggregated_results = set()
+        stream = self.iter_adaptive(prompt, n_calls, target_titles)
+        try:
+            async for titles in stream:
+                cached_titles = lookup.result()[1] if not aggregated_results and lookup is not None and lookup.done() else None
+                if cached_titles:
+                    # the semantic cache answered before the first call did, closing the stream cancels the rest
+                    yield set(cached_titles)
+                    return
+                new_titles = titles - aggregated_results
+                aggregated_results |= titles
+                if new_titles:
+                    yield new_titles
+        finally:
+            await stream.aclose()
+        self.remember_prompt(prompt, lookup, aggregated_results)
+
+
 def generate(prompt: str, content_type: str, model_name: str = 'cohere'):
     model = ModelHandler(model_name, content_type)
-    result = asyncio.run(model.generate_multiple(prompt))
+    result = run_sync(model.generate_multiple(prompt))
     return result
 
+
+def generate_stream(prompt: str, content_type: str, model_name: str = 'cohere'):
+    """Async iterator over title sets from ModelHandler.iter_generate, for the runner loop."""
+    model = ModelHandler(model_name, content_type)
+    return model.iter_generate(prompt)
+
 # ✅ Example usage
 if __name__ == "__main__":
     
@@ -0,0 +1,97 @@
+import os
+import threading
+from time import monotonic
+from collections import OrderedDict
+from dotenv import load_dotenv
+from app.metrics import Gauge
+load_dotenv()
+
+# in-process tier in front of redis for hot metadata and prompt titles, per worker.
+# entries are keyed by their redis key, bounded by an estimate of their size in bytes,
+# and invalidated across workers through redis pub/sub (see app.redis)
+LOCAL_CACHE_ENABLED = os.getenv("LOCAL_CACHE_ENABLED", "1") == "1"
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", 300))
+LOCAL_CACHE_NEGATIVE_TTL = float(os.getenv("LOCAL_CACHE_NEGATIVE_TTL", 30))
+
+MISSING = object()
+
+
+def approx_size(value) -> int:
+    """Rough payload size in bytes, enough to keep the cache within its budget."""
+    if isinstance(value, (str, bytes)):
+        return len(value) + 48
+    if isinstance(value, dict):
+        return 64 + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return 56 + sum(approx_size(item) for item in value)
+    return 32
+
+
+class LocalCache:
+
+    def __init__(self, max_bytes: int = LOCAL_CACHE_MAX_BYTES, ttl: float = LOCAL_CACHE_TTL, negative_ttl: float = LOCAL_CACHE_NEGATIVE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()  # key -> (expires, size, value or MISSING)
+        self.bytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """(True, value) on a hit, value None for a cached miss, (False, None) otherwise."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < monotonic():
+                self._pop(key)
+                return False, None
+            self.entries.move_to_end(key)
+            return True, None if entry[2] is MISSING else entry[2]
+
+    def set(self, key: str, value):
+        """Cache value, None caches a miss for the shorter negative TTL."""
+        if value is None:
+            ttl, value, size = self.negative_ttl, MISSING, approx_size(key) + 64
+        else:
+            ttl, size = self.ttl, approx_size(key) + approx_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self.entries[key] = (monotonic() + ttl, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._pop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        with self._lock:
+            for key in keys:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _pop(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+
+local_cache = LocalCache()
+
+Gauge(
+    "shows5u_local_cache",
+    "In-process cache tier: entries, bytes, max_bytes and evictions since start.",
+    lambda: {(("stat", k),): v for k, v in local_cache.metrics().items()},
+)
@@ -0,0 +1,167 @@
+import asyncio
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+from contextlib import contextmanager
+
+# minimal in-process Prometheus metrics, per worker process
+# recording is a perf_counter pair, a bisect and a dict update under an uncontended lock
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with _lock:
+            items = list(self.values.items())
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in items]
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.values = {}  # label key -> [bucket counts..., +Inf count, sum]
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        i = bisect_left(self.buckets, value)
+        with _lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 2)
+            state[i] += 1
+            state[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            items = [(key, list(state)) for key, state in self.values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {state[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time from a callback returning {label tuple or None: value}."""
+
+    def __init__(self, name: str, documentation: str, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Error reading gauge {self.name}: {e}")
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in values.items()]
+        return lines
+
+
+stage_seconds = Histogram("shows5u_stage_seconds", "Time spent per pipeline stage.")
+stage_errors = Counter("shows5u_stage_errors_total", "Exceptions raised per pipeline stage.")
+cache_lookups = Counter("shows5u_cache_lookups_total", "Cache lookups by cache and result.")
+cache_writes = Counter("shows5u_cache_writes_total", "Cache entries written or skipped because they already existed, by cache.")
+provider_errors = Counter("shows5u_provider_errors_total", "Metadata provider responses that were not 200, by provider and status.")
+llm_retries = Counter("shows5u_llm_retries_total", "Retried LLM generate calls.")
+llm_hedges = Counter("shows5u_llm_hedges_total", "Backup LLM calls started because a call ran past the hedge delay.")
+llm_cancelled = Counter("shows5u_llm_cancelled_total", "LLM calls cancelled after the title target was reached or a hedge won.")
+
+
+@contextmanager
+def span(stage: str, **labels):
+    start = perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=stage, **labels)
+        raise
+    finally:
+        stage_seconds.observe(perf_counter() - start, stage=stage, **labels)
+
+
+def traced(stage: str, **labels):
+    """Decorator form of span, works on plain and async functions."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage, **labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_cache(cache: str, hits: int, misses: int):
+    if hits:
+        cache_lookups.inc(hits, cache=cache, result="hit")
+    if misses:
+        cache_lookups.inc(misses, cache=cache, result="miss")
+
+
+def record_write(cache: str, written: int, skipped: int):
+    if written:
+        cache_writes.inc(written, cache=cache, result="written")
+    if skipped:
+        cache_writes.inc(skipped, cache=cache, result="skipped")
+
+
+def record_status(provider: str, status: int):
+    if status != 200:
+        provider_errors.inc(provider=provider, status=status)
+
+
+def render() -> str:
+    lines = []
+    for metric in list(_registry):
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,83 @@
+import os
+import threading
+from dotenv import load_dotenv
+from app.metrics import Gauge
+load_dotenv()
+
+# titles that failed validation (hallucinated, filtered out, or unknown to every provider)
+# are remembered in redis for a short while so they aren't looked up again on the next
+# request, by any worker. a request checks all of its uncached titles in one mget
+NEGATIVE_CACHE_ENABLED = os.getenv("NEGATIVE_CACHE_ENABLED", "1") == "1"
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", 60 * 60 * 6))
+
+
+class NegativeCache:
+
+    def __init__(self, ttl: int = NEGATIVE_CACHE_TTL, prefix: str = "miss"):
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.skipped = 0
+        self.provider_calls_saved = 0
+        self.errors = 0
+
+    def key(self, content_type: str, title: str) -> str:
+        return f"{self.prefix}:{content_type}:{title.lower()}"
+
+    async def known_misses(self, r, content_type: str, titles) -> set[str]:
+        """Titles with a live miss entry."""
+        titles = list(titles)
+        if not titles:
+            return set()
+        try:
+            values = await r.mget([self.key(content_type, title) for title in titles])
+        except Exception as e:
+            print(f"Error reading negative cache: {e}")
+            values = [None] * len(titles)
+            with self._lock:
+                self.errors += 1
+        misses = set()
+        saved = 0
+        for title, value in zip(titles, values):
+            if value is not None:
+                misses.add(title)
+                saved += int(value)
+        with self._lock:
+            self.checks += len(titles)
+            self.skipped += len(misses)
+            self.provider_calls_saved += saved
+        return misses
+
+    async def add(self, r, content_type: str, misses: list[tuple[str, int]]):
+        """Record (title, provider calls spent on it) pairs as misses."""
+        if not misses:
+            return
+        try:
+            async with r.pipeline(transaction=False) as pipe:
+                for title, calls in misses:
+                    pipe.set(self.key(content_type, title), calls, ex=self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            print(f"Error writing negative cache: {e}")
+            with self._lock:
+                self.errors += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "checks": self.checks,
+                "skipped": self.skipped,
+                "hit_rate": self.skipped / self.checks if self.checks else 0.0,
+                "provider_calls_saved": self.provider_calls_saved,
+                "errors": self.errors,
+            }
+
+
+negative_cache = NegativeCache()
+
+Gauge(
+    "shows5u_negative_cache",
+    "Negative validation cache checks, skipped titles, hit rate and provider calls saved since start.",
+    lambda: {(("stat", k),): v for k, v in negative_cache.metrics().items()},
+)
@@ -0,0 +1,123 @@
+import os
+import atexit
+import asyncio
+import threading
+from dotenv import load_dotenv
+from flask import current_app
+from app.crud import popular_values, upsert_popular_counts, upsert_popular_recommendations
+from app.runner import get_runner, run_in_background, SERVERLESS
+from app.metrics import Counter, Gauge
+load_dotenv()
+
+# /respond counts recommended titles here instead of upserting them per request. counts are
+# summed per (title, content_type) and written as one upsert every POPULAR_FLUSH_INTERVAL
+# seconds, so a popular title's row is locked once per interval and worker, not per request.
+# serverless processes can be frozen before the next flush, there each request upserts its own
+POPULAR_BUFFER_ENABLED = os.getenv("POPULAR_BUFFER_ENABLED", "1") == "1"
+POPULAR_FLUSH_INTERVAL = float(os.getenv("POPULAR_FLUSH_INTERVAL", 10))
+POPULAR_BUFFER_MAX_KEYS = int(os.getenv("POPULAR_BUFFER_MAX_KEYS", 1000))  # flush early past this many titles
+
+popular_flushes = Counter("shows5u_popular_flushes_total", "Buffered popular recommendation flushes, by result.")
+
+
+class PopularBuffer:
+    """Pending popular_recommendations rows keyed by (title, content_type), with summed counts."""
+
+    def __init__(self):
+        self.rows = {}
+        self.app = None  # flushes run outside a request, in this app's context
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _merge(self, values: list):
+        # caller holds _lock. the latest image, url and genres win, like the per request upsert
+        for value in values:
+            key = (value["title"], value["content_type"])
+            row = self.rows.get(key)
+            if row is None:
+                self.rows[key] = dict(value)
+            else:
+                count = row["recommendation_count"] + value["recommendation_count"]
+                latest = max(row["last_recommended"], value["last_recommended"])
+                row.update(value, recommendation_count=count, last_recommended=latest)
+
+    def add(self, content_type: str, entries: list) -> bool:
+        """Count entries once each, returns True when the buffer should be flushed early."""
+        values = popular_values(content_type, entries)
+        with self._lock:
+            self._merge(values)
+            return len(self.rows) >= POPULAR_BUFFER_MAX_KEYS
+
+    def flush(self, wait: bool = True) -> int:
+        """Write the summed counts, returns the number of rows written. Failed rows go back into the buffer."""
+        if self.app is None or not self._flush_lock.acquire(blocking=wait):
+            return 0
+        try:
+            with self._lock:
+                rows, self.rows = self.rows, {}
+            if not rows:
+                return 0
+            # same order in every worker, so concurrent flushes lock rows in the same order
+            values = [rows[key] for key in sorted(rows)]
+            try:
+                with self.app.app_context():
+                    upsert_popular_counts(values)
+            except Exception as e:
+                print(f"Error flushing {len(values)} popular recommendation counts: {e}")
+                popular_flushes.inc(result="failed")
+                with self._lock:
+                    self._merge(values)
+                return 0
+            popular_flushes.inc(result="written")
+            return len(values)
+        finally:
+            self._flush_lock.release()
+
+
+popular_buffer = PopularBuffer()
+
+_started_pid = None
+
+
+async def run_flush():
+    # the database session is blocking
+    await asyncio.to_thread(popular_buffer.flush, False)
+
+
+def _flush_at_exit():
+    try:
+        popular_buffer.flush()
+    except Exception as e:
+        print(f"Error flushing popular recommendation counts at exit: {e}")
+
+
+def ensure_flush_job():
+    """Schedule run_flush on this process's runner, once per process, safe to call per request."""
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    _started_pid = os.getpid()
+    get_runner().call_every(POPULAR_FLUSH_INTERVAL, run_flush)
+    # registered after the runner's own atexit hook, so it runs first
+    atexit.register(_flush_at_exit)
+
+
+def record_popular(content_type: str, entries: list):
+    """Count a /respond's recommended titles towards /trending."""
+    if not POPULAR_BUFFER_ENABLED or SERVERLESS:
+        upsert_popular_recommendations(content_type, entries)
+        return
+    popular_buffer.app = current_app._get_current_object()
+    ensure_flush_job()
+    if popular_buffer.add(content_type, entries):
+        run_in_background(run_flush())
+
+
+Gauge(
+    "shows5u_popular_buffer_titles",
+    "Titles with popular recommendation counts waiting to be flushed.",
+    lambda: len(popular_buffer),
+)
@@ -0,0 +1,258 @@
+import io
+import os
+import json
+import numpy as np
+from dotenv import load_dotenv
+from app.crud import get_user_recommendations
+from app.models import UserRecommendation
+from app.utils import embedding_id, split_genres
+from app.vector_store import get_vector_store, EMBEDDING_DIMENSION
+from app.embed_cache import DiskEmbeddingStore, RedisEmbeddingStore
+load_dotenv()
+
+# per (user, content_type) ranking inputs, kept up to date by /preference so /respond
+# doesn't re-read every rated title's vector and re-normalize it on each call.
+# "disk" is a file under /tmp on one host: on multi host deployments other hosts keep
+# ranking with the profile they stored until it expires. "redis" shares them, but a
+# profile holds a full float32 row per rated title (16KB each), outside the cache:* keys
+# eviction budgets for, so it is only bounded by PROFILE_TTL
+PROFILE_STORE = os.getenv("PROFILE_STORE", "disk")  # "disk", "redis" or "none"
+PROFILE_STORE_PATH = os.getenv("PROFILE_STORE_PATH", "/tmp/shows5u_profiles.sqlite3")
+PROFILE_TTL = int(os.getenv("PROFILE_TTL", 60 * 60 * 24 * 30))
+PROFILE_MAX_ENTRIES = int(os.getenv("PROFILE_MAX_ENTRIES", 5000))
+PROFILE_WRITE_RETRIES = int(os.getenv("PROFILE_WRITE_RETRIES", 5))  # redis write attempts before the profile is dropped
+
+
+def l2_normalize(matrix) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+class PreferenceProfile:
+    """
+    Row i of every array describes the user's i-th rated title:
+    embeddings (P, D) L2-normalized, ratings (P,), genre_matrix (P, G) multi-hot over genres.
+    Rows without a stored embedding are zero and masked out by has_embedding.
+    """
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION):
+        self.version = 0
+        self.titles = []
+        self.genres = []
+        self.seen = np.zeros(0, dtype=bool)
+        self.ratings = np.zeros(0, dtype=np.float32)
+        self.embeddings = np.zeros((0, dimension), dtype=np.float32)
+        self.has_embedding = np.zeros(0, dtype=bool)
+        self.genre_matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @property
+    def vocabulary(self) -> dict[str, int]:
+        return {genre: i for i, genre in enumerate(self.genres)}
+
+    def seen_titles(self) -> set[str]:
+        return {title for title, seen in zip(self.titles, self.seen) if seen}
+
+    def index_of(self, title: str):
+        title = title.lower()
+        for i, existing in enumerate(self.titles):
+            if existing.lower() == title:
+                return i
+        return None
+
+    def _genre_row(self, genres) -> np.ndarray:
+        for genre in split_genres(genres):
+            if genre not in self.genres:
+                self.genres.append(genre)
+                self.genre_matrix = np.pad(self.genre_matrix, ((0, 0), (0, 1)))
+        row = np.zeros(len(self.genres), dtype=np.float32)
+        vocabulary = self.vocabulary
+        for genre in split_genres(genres):
+            row[vocabulary[genre]] = 1
+        return row
+
+    def upsert(self, title: str, rating: float, genres=None, seen: bool = None, embedding=None):
+        """Mirror crud.upsert_user_recommendation: existing rows only take truthy rating/seen, genres are kept."""
+        i = self.index_of(title)
+        if i is None:
+            genre_row = self._genre_row(genres)
+            self.titles.append(title)
+            self.seen = np.append(self.seen, bool(seen))
+            self.ratings = np.append(self.ratings, np.float32(rating))
+            self.genre_matrix = np.vstack([self.genre_matrix, genre_row[None, :]])
+            self.embeddings = np.vstack([self.embeddings, np.zeros((1, self.embeddings.shape[1]), dtype=np.float32)])
+            self.has_embedding = np.append(self.has_embedding, False)
+            i = len(self.titles) - 1
+        else:
+            if rating:
+                self.ratings[i] = rating
+            if seen:
+                self.seen[i] = True
+        if embedding is not None:
+            self.embeddings[i] = l2_normalize(embedding)
+            self.has_embedding[i] = bool(self.embeddings[i].any())
+        self.version += 1
+
+    def remove(self, title: str) -> bool:
+        i = self.index_of(title)
+        if i is None:
+            return False
+        del self.titles[i]
+        self.seen = np.delete(self.seen, i)
+        self.ratings = np.delete(self.ratings, i)
+        self.genre_matrix = np.delete(self.genre_matrix, i, axis=0)
+        self.embeddings = np.delete(self.embeddings, i, axis=0)
+        self.has_embedding = np.delete(self.has_embedding, i)
+        self.version += 1
+        return True
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        meta = json.dumps({"version": self.version, "titles": self.titles, "genres": self.genres})
+        np.savez(
+            buffer,
+            meta=np.frombuffer(meta.encode("utf-8"), dtype=np.uint8),
+            seen=self.seen,
+            ratings=self.ratings,
+            embeddings=self.embeddings,
+            has_embedding=self.has_embedding,
+            genre_matrix=self.genre_matrix,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "PreferenceProfile":
+        arrays = np.load(io.BytesIO(blob))
+        meta = json.loads(arrays["meta"].tobytes().decode("utf-8"))
+        profile = cls(dimension=arrays["embeddings"].shape[1])
+        profile.version = meta["version"]
+        profile.titles = meta["titles"]
+        profile.genres = meta["genres"]
+        for name in ("seen", "ratings", "embeddings", "has_embedding", "genre_matrix"):
+            setattr(profile, name, arrays[name])
+        return profile
+
+
+def build_profile(user_id: str, content_type: str) -> PreferenceProfile:
+    """Full rebuild from the database and the vector store, only needed when no profile is stored."""
+    rows = get_user_recommendations(user_id, content_type, cols=(UserRecommendation.title, UserRecommendation.rating, UserRecommendation.content_type, UserRecommendation.seen, UserRecommendation.genres))
+    vectors = get_vector_store().fetch([embedding_id(row.content_type, row.title) for row in rows]) if rows else {}
+    profile = PreferenceProfile()
+    for row in rows:
+        profile.upsert(row.title, row.rating, row.genres, row.seen, vectors.get(embedding_id(row.content_type, row.title)))
+    return profile
+
+
+def create_profile_store(backend: str = PROFILE_STORE):
+    # same byte stores as the embedding cache, under their own file / prefix
+    if backend == "redis":
+        return RedisEmbeddingStore(prefix="profile", ttl=PROFILE_TTL, write_attempts=PROFILE_WRITE_RETRIES)
+    if backend == "disk":
+        return DiskEmbeddingStore(path=PROFILE_STORE_PATH, ttl=PROFILE_TTL, max_entries=PROFILE_MAX_ENTRIES)
+    return None
+
+
+profile_store = create_profile_store()
+
+
+def profile_key(user_id: str, content_type: str) -> str:
+    return f"{content_type}:{user_id}"
+
+
+def load_profile(user_id: str, content_type: str):
+    if profile_store is None:
+        return None
+    key = profile_key(user_id, content_type)
+    try:
+        blob = profile_store.get_many([key]).get(key)
+        return PreferenceProfile.from_bytes(blob) if blob else None
+    except Exception as e:
+        print(f"Error loading profile {key}: {e}")
+        return None
+
+
+def add_profile(user_id: str, content_type: str, profile: PreferenceProfile):
+    """Store a freshly built profile, unless another request stored one first."""
+    if profile_store is None:
+        return
+    key = profile_key(user_id, content_type)
+    blob = profile.to_bytes()
+    try:
+        profile_store.update(key, lambda stored: None if stored else blob)
+    except Exception as e:
+        print(f"Error saving profile {key}: {e}")
+
+
+def modify_profile(user_id: str, content_type: str, change):
+    """
+    Apply change(profile) -> bool (whether it changed anything) to the stored profile.
+    The read and write are one store transaction, so concurrent writers don't overwrite
+    each other's changes. If it keeps conflicting the profile is dropped and get_profile
+    rebuilds it from the database.
+    """
+    if profile_store is None:
+        return
+
+    def apply(blob):
+        if not blob:
+            return None
+        profile = PreferenceProfile.from_bytes(blob)
+        return profile.to_bytes() if change(profile) else None
+
+    key = profile_key(user_id, content_type)
+    try:
+        if profile_store.update(key, apply):
+            return
+        print(f"Dropping profile {key} after {PROFILE_WRITE_RETRIES} conflicting writes")
+    except Exception as e:
+        print(f"Error updating profile {key}: {e}")
+    try:
+        profile_store.delete_many([key])
+    except Exception as e:
+        print(f"Error dropping profile {key}: {e}")
+
+
+def get_profile(user_id: str, content_type: str) -> PreferenceProfile:
+    profile = load_profile(user_id, content_type)
+    if profile is None:
+        profile = build_profile(user_id, content_type)
+        add_profile(user_id, content_type, profile)
+    return profile
+
+
+def update_profile(user_id: str, content_type: str, changes: list, vectors: dict = None):
+    """
+    Apply /preference changes, (title, rating, genres, seen) with a falsy rating for a
+    removal, in order and in one write. vectors holds stored embeddings by embedding_id.
+    A user without a stored profile is left alone, get_profile builds it from the database
+    on their next /respond.
+    """
+    vectors = vectors or {}
+
+    def change(profile: PreferenceProfile) -> bool:
+        changed = False
+        for title, rating, genres, seen in changes:
+            if rating:
+                profile.upsert(title, rating, genres, seen, vectors.get(embedding_id(content_type, title)))
+                changed = True
+            else:
+                changed = profile.remove(title) or changed
+        return changed
+
+    modify_profile(user_id, content_type, change)
+
+
+def set_profile_embedding(user_id: str, content_type: str, title: str, embedding):
+    """Fill in the embedding of a title rated before its vector was stored."""
+    if embedding is None:
+        return
+
+    def change(profile: PreferenceProfile) -> bool:
+        i = profile.index_of(title)
+        if i is None or profile.has_embedding[i]:
+            return False
+        profile.upsert(title, None, embedding=embedding)
+        return True
+
+    modify_profile(user_id, content_type, change)
+
@@ -0,0 +1,96 @@
+import os
+import threading
+from time import time
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+# maps a new prompt to a previously answered one ("like solo leveling" ~ "shows like Solo Leveling!")
+# so its cached title set can be reused; titles themselves stay in redis under the matched prompt
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "1") == "1"
+PROMPT_CACHE_THRESHOLD = float(os.getenv("PROMPT_CACHE_THRESHOLD", 0.92))
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", 60 * 60 * 24 * 7))  # same as cache_titles
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", 256))  # 4MB per content type at 4096 dims
+
+
+class PromptIndex:
+    """Fixed-size matrix of normalized prompt embeddings for one content type."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.matrix = None
+        self.prompts = [None] * max_entries
+        self.expires = np.zeros(max_entries)
+        self.accessed = np.zeros(max_entries)
+
+    def nearest(self, vector: np.ndarray, now: float):
+        if self.matrix is None:
+            return None, 0.0
+        live = self.expires > now
+        if not live.any():
+            return None, 0.0
+        similarities = np.where(live, self.matrix @ vector, -np.inf)
+        i = int(np.argmax(similarities))
+        return i, float(similarities[i])
+
+    def add(self, prompt: str, vector: np.ndarray, now: float, ttl: int):
+        if self.matrix is None:
+            self.matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+        if prompt in self.prompts:
+            i = self.prompts.index(prompt)
+        else:
+            # expired slots first (expires 0 for never used), then least recently used
+            expired = np.flatnonzero(self.expires <= now)
+            i = int(expired[0]) if len(expired) else int(np.argmin(self.accessed))
+        self.matrix[i] = vector
+        self.prompts[i] = prompt
+        self.expires[i] = now + ttl
+        self.accessed[i] = now
+
+    def remove(self, prompt: str):
+        if prompt in self.prompts:
+            i = self.prompts.index(prompt)
+            self.prompts[i] = None
+            self.expires[i] = 0
+
+
+class SemanticPromptCache:
+
+    def __init__(self, threshold: float = PROMPT_CACHE_THRESHOLD, ttl: int = PROMPT_CACHE_TTL, max_entries: int = PROMPT_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.indexes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, content_type: str, vector) -> str:
+        """Return the closest cached prompt at or above the threshold, else None."""
+        with self._lock:
+            index = self.indexes.get(content_type)
+            if index is None:
+                return None
+            now = time()
+            i, similarity = index.nearest(self.normalize(vector), now)
+            if i is None or similarity < self.threshold:
+                return None
+            index.accessed[i] = now
+            return index.prompts[i]
+
+    def add(self, content_type: str, prompt: str, vector):
+        with self._lock:
+            index = self.indexes.setdefault(content_type, PromptIndex(self.max_entries))
+            index.add(prompt, self.normalize(vector), time(), self.ttl)
+
+    def remove(self, content_type: str, prompt: str):
+        with self._lock:
+            if content_type in self.indexes:
+                self.indexes[content_type].remove(prompt)
+
+
+prompt_cache = SemanticPromptCache()
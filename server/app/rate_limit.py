@@ -0,0 +1,212 @@
+import os
+import asyncio
+import hashlib
+from time import monotonic, perf_counter
+from redis.exceptions import NoScriptError
+from dotenv import load_dotenv
+from app.redis import redis_client
+from app.metrics import Counter, Histogram
+load_dotenv()
+
+# outbound token buckets per metadata provider, shared by every worker through redis.
+# each worker leases a few tokens at a time and hands them out locally, so most calls
+# cost no round trip, and gives back the ones it didn't use when the lease expires;
+# callers wait for a token up to a deadline instead of getting a 429
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# "requests/seconds", refilled at requests/seconds per second
+RATE_LIMITS = {
+    "jikan": os.getenv("RATE_LIMIT_JIKAN", "3/1"),
+    "anilist": os.getenv("RATE_LIMIT_ANILIST", "90/60"),
+    "kitsu": os.getenv("RATE_LIMIT_KITSU", "10/1"),
+    "find_my_anime": os.getenv("RATE_LIMIT_FIND_MY_ANIME", "5/1"),
+    "omdb": os.getenv("RATE_LIMIT_OMDB", "10/1"),
+    "tmdb": os.getenv("RATE_LIMIT_TMDB", "40/1"),
+}
+# bucket size as a share of requests. a full period's worth lets a burst after an idle period
+# plus the refill exceed a sliding window limit, smaller bursts keep closer to the published rate
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", 0.5))
+RATE_LIMIT_DEADLINE = float(os.getenv("RATE_LIMIT_DEADLINE", 2.0))  # seconds a call may wait for a token
+RATE_LIMIT_LEASE = float(os.getenv("RATE_LIMIT_LEASE", 0.1))  # share of the bucket a worker leases at once
+RATE_LIMIT_LEASE_TTL = float(os.getenv("RATE_LIMIT_LEASE_TTL", 1.0))  # unused leased tokens are returned after this
+
+# refill, take back ARGV[4] unused leased tokens, then grant up to ARGV[3] whole tokens,
+# or none and the seconds until one is available
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local returned = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate + returned)
+local granted = math.min(requested, math.floor(tokens))
+local wait = 0
+if requested > 0 and granted < 1 then
+    granted = 0
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - granted), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {granted, tostring(wait)}
+"""
+TOKEN_BUCKET_SCRIPT_SHA = hashlib.sha1(TOKEN_BUCKET_SCRIPT.encode()).hexdigest()
+
+rate_limit_waits = Histogram("shows5u_rate_limit_wait_seconds", "Time provider calls waited for a rate limit token, by provider.")
+rate_limit_tokens = Counter("shows5u_rate_limit_tokens_total", "Rate limit tokens by provider and source: local, leased, timeout, unlimited or returned (leased, unused).")
+
+
+class RateLimitTimeout(Exception):
+    """No token became available before the call's deadline."""
+
+
+def parse_limit(limit: str):
+    """(tokens per second, bucket size) for a "requests/seconds" limit."""
+    requests, seconds = limit.split("/")
+    return float(requests) / float(seconds), max(1.0, float(requests) * RATE_LIMIT_BURST)
+
+
+class LocalBucket:
+    """Tokens this worker leased from the shared bucket, or the whole bucket when redis is unavailable."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.leased = 0
+        self.lease_expires = 0.0
+        self.lock = None
+        # fallback bucket, used only while redis can't be reached
+        self.tokens = capacity
+        self.refilled = monotonic()
+
+    def take_leased(self) -> bool:
+        if self.leased and monotonic() < self.lease_expires:
+            self.leased -= 1
+            return True
+        return False
+
+    def expired(self) -> int:
+        """Take the unused tokens of an expired lease, to give back to the shared bucket."""
+        if monotonic() < self.lease_expires:
+            return 0
+        unused, self.leased = self.leased, 0
+        return unused
+
+    def take_fallback(self):
+        """None when a token was taken, else the seconds until the next one."""
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+
+    def __init__(self, limits: dict = RATE_LIMITS, prefix: str = "ratelimit"):
+        self.limits = {name: parse_limit(limit) for name, limit in limits.items() if limit}
+        self.prefix = prefix
+        self.buckets = {}
+        self.returns = set()  # pending lease returns, so they aren't garbage collected
+
+    def _bucket(self, provider: str) -> LocalBucket:
+        bucket = self.buckets.get(provider)
+        if bucket is None:
+            bucket = self.buckets[provider] = LocalBucket(*self.limits[provider])
+        return bucket
+
+    async def _call(self, provider: str, bucket: LocalBucket, requested: int, returned: int):
+        args = (1, f"{self.prefix}:{provider}", bucket.rate, bucket.capacity, requested, returned)
+        async with redis_client() as r:
+            try:
+                return await r.execute_command("EVALSHA", TOKEN_BUCKET_SCRIPT_SHA, *args)
+            except NoScriptError:
+                return await r.execute_command("EVAL", TOKEN_BUCKET_SCRIPT, *args)
+
+    async def _lease(self, provider: str, bucket: LocalBucket):
+        """Lease tokens from the shared bucket, returns the seconds to wait when none were granted."""
+        requested = max(1, int(bucket.capacity * RATE_LIMIT_LEASE))
+        # leftovers of an expired lease not returned yet go back in the same call
+        returned = bucket.expired()
+        try:
+            granted, wait = await self._call(provider, bucket, requested, returned)
+        except Exception as e:
+            # without redis each worker limits itself to the whole budget
+            print(f"Rate limiter falling back to a local bucket for {provider}: {e}")
+            return bucket.take_fallback()
+        if returned:
+            rate_limit_tokens.inc(returned, provider=provider, source="returned")
+        if int(granted):
+            # this call takes the first token, the rest are handed out locally
+            bucket.leased, bucket.lease_expires = int(granted) - 1, monotonic() + RATE_LIMIT_LEASE_TTL
+            if bucket.leased:
+                asyncio.get_running_loop().call_later(RATE_LIMIT_LEASE_TTL, self._schedule_return, provider, bucket)
+            return None
+        return float(wait)
+
+    def _schedule_return(self, provider: str, bucket: LocalBucket):
+        task = asyncio.ensure_future(self._return_lease(provider, bucket))
+        self.returns.add(task)
+        task.add_done_callback(self.returns.discard)
+
+    async def _return_lease(self, provider: str, bucket: LocalBucket):
+        """Give the unused tokens of an expired lease back to the shared bucket for the other workers."""
+        if bucket.lock is not None and bucket.lock.locked():
+            # a lease request is in flight and hands them back itself
+            return
+        returned = bucket.expired()
+        if not returned:
+            return
+        try:
+            await self._call(provider, bucket, 0, returned)
+        except Exception as e:
+            print(f"Error returning {returned} leased {provider} tokens: {e}")
+            return
+        rate_limit_tokens.inc(returned, provider=provider, source="returned")
+
+    async def acquire(self, provider: str, deadline: float = RATE_LIMIT_DEADLINE):
+        """Wait for one of provider's tokens, raises RateLimitTimeout after deadline seconds."""
+        if not RATE_LIMIT_ENABLED or provider not in self.limits:
+            rate_limit_tokens.inc(provider=provider, source="unlimited")
+            return
+        bucket = self._bucket(provider)
+        if bucket.take_leased():
+            rate_limit_tokens.inc(provider=provider, source="local")
+            rate_limit_waits.observe(0, provider=provider)
+            return
+        if bucket.lock is None:
+            bucket.lock = asyncio.Lock()
+        start = perf_counter()
+        give_up = start + deadline
+        source = "timeout"
+        # one lease request per worker and provider at a time, the rest queue behind it
+        try:
+            await asyncio.wait_for(bucket.lock.acquire(), deadline)
+        except asyncio.TimeoutError:
+            pass
+        else:
+            try:
+                while True:
+                    if bucket.take_leased():
+                        source = "local"
+                        break
+                    wait = await self._lease(provider, bucket)
+                    if wait is None:
+                        source = "leased"
+                        break
+                    if perf_counter() + wait > give_up:
+                        break
+                    await asyncio.sleep(wait)
+            finally:
+                bucket.lock.release()
+        rate_limit_tokens.inc(provider=provider, source=source)
+        rate_limit_waits.observe(perf_counter() - start, provider=provider)
+        if source == "timeout":
+            raise RateLimitTimeout(f"no {provider} token within {deadline}s")
+
+
+rate_limiter = RateLimiter()
@@ -4,57 +4,42 @@ from dotenv import load_dotenv
 import numpy as np
 from app.crud import *
 from app.models import UserRecommendation
-from pinecone import Pinecone, ServerlessSpec
-from app.utils import to_ascii_safe_id
+from app.utils import embedding_id, split_genres
+from app.embed_cache import embedding_cache
+from app.vector_store import get_vector_store
+from app.profile import PreferenceProfile, get_profile, l2_normalize
+from app.metrics import traced
 load_dotenv()
 # can later build model like transformer, takes in preferenes + ratings and current title and gives score
 # for training we use titles which also have user ranking associated to eval score
 # Initialize Cohere client
 
 
-# KEYWORDS FOR COMMENTS + GENRES
-def create_pinecone_index():
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-
-    index_name = 'embeddings'
-    embedding_dimension = 4096  
+co = cohere.Client(os.getenv('COHERE_API_KEY'))
 
-    if not pc.has_index(index_name):
-        pc.create_index(
-            name=index_name,
-            dimension=embedding_dimension,
-            metric='cosine', 
-            spec=ServerlessSpec(
-                cloud='aws',
-                region='us-east-1'
-            )
-        )
-    index = pc.Index(index_name)
-    return index
 
-co = cohere.Client(os.getenv('COHERE_API_KEY'))
-pc_index = create_pinecone_index()
+EMBED_MODEL = 'embed-english-v2.0'
 
 
-def get_embeddings(descriptions):
+def embed_texts(descriptions):
     response = co.embed(
         texts=descriptions,
-        model='embed-english-v2.0',
+        model=EMBED_MODEL,
         truncate='END'
     )
     return response.embeddings
 
+
+@traced("embed")
+def get_embeddings(descriptions):
+    # (N, D) float32, only descriptions missing from the cache reach Cohere
+    return embedding_cache.get_or_compute(descriptions, EMBED_MODEL, embed_texts)
+
 def store_embeddings(content_types: list[str], titles: list[str], descriptions: list[str]):
     embeddings = get_embeddings(descriptions)
-    vectors = [
-        {
-            "id": f"{content_types[i]}_{to_ascii_safe_id(titles[i])}",
-            "values": embeddings[i]
-        }
-        for i in range(len(embeddings))
-    ]
-
-    pc_index.upsert(vectors=vectors)
+    ids = [embedding_id(content_type, title) for content_type, title in zip(content_types, titles)]
+    get_vector_store().upsert(ids, embeddings)
+    return embeddings
 
 
 
@@ -80,45 +65,55 @@ def keyword_match_boost(pref_comments, rec_texts, boost=0.2):
 def retrieve_embeddings(items: list[tuple[str, str]]):
     if not items:
         return []
-    ids = [f"{content_type}_{to_ascii_safe_id(title)}" for title, content_type in items]
-    response = pc_index.fetch(ids=ids)
+    ids = [embedding_id(content_type, title) for title, content_type in items]
+    vectors = get_vector_store().fetch(ids)
     # need to add the if statement bc embeddings are added async, so if we just added one it won't be here
-    embeddings = [response.vectors[item_id].values for item_id in ids if item_id in response.vectors]
+    embeddings = [vectors[item_id] for item_id in ids if item_id in vectors]
     return embeddings
 
 
+def genre_multi_hot(genre_lists: list[list[str]], vocabulary: dict[str, int]) -> np.ndarray:
+    """(N, G) float32 matrix with a 1 for every genre of each row, genres outside the vocabulary are dropped."""
+    matrix = np.zeros((len(genre_lists), len(vocabulary)), dtype=np.float32)
+    pairs = [(i, vocabulary[genre]) for i, genres in enumerate(genre_lists) for genre in genres if genre in vocabulary]
+    if pairs:
+        rows, cols = zip(*pairs)
+        matrix[list(rows), list(cols)] = 1
+    return matrix
+
+
+def score_genres(pref_matrix: np.ndarray, rec_matrix: np.ndarray, rec_has_genres: np.ndarray):
+    pref_counts = pref_matrix.sum(axis=1)  # (P,)
+
+    overlap = pref_matrix @ rec_matrix.T  # (P, R) shared genre counts
+    scores = overlap / np.maximum(pref_counts, 1)[:, None]
+
+    # pairs where either side has no genres get the mean of the scored pairs
+    valid = (pref_counts > 0)[:, None] & rec_has_genres[None, :]
+    score_mean = scores[valid].mean() if valid.any() else 0
+    return np.where(valid, scores, score_mean)
+
+
 def genre_match(preferences: list, recommendations: list):
     # normalize by dividing by preference len (not rec len)
     # if rec has 10 genres, pref has 2 and 2 mathes, score should be 1 rather than 0.2
-    scores = np.full((len(preferences), len(recommendations)), -1)
-
-    score_sum = 0
-    score_count = 0
-    for i in range(len(preferences)):
-        pref_genres = preferences[i].genres.split(', ')
-        for j in range(len(recommendations)):
-            rec_genres = recommendations[j]['genres']
-            if pref_genres and rec_genres:
-                scores[i][j] = len(set(pref_genres).intersection(set(rec_genres))) / len(pref_genres)
-                score_sum += scores[i][j]
-                score_count += 1
-    score_mean = score_sum / score_count if score_count > 0 else 0
-    scores[scores == -1] = score_mean
-    return scores
+    pref_genres = [split_genres(row.genres) for row in preferences]
+    rec_genres = [split_genres(rec['genres']) for rec in recommendations]
+    vocabulary = {}
+    for genres in pref_genres + rec_genres:
+        for genre in genres:
+            vocabulary.setdefault(genre, len(vocabulary))
 
-
-def embed_match(pref_embeddings: list[list[float]], rec_embeddings: list[list[float]]):
+    pref_matrix = genre_multi_hot(pref_genres, vocabulary)  # (P, G)
+    rec_matrix = genre_multi_hot(rec_genres, vocabulary)  # (R, G)
+    return score_genres(pref_matrix, rec_matrix, rec_matrix.sum(axis=1) > 0)
 
 
-    pref_embeddings = np.array(pref_embeddings) # (P, D) -> Preferences
-    rec_embeddings = np.array(rec_embeddings) # (R, D) -> Recommendations
-    
-    dot_products = np.dot(pref_embeddings, rec_embeddings.T)  # (P, R)
-
-    pref_norms = np.linalg.norm(pref_embeddings, axis=1, keepdims=True)  # (P, 1)
-    rec_norms = np.linalg.norm(rec_embeddings, axis=1)  # (R,)
+def embed_match(pref_embeddings: list[list[float]], rec_embeddings: list[list[float]]):
+    pref_embeddings = l2_normalize(pref_embeddings) # (P, D) -> Preferences
+    rec_embeddings = l2_normalize(rec_embeddings) # (R, D) -> Recommendations
     
-    cosine_similarity = dot_products / (pref_norms * rec_norms.T)  # (P, R)
+    cosine_similarity = pref_embeddings @ rec_embeddings.T  # (P, R)
     normalized_cs = (cosine_similarity + 1) / 2
     return normalized_cs 
 
@@ -137,24 +132,32 @@ def add_ranks(scores: np.array, ratings: list[int], alpha: float = 0.75):
     final_scores = np.mean(scores_with_rating, axis=0)  
     return final_scores 
 
-def rank_recommendations(preferences: list, recommendations: list, k: int = 20):
+@traced("rank")
+def rank_recommendations(profile: PreferenceProfile, recommendations: list, k: int = 20):
 
-    if not preferences:
+    if not recommendations:
+        # every title failed validation
+        return [], np.empty(0)
+    if not profile.titles:
         length = min(len(recommendations), k)
         return list(range(length)), [50] * length
-    pref_ratings = np.array([row.rating for row in preferences])
     # both scores betwee 0 and 1
-    genre_scores = genre_match(preferences, recommendations)
-    genre_scores_with_ratings = add_ranks(genre_scores, pref_ratings)
-
-    pref_embeddings = retrieve_embeddings(items=[(row.title, row.content_type) for row in preferences])
-
-    rec_descriptions = [rec['description'] for rec in recommendations]
-    rec_embeddings = get_embeddings(rec_descriptions)
-    
-    embed_scores = embed_match(pref_embeddings, rec_embeddings)
-    embed_scores_with_ratings = add_ranks(embed_scores, pref_ratings)
-    scores = (genre_scores_with_ratings + embed_scores_with_ratings) / 2
+    rec_genres = [split_genres(rec['genres']) for rec in recommendations]
+    rec_matrix = genre_multi_hot(rec_genres, profile.vocabulary)
+    rec_has_genres = np.array([bool(genres) for genres in rec_genres], dtype=bool)
+    genre_scores = score_genres(profile.genre_matrix, rec_matrix, rec_has_genres)
+    genre_scores_with_ratings = add_ranks(genre_scores, profile.ratings)
+
+    # profile rows are already L2-normalized, so cosine similarity is one product
+    has_embedding = profile.has_embedding
+    if has_embedding.any():
+        rec_descriptions = [rec['description'] for rec in recommendations]
+        rec_embeddings = l2_normalize(get_embeddings(rec_descriptions))
+        embed_scores = (profile.embeddings[has_embedding] @ rec_embeddings.T + 1) / 2
+        embed_scores_with_ratings = add_ranks(embed_scores, profile.ratings[has_embedding])
+        scores = (genre_scores_with_ratings + embed_scores_with_ratings) / 2
+    else:
+        scores = genre_scores_with_ratings
     
     top_k_indices = np.argsort(scores)[::-1][:k]
     top_k_scores = scores[top_k_indices]  
@@ -163,18 +166,18 @@ def rank_recommendations(preferences: list, recommendations: list, k: int = 20):
 
 
 def give_recommendations(recommendations: list, user_id: str, content_type: str, k: int = 20):
-    preferences = get_user_recommendations(user_id, content_type, cols=(UserRecommendation.title, UserRecommendation.rating, UserRecommendation.content_type, UserRecommendation.seen))
-    seen = {row.title for row in preferences if row.seen}
+    profile = get_profile(user_id, content_type)
+    seen = profile.seen_titles()
     unseen_recommendations = [rec for rec in recommendations if rec['title'] not in seen]
-    top_k_indices, top_k_scores = rank_recommendations(preferences, unseen_recommendations, k)
+    top_k_indices, top_k_scores = rank_recommendations(profile, unseen_recommendations, k)
     norm_scores = top_k_scores * 100
 
-    final_recs = [unseen_recommendations[index] | {"score": norm_scores[i]} for i, index in enumerate(top_k_indices)]
+    final_recs = [unseen_recommendations[index] | {"score": float(norm_scores[i])} for i, index in enumerate(top_k_indices)]
     return final_recs
     
 
-def delete_pinecone(pc_index):
-    pc_index.delete(delete_all=True)
+def delete_embeddings():
+    get_vector_store().delete(delete_all=True)
     
 if __name__ == "__main__":
     pass
@@ -200,8 +203,8 @@ if __name__ == "__main__":
     # # Rank recommendations
     # ranked_recs = rank_recommendations(prefs, ratings, recs)
     # print(ranked_recs)
-    pc_index = create_pinecone_index()
-    print(pc_index.describe_index_stats())
+    vector_store = get_vector_store()
+    print(vector_store.fetch([embedding_id('anime', 'Naruto')]).keys())
 
     
 
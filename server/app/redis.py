@@ -1,86 +1,279 @@
 import redis.asyncio as redis
+from redis.client import NEVER_DECODE
+from redis.exceptions import ResponseError, NoScriptError
 import os
-from app.utils import left_to_right_match, serialize, deserialize
+import hashlib
+import json
+import weakref
+from time import time
+from app.utils import left_to_right_match, deserialize, pack_metadata, unpack_metadata
+from app.metrics import Gauge, traced, record_cache, record_write
+from app.local_cache import local_cache, LOCAL_CACHE_ENABLED
 import asyncio
 from dotenv import load_dotenv
 
 from contextlib import asynccontextmanager
 load_dotenv()
 
+# one bounded pool per event loop, callers past REDIS_MAX_CONNECTIONS wait up to REDIS_POOL_TIMEOUT
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 32))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 5))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 3))
+METADATA_COMPRESS_MIN = int(os.getenv("METADATA_COMPRESS_MIN", 512))
+# metadata keys scored by last access, eviction removes the lowest scores first
+RECENCY_KEY = "lru:cache"
+# JSON list of redis keys whose local copies are stale, or "*" for all of them
+INVALIDATION_CHANNEL = "cache:invalidate"
+INVALIDATION_POLL_TIMEOUT = 10.0  # seconds the listener waits per get_message, a quiet channel is normal
+CACHE_LOOKUP_SCRIPT = os.getenv("CACHE_LOOKUP_SCRIPT", "1") == "1"
+# 0 means no expiry
+CACHE_RESULTS_TTL = int(os.getenv("CACHE_RESULTS_TTL", 0))
+CACHE_NAMES_TTL = int(os.getenv("CACHE_NAMES_TTL", 0))
+CACHE_TITLES_TTL = int(os.getenv("CACHE_TITLES_TTL", 60 * 60 * 24 * 7))
+
+# direct key, then alias, then the aliased key, for a whole batch in one round trip.
+# KEYS is every direct key, every alias key, then the recency set, ARGV[1] the cache key prefix
+# the alias target is appended to and ARGV[2] the time hits are touched with in the recency set.
+# the fallback key isn't declared up front, fine outside cluster mode.
+# three reply slots per title: kind (b blob, h old hash entry, m miss), key found, value
+LOOKUP_SCRIPT = """
+local n = (#KEYS - 1) / 2
+local recency = KEYS[#KEYS]
+local out = {}
+local function read(key)
+    local value = redis.pcall('GET', key)
+    if type(value) == 'table' and value.err then
+        return 'h', ''
+    elseif value then
+        return 'b', value
+    end
+    return nil
+end
+for i = 1, n do
+    local kind, value = read(KEYS[i])
+    local found = KEYS[i]
+    if not kind then
+        local alias = redis.call('GET', KEYS[n + i])
+        if alias then
+            found = ARGV[1] .. alias
+            kind, value = read(found)
+        end
+    end
+    if kind then
+        redis.call('ZADD', recency, ARGV[2], found)
+    end
+    out[#out + 1] = kind or 'm'
+    out[#out + 1] = found
+    out[#out + 1] = value or ''
+end
+return out
+"""
+LOOKUP_SCRIPT_SHA = hashlib.sha1(LOOKUP_SCRIPT.encode()).hexdigest()
+_scripting_available = True
+
+
+class MeteredConnectionPool(redis.BlockingConnectionPool):
+    """BlockingConnectionPool that counts connections created, callers waiting and wait timeouts."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created = 0
+        self.waiting = 0
+        self.timeouts = 0
+
+    def make_connection(self):
+        self.created += 1
+        return super().make_connection()
+
+    async def get_connection(self, *args, **kwargs):
+        waited = not self.can_get_connection()
+        if waited:
+            self.waiting += 1
+        try:
+            return await super().get_connection(*args, **kwargs)
+        except redis.ConnectionError:
+            if waited:
+                self.timeouts += 1
+            raise
+        finally:
+            if waited:
+                self.waiting -= 1
+
+    def metrics(self) -> dict:
+        return {
+            "in_use": len(self._in_use_connections),
+            "idle": len(self._available_connections),
+            "waiting": self.waiting,
+            "created": self.created,
+            "timeouts": self.timeouts,
+            "max_connections": self.max_connections,
+        }
+
 
 def get_redis():
-    # Create a new Redis connection for the current event loop
-    return redis.Redis(
+    # Create a Redis client with its own connection pool, get_client shares one per event loop
+    pool = MeteredConnectionPool(
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
         host=os.getenv("REDIS_HOST"),
         port=int(os.getenv("REDIS_PORT")),
         decode_responses=True,
         username="default",
-        password=os.getenv("REDIS_PASSWORD")
+        password=os.getenv("REDIS_PASSWORD"),
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_keepalive=True,
     )
+    return redis.Redis(connection_pool=pool)
+
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """Return the shared client for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = get_redis()
+    return client
+
+
+async def close_redis():
+    """Close the running loop's client and its pool. Call before the loop itself shuts down."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose(close_connection_pool=True)
+
+
+def pool_metrics() -> dict:
+    totals = {}
+    for client in list(_clients.values()):
+        pool = client.connection_pool
+        if isinstance(pool, MeteredConnectionPool):
+            for key, value in pool.metrics().items():
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+Gauge(
+    "shows5u_redis_pool",
+    "Redis connection pools across event loops: in_use, idle, waiting, created, timeouts, max_connections.",
+    lambda: {(("state", k),): v for k, v in pool_metrics().items()},
+)
 
 
 @asynccontextmanager
 async def redis_client():
-    r = get_redis()
-    try:
-        yield r
-    finally:
-        await r.aclose()
+    # connections go back to the pool after every command, nothing to release here
+    yield get_client()
 
 async def run_with_client(redis_func, *args, **kwargs):
     async with redis_client() as r:
         return await redis_func(r, *args, **kwargs)
 
-async def map_names(r, names: list[tuple], prefix: str = "alias"):
+async def write_cache(r, content_type: str, results: list[dict] = (), names: list[tuple] = (), query: str = None, titles: set[str] = (),
+                      results_ttl: int = CACHE_RESULTS_TTL, names_ttl: int = CACHE_NAMES_TTL, titles_ttl: int = CACHE_TITLES_TTL,
+                      prefix: str = "cache", alias_prefix: str = "alias") -> dict:
+    """
+    Write validated metadata, alias mappings and a prompt's titles in one pipelined round trip.
+    Metadata and aliases are set only if absent (SET NX), titles are added to the prompt's set.
+    Returns written and skipped counts per kind.
+    """
+    counts = {kind: {"written": 0, "skipped": 0} for kind in ("metadata", "aliases", "titles")}
+    # results without genres can't be checked against FORBIDDEN_GENRES later, don't keep them
+    results = [result for result in results if result['genres']]
+    titles = list(titles) if query else []
+    if not results and not names and not titles:
+        return counts
+    titles_key = f"{content_type}:{query.lower()}" if titles else None
     try:
-        async with r.pipeline(transaction=True) as pipe:
+        async with r.pipeline(transaction=False) as pipe:
+            for result in results:
+                pipe.set(f"{prefix}:{content_type}_{result['title'].lower()}", pack_metadata(result, METADATA_COMPRESS_MIN), ex=results_ttl or None, nx=True)
             for title, actual_title in names:
-                title, actual_title = title.lower(), actual_title.lower()
-                pipe.set(f"{prefix}:{title}", actual_title)
-
-            await pipe.execute()
+                pipe.set(f"{alias_prefix}:{title.lower()}", actual_title.lower(), ex=names_ttl or None, nx=True)
+            if titles:
+                pipe.sadd(titles_key, *titles)
+                if titles_ttl:
+                    pipe.expire(titles_key, titles_ttl)
+            if results:
+                now = time()
+                pipe.zadd(RECENCY_KEY, {f"{prefix}:{content_type}_{result['title'].lower()}": now for result in results})
+            stale = written_local_keys(content_type, results, names, titles_key, prefix)
+            if LOCAL_CACHE_ENABLED and stale:
+                pipe.publish(INVALIDATION_CHANNEL, json.dumps(stale))
+            replies = await pipe.execute()
     except Exception as e:
-        print(f"Error during mapping: {e}")
+        print(f"Error during caching: {e}")
+        return counts
+    if LOCAL_CACHE_ENABLED:
+        local_cache.invalidate(stale)
+
+    for kind, kind_replies in (("metadata", replies[:len(results)]), ("aliases", replies[len(results):len(results) + len(names)])):
+        written = sum(1 for reply in kind_replies if reply)
+        counts[kind] = {"written": written, "skipped": len(kind_replies) - written}
+    if titles:
+        added = replies[len(results) + len(names)]
+        counts["titles"] = {"written": added, "skipped": len(titles) - added}
+    for kind, kind_counts in counts.items():
+        record_write(kind, kind_counts["written"], kind_counts["skipped"])
+    return counts
+
+
+def written_local_keys(content_type: str, results: list[dict], names: list[tuple], titles_key: str, prefix: str) -> list[str]:
+    # local entries, misses included, that a write makes stale: metadata under its own title
+    # and under every name aliased to it, and the prompt's title set
+    keys = [f"{prefix}:{content_type}_{result['title'].lower()}" for result in results]
+    if content_type:
+        keys += [f"{prefix}:{content_type}_{title.lower()}" for title, _ in names]
+    if titles_key:
+        keys.append(titles_key)
+    return keys
 
-async def cache_titles(r, key: str, values: set[str], content_type: str, ttl: int = 60 * 60 * 24 * 7):
-    if not values:
-        return
-    key = f"{content_type}:{key.lower()}"
-    try:
-        await r.sadd(key, *values)
-        if ttl:
-            await r.expire(key, ttl)
-    except Exception as e:
-        print(f"Error caching titles for key {key}: {e}")
+
+async def map_names(r, names: list[tuple], prefix: str = "alias"):
+    return await write_cache(r, None, names=names, alias_prefix=prefix)
+
+async def cache_titles(r, key: str, values: set[str], content_type: str, ttl: int = CACHE_TITLES_TTL):
+    return await write_cache(r, content_type, query=key, titles=values, titles_ttl=ttl)
+
+
+async def cache_results(r, results: list[dict], content_type: str, prefix: str = "cache", ttl: int = CACHE_RESULTS_TTL):
+    return await write_cache(r, content_type, results=results, results_ttl=ttl, prefix=prefix)
 
 
 async def get_titles(r, key: str, content_type: str) -> set[str]:
     key = f"{content_type}:{key.lower()}"
+    if LOCAL_CACHE_ENABLED:
+        ensure_invalidation_listener()
+        found, titles = local_cache.get(key)
+        record_cache("titles_local", int(found), int(not found))
+        if found:
+            return set(titles or ())
     try:
-        return await r.smembers(key)
+        titles = await r.smembers(key)
     except Exception as e:
         print(f"Error retrieving titles for key {key}: {e}")
+        return None
+    record_cache("titles", int(bool(titles)), int(not titles))
+    if LOCAL_CACHE_ENABLED:
+        local_cache.set(key, frozenset(titles) if titles else None)
+    return titles
 
 
-async def cache_results(r, results: list[dict], content_type: str, prefix: str = "cache", ttl: int = None):
-    if content_type != 'anime' or not results:
-        return 
-    try:
-        async with r.pipeline(transaction=True) as pipeline:
-            for result in results:
-                redis_key = f"{prefix}:{content_type}_{result['title'].lower()}"
-                if result['genres'] and not await r.exists(redis_key):
-                    await pipeline.hset(redis_key, mapping=serialize(result))
-                    if ttl:
-                        await pipeline.expire(redis_key, ttl)
-                    
-            await pipeline.execute()
-    except Exception as e:
-        print(f"Error during caching: {e}")
-
 async def pipeline_caching(r, keys: list[str], mode: str = 'hash'):
     if not keys:
         return []
+    if mode == "blob":
+        # raw bytes, the client decodes responses by default; no MULTI so NEVER_DECODE applies per reply
+        async with r.pipeline(transaction=False) as pipeline:
+            for key in keys:
+                pipeline.execute_command("GET", key, **{NEVER_DECODE: True})
+            return await pipeline.execute(raise_on_error=False)
     async with r.pipeline(transaction=True) as pipeline:
         for key in keys:
             if mode == "hash":
@@ -89,6 +282,42 @@ async def pipeline_caching(r, keys: list[str], mode: str = 'hash'):
                 await pipeline.get(key)
         results = await pipeline.execute()
         return results
+
+
+async def read_metadata(r, keys: list[str]) -> list:
+    """Decoded metadata per key (None when missing), also reading and migrating entries stored as hashes."""
+    blobs = await pipeline_caching(r, keys, "blob")
+    results = [None] * len(keys)
+    legacy = []
+    for i, blob in enumerate(blobs):
+        if isinstance(blob, ResponseError):
+            # WRONGTYPE, written by the old per-field hash format
+            legacy.append(i)
+        elif blob:
+            try:
+                results[i] = unpack_metadata(blob)
+            except Exception as e:
+                print(f"Error decoding cached metadata {keys[i]}: {e}")
+
+    if legacy:
+        async with r.pipeline(transaction=False) as pipeline:
+            for i in legacy:
+                pipeline.hgetall(keys[i])
+                pipeline.pttl(keys[i])
+            replies = await pipeline.execute()
+        async with r.pipeline(transaction=True) as pipeline:
+            for n, i in enumerate(legacy):
+                fields, pttl = replies[2 * n], replies[2 * n + 1]
+                if not fields:
+                    continue
+                results[i] = deserialize(fields)
+                pipeline.delete(keys[i])
+                pipeline.set(keys[i], pack_metadata(results[i], METADATA_COMPRESS_MIN), px=pttl if pttl > 0 else None)
+            try:
+                await pipeline.execute()
+            except Exception as e:
+                print(f"Error migrating cached metadata: {e}")
+    return results
         
 # 0, None, None, None, None
 # 0, None, 2, 3
@@ -98,12 +327,10 @@ async def pipeline_caching(r, keys: list[str], mode: str = 'hash'):
 # 1, 3, 4 
 # 1, 4
     
-async def get_cached_results_with_fallback(r, titles: list[str], content_type: str, prefix: str = "cache", alias_prefix: str = "alias"):
-    if content_type != 'anime' or not titles:
-        return {}
+async def lookup_with_pipelines(r, titles: list[str], content_type: str, prefix: str = "cache", alias_prefix: str = "alias") -> list:
     # Pipeline to get original keys
     redis_keys = [f"{prefix}:{content_type}_{title.lower()}" for title in titles]
-    original_results = await pipeline_caching(r, redis_keys)
+    original_results = await read_metadata(r, redis_keys)
     missing_indices = [i for i in range(len(original_results)) if not original_results[i]]
 
     # Get aliases for missing titles
@@ -114,64 +341,205 @@ async def get_cached_results_with_fallback(r, titles: list[str], content_type: s
 
     # Pipeline to fetch fallback (mapped) keys
     fallback_keys = [f"{prefix}:{content_type}_{title.lower()}" for title in mapped_titles if title]
-    fallback_results = await pipeline_caching(r, fallback_keys)
+    fallback_results = await read_metadata(r, fallback_keys)
     fallback_map = {mapped_indices[i]: fallback_results[i] for i in range(len(fallback_results)) if fallback_results[i]}
     
     # we could also compute the mapping once at the end, but i like this approach of intermediate mappings between indices
     
     # Merge original and fallback results
+    hits = {redis_keys[i]: time() for i in range(len(titles)) if original_results[i]}
+    hits.update({fallback_keys[n]: time() for n in range(len(fallback_keys)) if fallback_results[n]})
+    if hits:
+        await r.zadd(RECENCY_KEY, hits)
+    return [original_results[i] or fallback_map.get(i) for i in range(len(titles))]
+
+
+async def lookup_with_script(r, titles: list[str], content_type: str, prefix: str = "cache", alias_prefix: str = "alias"):
+    """Same result as lookup_with_pipelines in one round trip, None if the server can't run scripts."""
+    global _scripting_available
+    keys = [f"{prefix}:{content_type}_{title.lower()}" for title in titles] + [f"{alias_prefix}:{title.lower()}" for title in titles] + [RECENCY_KEY]
+    args = (len(keys), *keys, f"{prefix}:{content_type}_", time())
+    try:
+        try:
+            reply = await r.execute_command("EVALSHA", LOOKUP_SCRIPT_SHA, *args, **{NEVER_DECODE: True})
+        except NoScriptError:
+            # EVAL also caches the script for the next EVALSHA
+            reply = await r.execute_command("EVAL", LOOKUP_SCRIPT, *args, **{NEVER_DECODE: True})
+    except ResponseError as e:
+        print(f"Cache lookup script failed, using pipelines: {e}")
+        # scripting disabled or unsupported (some managed and proxied redis setups), stop trying
+        if "unknown command" in str(e).lower() or "disabled" in str(e).lower() or "not allowed" in str(e).lower():
+            _scripting_available = False
+        return None
+
+    results = [None] * len(titles)
+    legacy = []
+    for i in range(len(titles)):
+        kind, key, value = reply[3 * i: 3 * i + 3]
+        if kind == b'b':
+            try:
+                results[i] = unpack_metadata(value)
+            except Exception as e:
+                print(f"Error decoding cached metadata {key.decode()}: {e}")
+        elif kind == b'h':
+            legacy.append((i, key.decode()))
+    if legacy:
+        legacy_results = await read_metadata(r, [key for _, key in legacy])
+        for (i, _), result in zip(legacy, legacy_results):
+            results[i] = result
+    return results
+
+
+@traced("cache_lookup")
+async def get_cached_results_with_fallback(r, titles: list[str], content_type: str, prefix: str = "cache", alias_prefix: str = "alias"):
+    if not titles:
+        return {}
     final_results = {}
-    for i, title in enumerate(titles):
-        if original_results[i]:
-            final_results[title] = deserialize(original_results[i])
-        elif i in fallback_map:
-            final_results[title] = deserialize(fallback_map[i])
-    
+    if LOCAL_CACHE_ENABLED:
+        ensure_invalidation_listener()
+        remaining = []
+        for title in titles:
+            found, result = local_cache.get(f"{prefix}:{content_type}_{title.lower()}")
+            if not found:
+                remaining.append(title)
+            elif result:
+                # callers get their own copy of the shared entry
+                final_results[title] = dict(result)
+        record_cache("metadata_local", len(titles) - len(remaining), len(remaining))
+        titles = remaining
+        if not titles:
+            return final_results
+
+    results = None
+    if CACHE_LOOKUP_SCRIPT and _scripting_available:
+        results = await lookup_with_script(r, titles, content_type, prefix, alias_prefix)
+    if results is None:
+        results = await lookup_with_pipelines(r, titles, content_type, prefix, alias_prefix)
+
+    hits = 0
+    for title, result in zip(titles, results):
+        if LOCAL_CACHE_ENABLED:
+            local_cache.set(f"{prefix}:{content_type}_{title.lower()}", dict(result) if result else None)
+        if result:
+            final_results[title] = result
+            hits += 1
+    record_cache("metadata", hits, len(titles) - hits)
     return final_results
 
 
-
-async def clear_cache(r, prefixes: tuple[str] = ("cache", "alias", "series", "anime", "movie")):
-    for prefix in prefixes:
-        keys = await r.keys(f"{prefix}:*")
-        if keys:
-            await r.delete(*keys)
+async def listen_for_invalidations():
+    """Drop local entries other workers (and this one) have rewritten, for as long as the loop runs."""
+    while True:
+        try:
+            async with get_client().pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # anything published while not subscribed was missed
+                local_cache.clear()
+                while True:
+                    # listen() reads with the pool's socket_timeout and raises on a quiet channel, an explicit
+                    # timeout returns None instead. check_health pings on every call, so a dead connection still raises
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=INVALIDATION_POLL_TIMEOUT)
+                    if message is None or message["type"] != "message":
+                        continue
+                    keys = json.loads(message["data"])
+                    if keys == "*":
+                        local_cache.clear()
+                    else:
+                        local_cache.invalidate(keys)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error listening for cache invalidations: {e}")
+            await asyncio.sleep(1)
+
+
+_listener_pid = None
+
+
+def ensure_invalidation_listener():
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    _listener_pid = os.getpid()
+    from app.runner import get_runner  # app.runner imports this module
+    get_runner().spawn(listen_for_invalidations())
 
 
-async def auto_cleanup(r, prefix: str = "cache", threshold_percent: float = 80, cleanup_percent: float = 20, max_memory: float = 3e7):
 
-    info = await r.info("memory")
-    used_memory = info['used_memory']
-    usage_ratio = (used_memory / max_memory) * 100
-    print(f"Redis Memory Usage: {usage_ratio:.2f}%")
+async def unlink_matching(r, pattern: str, batch: int = 500) -> int:
+    """UNLINK every key matching pattern, SCANning and deleting batch keys at a time."""
+    removed = 0
+    keys = []
+    async for key in r.scan_iter(match=pattern, count=batch):
+        keys.append(key)
+        if len(keys) >= batch:
+            removed += await r.unlink(*keys)
+            keys = []
+    if keys:
+        removed += await r.unlink(*keys)
+    return removed
 
-    if usage_ratio >= threshold_percent:
-        keys = []
-        async for key in r.scan_iter(match=f"{prefix}:*"):
-            keys.append(key)
 
-        total_keys = len(keys)
-        if total_keys == 0:
-            print("No keys found to delete.")
-            return
+async def clear_cache(r, prefixes: tuple[str] = ("cache", "alias", "series", "anime", "movie", "miss", "lru")):
+    for prefix in prefixes:
+        await unlink_matching(r, f"{prefix}:*")
+    local_cache.clear()
+    await r.publish(INVALIDATION_CHANNEL, json.dumps("*"))
 
-        async with r.pipeline(transaction=True) as pipeline:
-            for key in keys:
-                await pipeline.object('idletime', key)
-            idletimes = await pipeline.execute()
 
-        keys_with_idle = sorted(zip(keys, idletimes), key=lambda x: x[1], reverse=True)
-        num_to_delete = int(total_keys * (cleanup_percent / 100))
-        keys_to_delete = [k for k, _ in keys_with_idle[:num_to_delete]]
+async def used_memory(r) -> int:
+    info = await r.info("memory")
+    return info['used_memory']
 
-        async with r.pipeline(transaction=True) as pipeline:
-            for key in keys_to_delete:
-                await pipeline.delete(key)
-            await pipeline.execute()
 
-        print(f"🚨 Cleanup triggered: Deleted {num_to_delete}/{total_keys} least-accessed keys in '{prefix}:*'")
-    else:
-        print("✅ Memory usage under control. No cleanup needed.")
+async def evict_least_recent(r, count: int) -> int:
+    """
+    UNLINK the count least recently used metadata keys, returns how many were tracked.
+    Every worker drops them from its local tier too, like rewritten keys in write_cache.
+    """
+    keys = await r.zrange(RECENCY_KEY, 0, count - 1)
+    if not keys:
+        return 0
+    async with r.pipeline(transaction=False) as pipeline:
+        pipeline.unlink(*keys)
+        pipeline.zrem(RECENCY_KEY, *keys)
+        if LOCAL_CACHE_ENABLED:
+            pipeline.publish(INVALIDATION_CHANNEL, json.dumps(keys))
+        await pipeline.execute()
+    if LOCAL_CACHE_ENABLED:
+        local_cache.invalidate(keys)
+    return len(keys)
+
+
+async def track_untracked(r, cursor: int = 0, prefix: str = "cache", batch: int = 500) -> int:
+    """
+    Add one SCAN batch of metadata keys missing from the recency set, as least recent.
+    Picks up keys written before recency tracking. Returns the cursor to continue from, 0 when done.
+    """
+    cursor, keys = await r.scan(cursor, match=f"{prefix}:*", count=batch)
+    if keys:
+        await r.zadd(RECENCY_KEY, {key: 0 for key in keys}, nx=True)
+    return cursor
+
+
+async def auto_cleanup(r, max_memory: float = 3e7, high_watermark: float = 0.8, low_watermark: float = 0.7, batch: int = 100, max_batches: int = 50) -> int:
+    """
+    Once memory use passes high_watermark of max_memory, evict least recently used metadata
+    in batches until it drops under low_watermark (or max_batches ran). Returns keys evicted.
+    """
+    used = await used_memory(r)
+    if used < max_memory * high_watermark:
+        return 0
+    print(f"Redis Memory Usage: {used / max_memory * 100:.2f}%")
+
+    evicted = 0
+    for _ in range(max_batches):
+        removed = await evict_least_recent(r, batch)
+        evicted += removed
+        if not removed or await used_memory(r) < max_memory * low_watermark:
+            break
+    print(f"Cleanup evicted {evicted} least recently used keys")
+    return evicted
 
 async def get_keys(r, prefix: str):
     keys = []
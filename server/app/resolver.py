@@ -0,0 +1,187 @@
+import os
+import math
+import asyncio
+import threading
+import unicodedata
+from array import array
+import numpy as np
+from dotenv import load_dotenv
+from app.catalog import catalog
+from app.runner import get_runner
+from app.metrics import Counter, Gauge
+load_dotenv()
+
+# resolves LLM titles to known titles (catalog, validated results and their aliases)
+# before any provider call, by trigram similarity over an in-memory inverted index.
+# catalog titles are picked up by a job on the runner every RESOLVER_REFRESH_INTERVAL
+RESOLVER_ENABLED = os.getenv("RESOLVER_ENABLED", "1") == "1"
+RESOLVER_MIN_CONFIDENCE = float(os.getenv("RESOLVER_MIN_CONFIDENCE", 0.75))
+RESOLVER_REFRESH_INTERVAL = float(os.getenv("RESOLVER_REFRESH_INTERVAL", 60))
+
+resolutions = Counter("shows5u_title_resolutions_total", "Titles looked up in the fuzzy title resolver, by outcome.")
+
+
+def normalize_title(title: str) -> str:
+    title = unicodedata.normalize("NFKC", title or "").casefold()
+    return " ".join("".join(c if c.isalnum() else " " for c in title).split())
+
+
+# no "x", it is a word in "Hunter x Hunter" and "Spy x Family"
+ROMAN_NUMERALS = {"ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6", "vii": "7", "viii": "8", "ix": "9"}
+# how many of the best scoring candidates are checked for matching numbers
+NUMBER_CHECK_CANDIDATES = 8
+
+
+def title_numbers(normalized: str) -> frozenset:
+    # "Toy Story 2" and "Toy Story 3" are close by trigrams but are different titles. "II" and
+    # "02" are 2, and a 1 ("Season 1", "Part 1") is the title itself
+    numbers = {str(int(token)) if token.isdecimal() else ROMAN_NUMERALS.get(token) for token in normalized.split()}
+    return frozenset(numbers - {None, "1"})
+
+
+def trigrams(normalized: str) -> set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Known spellings of one content type's titles. Postings are uint32 arrays of entry
+    ids per trigram, so appending a title is cheap and a lookup is one bincount over
+    the postings of the query's trigrams, scored by Dice coefficient. Titles whose
+    numbers differ (sequels, seasons) are not taken as matches.
+    """
+
+    def __init__(self):
+        self.targets = []  # entry id -> canonical title, an alias points at its title
+        self.sizes = array("H")  # entry id -> number of trigrams
+        self.exact = {}  # normalized spelling -> entry id
+        self.postings = {}  # trigram -> array of entry ids
+
+    def __len__(self):
+        return len(self.targets)
+
+    def add(self, spelling: str, title: str):
+        normalized = normalize_title(spelling)
+        if not normalized or normalized in self.exact:
+            return
+        entry = len(self.targets)
+        grams = trigrams(normalized)
+        self.targets.append(title)
+        self.sizes.append(min(len(grams), 65535))
+        self.exact[normalized] = entry
+        for gram in grams:
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array("I")
+            postings.append(entry)
+
+    def search(self, title: str, min_confidence: float = 0.0):
+        """
+        (canonical title, confidence in [0, 1]) for the closest entry, None if nothing shares a trigram.
+        Entries that can't reach min_confidence are skipped, so a lower result may not be the closest.
+        """
+        normalized = normalize_title(title)
+        entry = self.exact.get(normalized)
+        if entry is not None:
+            return self.targets[entry], 1.0
+        grams = trigrams(normalized) if normalized else set()
+        present = sorted((gram for gram in grams if gram in self.postings), key=lambda gram: len(self.postings[gram]))
+        # dice >= t needs at least t*q/(2-t) shared trigrams, so a match has to be in one of
+        # the rarest len(present) - needed + 1 postings, only those entries are scored
+        needed = max(1, math.ceil(min_confidence * len(grams) / (2 - min_confidence)))
+        probe = len(present) - needed + 1
+        if probe <= 0:
+            return None
+        postings = [np.frombuffer(self.postings[gram], dtype=np.uint32) for gram in present]
+        shared = np.bincount(np.concatenate(postings))
+        candidates = np.unique(np.concatenate(postings[:probe]))
+        del postings  # release the buffers so the arrays can grow again
+        sizes = np.frombuffer(self.sizes, dtype=np.uint16)[candidates]
+        scores = 2 * shared[candidates] / (len(grams) + sizes)
+        numbers = title_numbers(normalized)
+        order = np.argsort(-scores, kind="stable")[:NUMBER_CHECK_CANDIDATES]
+        for best in order:
+            target = self.targets[candidates[best]]
+            if title_numbers(normalize_title(target)) == numbers:
+                return target, float(scores[best])
+        # only other installments are close, never confident enough to stand in for this one
+        return self.targets[candidates[order[0]]], float(scores[order[0]]) / 2
+
+
+class TitleResolver:
+
+    def __init__(self, source=catalog):
+        self.source = source
+        self.indexes = {}  # content type -> TrigramIndex
+        self.synced = 0  # catalog batches after this seq are not indexed yet
+        self._lock = threading.Lock()
+
+    def _index(self, content_type: str) -> TrigramIndex:
+        index = self.indexes.get(content_type)
+        if index is None:
+            index = self.indexes[content_type] = TrigramIndex()
+        return index
+
+    def add(self, content_type: str, titles, aliases=()):
+        """Index titles under their own spelling and (spelling, title) aliases under the alias."""
+        with self._lock:
+            index = self._index(content_type)
+            for title in titles:
+                index.add(title, title)
+            for alias, title in aliases:
+                index.add(alias, title)
+
+    def refresh(self):
+        """Index catalog titles written since the last refresh, incrementally."""
+        try:
+            rows = self.source.titles_since(self.synced)
+        except Exception as e:
+            print(f"Error refreshing title resolver: {e}")
+            rows = []
+        with self._lock:
+            for content_type, title, seq in rows:
+                self._index(content_type).add(title, title)
+                self.synced = max(self.synced, seq)
+
+    def resolve_many(self, content_type: str, titles, min_confidence: float = RESOLVER_MIN_CONFIDENCE) -> dict:
+        """title -> (canonical title, confidence) for every title with a candidate, see TrigramIndex.search."""
+        matches = {}
+        with self._lock:
+            index = self.indexes.get(content_type)
+            if index is None:
+                return matches
+            for title in titles:
+                match = index.search(title, min_confidence)
+                if match:
+                    matches[title] = match
+        return matches
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {content_type: len(index) for content_type, index in self.indexes.items()}
+
+
+title_resolver = TitleResolver()
+
+_started_pid = None
+
+
+async def run_refresh():
+    # the catalog is a blocking sqlite read
+    await asyncio.to_thread(title_resolver.refresh)
+
+
+def ensure_refresh_job():
+    """Schedule run_refresh on this process's runner, once per process, safe to call per request."""
+    global _started_pid
+    if not RESOLVER_ENABLED or _started_pid == os.getpid():
+        return
+    _started_pid = os.getpid()
+    get_runner().call_every(RESOLVER_REFRESH_INTERVAL, run_refresh)
+
+Gauge(
+    "shows5u_title_resolver_entries",
+    "Spellings indexed by the fuzzy title resolver, by content type.",
+    lambda: {(("content_type", k),): v for k, v in title_resolver.metrics().items()},
+)
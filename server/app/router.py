@@ -0,0 +1,264 @@
+import os
+import asyncio
+import threading
+from collections import deque
+from time import monotonic, perf_counter
+import numpy as np
+from dotenv import load_dotenv
+from app.validate import ProviderCalls, provider_calls, record_provider_call
+from app.metrics import Counter, Gauge
+from app.rate_limit import rate_limiter, RateLimitTimeout
+load_dotenv()
+
+# metadata providers are tried in a per content type order. a provider that is slower than
+# its usual latency gets a hedged request to the next one, and one that keeps failing is
+# skipped by its circuit breaker until a probe request succeeds again
+ROUTER_PREFERENCE = {
+    "anime": os.getenv("ROUTER_PREFERENCE_ANIME", "anilist,jikan,kitsu"),
+    "movie": os.getenv("ROUTER_PREFERENCE_MOVIE", "omdb,tmdb"),
+    "series": os.getenv("ROUTER_PREFERENCE_SERIES", "omdb,tmdb"),
+}
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", 200))  # samples kept per provider
+ROUTER_WINDOW_SECONDS = float(os.getenv("ROUTER_WINDOW_SECONDS", 120))
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", 10))
+ROUTER_ERROR_THRESHOLD = float(os.getenv("ROUTER_ERROR_THRESHOLD", 0.5))
+ROUTER_OPEN_SECONDS = float(os.getenv("ROUTER_OPEN_SECONDS", 30))
+ROUTER_HEDGE_PERCENTILE = float(os.getenv("ROUTER_HEDGE_PERCENTILE", 90))
+ROUTER_HEDGE_DEFAULT = float(os.getenv("ROUTER_HEDGE_DEFAULT", 0.5))  # seconds, until a provider has samples
+ROUTER_HEDGE_MIN = float(os.getenv("ROUTER_HEDGE_MIN", 0.05))
+ROUTER_HEDGE_MAX = float(os.getenv("ROUTER_HEDGE_MAX", 2.0))
+# a provider whose median latency is this many times the next one's goes behind it
+ROUTER_SLOW_FACTOR = float(os.getenv("ROUTER_SLOW_FACTOR", 3))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+router_decisions = Counter("shows5u_router_decisions_total", "Provider router decisions, by provider and decision.")
+
+
+class ProviderHealth:
+    """Rolling latency and error stats for one provider, with its circuit breaker."""
+
+    def __init__(self, name: str, window: int = ROUTER_WINDOW, window_seconds: float = ROUTER_WINDOW_SECONDS):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.samples = deque(maxlen=window)  # (time, latency, ok)
+        self.state = CLOSED
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self.samples and now - self.samples[0][0] > self.window_seconds:
+            self.samples.popleft()
+
+    def _error_rate(self) -> float:
+        return sum(1 for _, _, ok in self.samples if not ok) / len(self.samples) if self.samples else 0.0
+
+    def record(self, latency: float, ok: bool):
+        now = monotonic()
+        with self._lock:
+            self.samples.append((now, latency, ok))
+            self._prune(now)
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if ok:
+                    self.state = CLOSED
+                    self.samples.clear()
+                else:
+                    self._open(now)
+            elif self.state == CLOSED and len(self.samples) >= ROUTER_MIN_SAMPLES and self._error_rate() >= ROUTER_ERROR_THRESHOLD:
+                self._open(now)
+
+    def _open(self, now: float):
+        self.state, self.opened_at = OPEN, now
+        router_decisions.inc(provider=self.name, decision="opened")
+
+    def allow(self) -> bool:
+        """Whether a request may go to this provider now, an open breaker lets one probe through after ROUTER_OPEN_SECONDS."""
+        with self._lock:
+            if self.state == OPEN and monotonic() - self.opened_at >= ROUTER_OPEN_SECONDS:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    return False
+                self.probing = True
+                return True
+            return self.state == CLOSED
+
+    def release(self):
+        # a probe that was cancelled before it finished says nothing, let the next one through
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probing = False
+
+    def latency_percentile(self, percentile: float):
+        with self._lock:
+            self._prune(monotonic())
+            # failures are often fast (429s, refused connections) and would make a failing provider look quick
+            latencies = [latency for _, latency, ok in self.samples if ok]
+            if len(latencies) < ROUTER_MIN_SAMPLES:
+                return None
+            return float(np.percentile(latencies, percentile))
+
+    def hedge_delay(self) -> float:
+        delay = self.latency_percentile(ROUTER_HEDGE_PERCENTILE)
+        if delay is None:
+            return ROUTER_HEDGE_DEFAULT
+        return min(max(delay, ROUTER_HEDGE_MIN), ROUTER_HEDGE_MAX)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            self._prune(monotonic())
+            latencies = [latency for _, latency, ok in self.samples if ok]
+            return {
+                "samples": len(self.samples),
+                "error_rate": self._error_rate(),
+                "p50_ms": float(np.percentile(latencies, 50)) * 1000 if latencies else 0.0,
+                "p90_ms": float(np.percentile(latencies, 90)) * 1000 if latencies else 0.0,
+                "open": {CLOSED: 0, HALF_OPEN: 0.5, OPEN: 1}[self.state],
+            }
+
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def provider_health(name: str) -> ProviderHealth:
+    # one per provider and process, shared by every router and content type
+    with _health_lock:
+        health = _health.get(name)
+        if health is None:
+            health = _health[name] = ProviderHealth(name)
+        return health
+
+
+def provider_preference(content_type: str) -> list[str]:
+    return [name.strip() for name in ROUTER_PREFERENCE.get(content_type, "").split(",") if name.strip()]
+
+
+def has_genres(result: dict) -> bool:
+    # results without genres can't be checked against FORBIDDEN_GENRES or cached
+    return bool(result.get("genres"))
+
+
+class ProviderRouter:
+    """
+    Looks a title up across providers in (latency adjusted) preference order. The next provider is started when
+    the current one misses, fails, or runs past its hedge delay (ROUTER_HEDGE_PERCENTILE of its
+    recent latency). The first complete result wins; an incomplete one is kept as a fallback.
+    """
+
+    def __init__(self, providers: dict, preference: list[str], complete=has_genres):
+        self.providers = providers  # name -> async search(title)
+        self.preference = [name for name in preference if name in providers]
+        self.complete = complete
+
+    async def _attempt(self, name: str, title: str):
+        # each attempt gets its own tracker so its failures are charged to its provider,
+        # then they are added to the lookup's tracker as before
+        parent = provider_calls.get()
+        attempt = ProviderCalls()
+        provider_calls.set(attempt)
+        health = provider_health(name)
+        finished = False
+        try:
+            # waiting for a rate limit token isn't the provider's latency
+            await rate_limiter.acquire(name)
+            start = perf_counter()
+            result = await self.providers[name](title)
+            finished = True
+        except asyncio.CancelledError:
+            raise
+        except RateLimitTimeout as e:
+            # our own budget ran out, the provider wasn't asked and isn't charged for it
+            print(f"Skipping {name} for {title}: {e}")
+            router_decisions.inc(provider=name, decision="rate_limited")
+            attempt.failed = True
+            result = None
+        except Exception as e:
+            print(f"Error fetching {title} from {name}: {e}")
+            attempt.failed = True
+            result, finished = None, True
+        finally:
+            if finished:
+                health.record(perf_counter() - start, not attempt.failed)
+            else:
+                health.release()
+            if parent is not None:
+                parent.calls += attempt.calls
+                parent.failed = parent.failed or attempt.failed
+        return result
+
+    def order(self) -> list[str]:
+        """Preference order, with a provider moved behind the next one while it is much slower."""
+        order = list(self.preference)
+        for i in range(len(order) - 1):
+            current = provider_health(order[i]).latency_percentile(50)
+            following = provider_health(order[i + 1]).latency_percentile(50)
+            # a demoted provider gets fewer samples, once they age out of the window it's tried first again
+            if current is not None and following is not None and current > ROUTER_SLOW_FACTOR * following:
+                router_decisions.inc(provider=order[i], decision="demoted")
+                order[i], order[i + 1] = order[i + 1], order[i]
+        return order
+
+    async def route(self, title: str):
+        queue = self.order()
+        pending = {}  # task -> (name, rank)
+        fallback = None  # (rank, name, result)
+        last_started = None
+        skipped = False
+
+        def start(decision: str) -> bool:
+            # breakers are asked only when a provider is about to be used, allow() hands out the probe
+            nonlocal last_started, skipped
+            while queue:
+                name = queue.pop(0)
+                if not provider_health(name).allow():
+                    router_decisions.inc(provider=name, decision="skipped_open")
+                    skipped = True
+                    continue
+                pending[asyncio.create_task(self._attempt(name, title))] = (name, self.preference.index(name))
+                last_started = name
+                router_decisions.inc(provider=name, decision=decision)
+                return True
+            return False
+
+        start("primary")
+        try:
+            while pending:
+                timeout = provider_health(last_started).hedge_delay() if queue else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    start("hedge")
+                    continue
+                for task in done:
+                    name, rank = pending.pop(task)
+                    result = task.result()
+                    if result and self.complete(result):
+                        router_decisions.inc(provider=name, decision="won")
+                        return result
+                    if result and (fallback is None or rank < fallback[0]):
+                        fallback = (rank, name, result)
+                    start("fallback")
+            if fallback:
+                router_decisions.inc(provider=fallback[1], decision="won")
+                return fallback[2]
+            if skipped:
+                # a provider that was skipped might have known the title
+                record_provider_call()
+            return None
+        finally:
+            for task, (name, _) in pending.items():
+                task.cancel()
+                router_decisions.inc(provider=name, decision="cancelled")
+
+
+Gauge(
+    "shows5u_provider_health",
+    "Rolling provider stats: samples, error_rate, p50_ms, p90_ms, and open (0 closed, 0.5 half open, 1 open).",
+    lambda: {
+        (("provider", name), ("stat", stat)): value
+        for name, health in list(_health.items())
+        for stat, value in health.metrics().items()
+    },
+)
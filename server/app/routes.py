@@ -1,13 +1,16 @@
-from flask import Blueprint, jsonify, request
-from app.llm import generate
-from app.validate_handler import validate_titles
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from app.llm import generate, generate_stream
+from app.validate_handler import validate_titles, stream_generated_titles
 from app.crud import *
-from app.utils import run_async_task
+from app.runner import run_in_background
+from app.utils import sse
 from app.extensions import limiter
-from app.redis import cache_results, map_names, run_with_client, cache_titles
-from app.recommend import give_recommendations, store_embeddings
-from time import time 
-import threading
+from app.redis import run_with_client, write_cache
+from app.eviction import ensure_eviction_job
+from app.recommend import give_recommendations
+from app.embed_queue import queue_preference
+from app.popular import record_popular
+from app.metrics import render as render_metrics
 
 
 
@@ -15,13 +18,8 @@ import threading
 main_bp = Blueprint("main", __name__)
 
 def start_background_tasks(query, results, content_type, to_cache, to_map):
-    tasks = [
-        (run_with_client, cache_results, to_cache, content_type),
-        (run_with_client, map_names, to_map),
-        (run_with_client, cache_titles, query, results, content_type)
-    ]
-    for task in tasks:
-        threading.Thread(target=run_async_task, args=task).start()
+    run_in_background(run_with_client(write_cache, content_type, results=to_cache, names=to_map, query=query, titles=results))
+    ensure_eviction_job()
 
 @main_bp.route("/respond", methods=["POST"])
 @limiter.limit("2 per minute")
@@ -37,12 +35,44 @@ def respond():
 
     recommended_results = give_recommendations(valid_results, email, content_type)
 
-    upsert_popular_recommendations(content_type, recommended_results)
+    record_popular(content_type, recommended_results)
     
     start_background_tasks(query, results, content_type, to_cache, to_map)
 
     return jsonify({"results": recommended_results})
 
+@main_bp.route("/respond/stream", methods=["POST"])
+@limiter.limit("2 per minute")
+def respond_stream():
+    """
+    Same pipeline as /respond as server-sent events: "generating" right away, "results" batches
+    as titles are validated (cached ones first, then each LLM call's titles as that call
+    finishes), then "ranking" with the scored top results, then "done".
+    """
+    data = request.get_json()
+    query = data['query']
+    content_type = data['content_type']
+    email = data['email']
+
+    @stream_with_context
+    def events():
+        yield sse("generating", {})
+
+        results, valid_results, to_map, to_cache = set(), [], [], []
+        title_batches = generate_stream(query, content_type)
+        for batch in stream_generated_titles(content_type, title_batches, results, to_map, to_cache):
+            valid_results += batch
+            yield sse("results", {"results": batch})
+
+        recommended_results = give_recommendations(valid_results, email, content_type)
+        # before the last events, so a client that disconnects now still counts and warms the caches
+        record_popular(content_type, recommended_results)
+        start_background_tasks(query, results, content_type, to_cache, to_map)
+        yield sse("ranking", {"results": recommended_results})
+        yield sse("done", {})
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @main_bp.route("/preference", methods=["POST"])
 def add_preference():
     """
@@ -62,13 +92,14 @@ def add_preference():
     seen = data.get("seen", False)  # Optional
     if not rating:
         delete_user_recommendation(email, title, content_type)
+        queue_preference(email, content_type, title, None)
     else:
         upsert_user_recommendation(user_id=email, title=title, genres=genres, content_type=content_type, rating=rating, comment=comment, seen=seen, url=url, image_url=image_url)
         
         # description_or_comment = comment if comment else description
-        if description:
-            description_or_comment = description
-            store_embeddings([content_type], [title], [description_or_comment])
+        description_or_comment = description
+        # the rating is saved, the profile and the description's embedding follow in the background
+        queue_preference(email, content_type, title, rating, genres, seen, description_or_comment)
 
     return jsonify({"message": "User recommendation added/updated/deleted successfully"})
 
@@ -115,4 +146,9 @@ def get_user_preferences():
     ]
       
 
-    return jsonify({"results": preferences_cleaned})
\ No newline at end of file
+    return jsonify({"results": preferences_cleaned})
+
+
+@main_bp.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
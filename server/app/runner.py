@@ -0,0 +1,214 @@
+import os
+import queue
+import atexit
+import asyncio
+import threading
+import concurrent.futures
+from dotenv import load_dotenv
+from app.http_client import close_session
+from app.redis import close_redis
+from app.metrics import Gauge
+load_dotenv()
+
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", 64))
+ASYNC_SHUTDOWN_TIMEOUT = float(os.getenv("ASYNC_SHUTDOWN_TIMEOUT", 10))
+# serverless (vercel.json, where VERCEL is set) freezes or kills the process between
+# requests, so call_every jobs and atexit hooks may never run, work has to finish in the request
+SERVERLESS = os.getenv("SERVERLESS", "1" if os.getenv("VERCEL") else "0") == "1"
+
+
+class LoopRunner:
+    """
+    Long-lived event loop on a daemon thread, one per worker process.
+    Sync code submits coroutines and gets concurrent futures back, so pooled
+    connections (http, redis) bound to the loop survive across requests.
+    Never call run() from a coroutine already on this loop, it would deadlock.
+    """
+
+    def __init__(self, max_concurrency: int = ASYNC_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.loop = asyncio.new_event_loop()
+        self._lock = threading.Lock()
+        self._futures = set()
+        self._services = set()
+        self._closed = False
+        self.queued = 0
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="async-runner", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.loop.call_soon(self._started.set)
+        self.loop.run_forever()
+
+    async def _bounded(self, coro, state: dict):
+        async with self._semaphore:
+            with self._lock:
+                state["started"] = True
+                self.queued -= 1
+                self.running += 1
+            try:
+                return await coro
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+    def _done(self, future, coro, state: dict):
+        with self._lock:
+            self._futures.discard(future)
+            if not state["started"]:
+                # cancelled while still waiting for a slot
+                self.queued -= 1
+            if future.cancelled() or future.exception():
+                self.failed += 1
+            else:
+                self.completed += 1
+        if not state["started"]:
+            coro.close()
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        state = {"started": False}
+        with self._lock:
+            if self._closed:
+                coro.close()
+                raise RuntimeError("LoopRunner is shut down")
+            self.queued += 1
+            self.submitted += 1
+            future = asyncio.run_coroutine_threadsafe(self._bounded(coro, state), self.loop)
+            self._futures.add(future)
+        future.add_done_callback(lambda f: self._done(f, coro, state))
+        return future
+
+    def spawn(self, coro):
+        """Run a long-lived coroutine (a listener) outside the concurrency limit until shutdown."""
+        def start():
+            task = self.loop.create_task(coro)
+            self._services.add(task)
+            task.add_done_callback(self._services.discard)
+        self.loop.call_soon_threadsafe(start)
+
+    async def _stop_services(self):
+        for task in list(self._services):
+            task.cancel()
+        await asyncio.gather(*self._services, return_exceptions=True)
+
+    def call_every(self, interval: float, coro_func):
+        """Submit coro_func() now and then every interval seconds until shutdown."""
+        def tick():
+            if self._closed:
+                return
+            try:
+                self.submit(coro_func()).add_done_callback(_log_failure)
+            except RuntimeError:
+                return
+            self.loop.call_later(interval, tick)
+        self.loop.call_soon_threadsafe(tick)
+
+    def run(self, coro, timeout: float = None):
+        """Submit and block until the coroutine finishes."""
+        return self.submit(coro).result(timeout)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self.queued,
+                "running": self.running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "max_concurrency": self.max_concurrency,
+            }
+
+    def shutdown(self, timeout: float = ASYNC_SHUTDOWN_TIMEOUT):
+        """Let in-flight work finish (up to timeout), cancel the rest, then close the loop."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            pending = list(self._futures)
+        concurrent.futures.wait(pending, timeout=timeout)
+        for future in pending:
+            future.cancel()
+        try:
+            asyncio.run_coroutine_threadsafe(self._stop_services(), self.loop).result(timeout)
+        except Exception as e:
+            print(f"Error stopping services: {e}")
+        try:
+            asyncio.run_coroutine_threadsafe(close_session(), self.loop).result(timeout)
+        except Exception as e:
+            print(f"Error closing http session: {e}")
+        try:
+            asyncio.run_coroutine_threadsafe(close_redis(), self.loop).result(timeout)
+        except Exception as e:
+            print(f"Error closing redis pool: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        if not self.loop.is_running():
+            self.loop.close()
+
+
+_runner = None
+_runner_pid = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> LoopRunner:
+    """Return this process's runner, starting a fresh one after a fork (gunicorn --preload)."""
+    global _runner, _runner_pid
+    with _runner_lock:
+        if _runner is None or _runner_pid != os.getpid():
+            _runner = LoopRunner()
+            _runner_pid = os.getpid()
+            atexit.register(_runner.shutdown)
+        return _runner
+
+
+Gauge(
+    "shows5u_async_runner",
+    "Persistent event loop state: queue_depth, running, submitted, completed, failed.",
+    lambda: {(("state", k),): v for k, v in _runner.metrics().items()} if _runner is not None else {},
+)
+
+
+def run_sync(coro, timeout: float = None):
+    return get_runner().run(coro, timeout)
+
+
+def run_in_background(coro) -> concurrent.futures.Future:
+    future = get_runner().submit(coro)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def iterate_sync(agen, timeout: float = None):
+    """Drive an async generator on the runner loop and yield its items to sync code."""
+    items = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        finally:
+            items.put(done)
+
+    future = get_runner().submit(pump())
+    try:
+        while (item := items.get(timeout=timeout)) is not done:
+            yield item
+        future.result(timeout)
+    finally:
+        # the consumer went away (client disconnected), stop the producer too
+        future.cancel()
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception():
+        print(f"Background task failed: {future.exception()}")
@@ -0,0 +1,132 @@
+import os
+import json
+import uuid
+import asyncio
+from time import monotonic
+from dotenv import load_dotenv
+from app.redis import redis_client
+from app.metrics import Counter
+load_dotenv()
+
+# concurrent callers asking for the same key share one in-flight computation: within a
+# process through a shared task, across workers through a short redis lock whose holder
+# publishes its result for the others to pick up. only keys no local task is computing go
+# to redis, the locks of one request's keys are taken in one pipeline, and the result is
+# published and the lock released in one script call
+SINGLEFLIGHT_REDIS = os.getenv("SINGLEFLIGHT_REDIS", "1") == "1"
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", 0.1))
+
+# KEYS: lock, result. ARGV: lock token, encoded result ("" when the computation failed), result ttl ms
+FINISH_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+end
+if ARGV[2] ~= '' then
+    redis.call('set', KEYS[2], ARGV[2], 'PX', ARGV[3])
+end
+"""
+
+singleflight_calls = Counter("shows5u_singleflight_total", "Single-flight calls by group and how they were served (leader, local, remote, fallback).")
+
+
+class SingleFlight:
+
+    def __init__(self, name: str, lock_ttl: float, result_ttl: float = 60, use_redis: bool = SINGLEFLIGHT_REDIS, encode=json.dumps, decode=json.loads):
+        self.name = name
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.use_redis = use_redis
+        self.encode = encode
+        self.decode = decode
+        self.inflight = {}
+
+    def _lock_key(self, key: str) -> str:
+        return f"singleflight:{self.name}:lock:{key}"
+
+    def _result_key(self, key: str) -> str:
+        return f"singleflight:{self.name}:result:{key}"
+
+    def do_many(self, calls: dict) -> dict:
+        """
+        key -> awaitable of func()'s result for every key, func in calls, each computed once for
+        all concurrent callers with that key. Must be called from a coroutine.
+        """
+        new = [key for key in calls if key not in self.inflight]
+        locks = asyncio.ensure_future(self._lock_many(new)) if new and self.use_redis else None
+        awaitables = {}
+        for key, func in calls.items():
+            task = self.inflight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._run(key, func, locks))
+                self.inflight[key] = task
+                task.add_done_callback(lambda _, key=key: self.inflight.pop(key, None))
+            else:
+                singleflight_calls.inc(group=self.name, served="local")
+            # a cancelled caller must not cancel the computation the others are waiting on
+            awaitables[key] = asyncio.shield(task)
+        return awaitables
+
+    async def do(self, key: str, func):
+        """Return func()'s result, computed once for all concurrent callers with this key."""
+        return await self.do_many({key: func})[key]
+
+    async def _lock_many(self, keys: list) -> dict:
+        """key -> lock token for the keys this process got the lock of, every key if redis is unreachable."""
+        tokens = {key: uuid.uuid4().hex for key in keys}
+        try:
+            async with redis_client() as r:
+                async with r.pipeline(transaction=False) as pipe:
+                    for key, token in tokens.items():
+                        pipe.set(self._lock_key(key), token, nx=True, px=int(self.lock_ttl * 1000))
+                    acquired = await pipe.execute()
+        except Exception as e:
+            print(f"Error acquiring {len(keys)} single-flight locks for {self.name}: {e}")
+            return tokens
+        return {key: token for (key, token), ok in zip(tokens.items(), acquired) if ok}
+
+    async def _run(self, key: str, func, locks):
+        if locks is None:
+            singleflight_calls.inc(group=self.name, served="leader")
+            return await func()
+
+        token = (await locks).get(key)
+        if token:
+            singleflight_calls.inc(group=self.name, served="leader")
+            encoded = ""
+            try:
+                result = await func()
+                encoded = self.encode(result)
+                return result
+            finally:
+                await self._finish(key, token, encoded)
+
+        result = await self._wait(key)
+        if result is not None:
+            singleflight_calls.inc(group=self.name, served="remote")
+            return self.decode(result)
+        # the other worker failed or ran past the lock ttl
+        singleflight_calls.inc(group=self.name, served="fallback")
+        return await func()
+
+    async def _finish(self, key: str, token: str, encoded: str):
+        try:
+            async with redis_client() as r:
+                await r.eval(FINISH_SCRIPT, 2, self._lock_key(key), self._result_key(key), token, encoded, int(self.result_ttl * 1000))
+        except Exception as e:
+            print(f"Error publishing single-flight result {self._result_key(key)}: {e}")
+
+    async def _wait(self, key: str):
+        lock_key, result_key = self._lock_key(key), self._result_key(key)
+        deadline = monotonic() + self.lock_ttl
+        try:
+            async with redis_client() as r:
+                while monotonic() < deadline:
+                    result, locked = await r.mget(result_key, lock_key)
+                    if result is not None:
+                        return result
+                    if locked is None:
+                        return await r.get(result_key)
+                    await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+        except Exception as e:
+            print(f"Error waiting on single-flight result {result_key}: {e}")
+        return None
@@ -1,8 +1,9 @@
 import unicodedata
 import re
 import hashlib
-import asyncio
 import json
+import zlib
+import msgpack
 
 def left_to_right_match(str1: str, str2: str) -> float:
     str1, str2 = str1.lower(), str2.lower()
@@ -25,6 +26,31 @@ def deserialize(result):
     }
 
 
+# metadata blobs: 1 byte format version, 1 byte flags, then the msgpack payload
+METADATA_VERSION = 1
+METADATA_ZLIB = 1
+
+
+def pack_metadata(result: dict, compress_min: int = 512) -> bytes:
+    payload = msgpack.packb(result, use_bin_type=True)
+    flags = 0
+    if len(payload) >= compress_min:
+        compressed = zlib.compress(payload, 6)
+        if len(compressed) < len(payload):
+            payload, flags = compressed, METADATA_ZLIB
+    return bytes((METADATA_VERSION, flags)) + payload
+
+
+def unpack_metadata(blob: bytes) -> dict:
+    version, flags = blob[0], blob[1]
+    if version != METADATA_VERSION:
+        raise ValueError(f"Unknown metadata format version {version}")
+    payload = blob[2:]
+    if flags & METADATA_ZLIB:
+        payload = zlib.decompress(payload)
+    return msgpack.unpackb(payload, raw=False)
+
+
 def to_ascii_safe_id(name: str) -> str:
     # Normalize Unicode
     normalized = unicodedata.normalize('NFKD', name)
@@ -42,11 +68,19 @@ def to_ascii_safe_id(name: str) -> str:
     return slug
 
 
+def embedding_id(content_type: str, title: str) -> str:
+    return f"{content_type}_{to_ascii_safe_id(title)}"
+
+
+def split_genres(genres) -> list[str]:
+    # preferences store genres as "A, B", recommendations as a list
+    if not genres:
+        return []
+    if isinstance(genres, str):
+        genres = genres.split(', ')
+    return [genre for genre in genres if genre]
 
 
-def run_async_task(coro_func, *args, **kwargs):
-    # Create a new event loop for the thread
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(coro_func(*args, **kwargs))
-    loop.close()
\ No newline at end of file
+def sse(event: str, data) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
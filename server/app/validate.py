@@ -1,4 +1,36 @@
 from abc import ABC, abstractmethod
+from contextvars import ContextVar
+
+
+class ProviderCalls:
+    """Provider requests made for one title lookup, shared with the tasks the lookup spawns."""
+
+    def __init__(self):
+        self.calls = 0
+        self.failed = False
+
+
+provider_calls = ContextVar("provider_calls", default=None)
+
+
+def track_provider_calls() -> ProviderCalls:
+    calls = ProviderCalls()
+    provider_calls.set(calls)
+    return calls
+
+
+def record_provider_call(status: int = None):
+    # a lookup that hit a rate limit, a server error or an exception (status None)
+    # says nothing about whether the title exists
+    calls = provider_calls.get()
+    if calls is None:
+        return
+    if status is not None:
+        calls.calls += 1
+    if status is None or status == 429 or status >= 500:
+        calls.failed = True
+
+
 class Validator(ABC):
     """Abstract base class for validation logic."""
 
@@ -1,35 +1,74 @@
-import aiohttp
+import os
 import asyncio
-from app.validate import Validator
+from app.validate import Validator, record_provider_call
+from app.router import ProviderRouter, provider_preference
+from app.http_client import get_session
+from app.metrics import traced, span, record_status
+from dotenv import load_dotenv
+load_dotenv()
 
 class ValidateAnime(Validator):
     
+    # overridable so the validators can be pointed at local stub servers
+    jikan_url = os.getenv('JIKAN_URL', 'https://api.jikan.moe/v4/anime')
+    anilist_url = os.getenv('ANILIST_URL', 'https://graphql.anilist.co')
+    kitsu_url = os.getenv('KITSU_URL', 'https://kitsu.io/api/edge/anime')
+    find_my_anime_url = os.getenv('FIND_MY_ANIME_URL', 'https://find-my-anime.dtimur.de/api')
+
+    # normalizers from each provider's record to the result dict, shared with app.ingest
+    @staticmethod
+    def from_jikan(anime):
+        return {
+            'title': anime['title'],
+            'description': anime['synopsis'],
+            'genres': [genre['name'] for genre in anime['genres']],
+            'year': anime.get('year'),
+            'image_url': anime['images']['jpg']['image_url'],
+            'url': anime['url']
+        }
+
+    @staticmethod
+    def from_anilist(anime):
+        return {
+            'title': anime['title']['romaji'],
+            'description': anime['description'],
+            'genres': anime['genres'],
+            'year': anime['startDate']['year'],
+            'image_url': anime['coverImage']['large'],
+            'url': anime['siteUrl']
+        }
+
+    @staticmethod
+    def from_kitsu(item):
+        anime = item['attributes']
+        return {
+            'title': anime['canonicalTitle'],
+            'description': anime['synopsis'],
+            'genres': [],
+            'year': anime.get('startDate')[:4],
+            'image_url': anime['posterImage']['original'],
+            'url': f"https://kitsu.io/anime/{item['id']}"
+        }
+    
     @staticmethod
+    @traced("provider", provider="jikan")
     async def search_jikan(anime_title):
         """Search for anime in Jikan API asynchronously."""
         query = anime_title.replace(' ', '%20')
-        url = f'https://api.jikan.moe/v4/anime?q={query}&limit=1'
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    # print(data)
-                    if data['data']:
-                        anime = data['data'][0]
-                        return {
-                            'title': anime['title'],
-                            'description': anime['synopsis'],
-                            'genres': [genre['name'] for genre in anime['genres']],
-                            'year': anime.get('year'),
-                            'image_url': anime['images']['jpg']['image_url'],
-                            'url': anime['url']
-                        }
-                #     print(data)
-                # print(response)
+        url = f'{ValidateAnime.jikan_url}?q={query}&limit=1'
+
+        session = get_session()
+        async with session.get(url) as response:
+            record_status("jikan", response.status)
+            record_provider_call(response.status)
+            if response.status == 200:
+                data = await response.json()
+                if data['data']:
+                    return ValidateAnime.from_jikan(data['data'][0])
         return None
 
     @staticmethod
+    @traced("provider", provider="anilist")
     async def search_anilist(anime_title):
         """Search for anime in AniList API asynchronously."""
         query = '''
@@ -51,62 +90,42 @@ class ValidateAnime(Validator):
         }
         '''
         variables = {'search': anime_title}
-        url = 'https://graphql.anilist.co'
+        url = ValidateAnime.anilist_url
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json={'query': query, 'variables': variables}) as response:
-                
-                if response.status == 200:
-                    
-                    data = await response.json()
-                    # print(data)
-                    if 'data' in data and 'Media' in data['data']:
-                        anime = data['data']['Media']
-                        return {
-                            'title': anime['title']['romaji'],
-                            'description': anime['description'],
-                            'genres': anime['genres'],
-                            'year': anime['startDate']['year'],
-                            'image_url': anime['coverImage']['large'],
-                            'url': anime['siteUrl']
-                        }
-                #     print(data)
-                # print(response)
-     
+        session = get_session()
+        async with session.post(url, json={'query': query, 'variables': variables}) as response:
+            record_status("anilist", response.status)
+            record_provider_call(response.status)
+            if response.status == 200:
+                data = await response.json()
+                if 'data' in data and 'Media' in data['data']:
+                    return ValidateAnime.from_anilist(data['data']['Media'])
         return None
     
     
 
     @staticmethod
+    @traced("provider", provider="kitsu")
     async def search_kitsu(anime_title):
         """Search for anime in Kitsu API asynchronously."""
         query = anime_title.replace(' ', '%20')
-        url = f'https://kitsu.io/api/edge/anime?filter[text]={query}'
+        url = f'{ValidateAnime.kitsu_url}?filter[text]={query}'
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                
-                    data = await response.json()
-                    # print(data)
-                    if data['data']:
-                        anime = data['data'][0]['attributes']
-                        return {
-                            'title': anime['canonicalTitle'],
-                            'description': anime['synopsis'],
-                            'genres': [],  
-                            'year': anime.get('startDate')[:4],
-                            'image_url': anime['posterImage']['original'],
-                            'url': f"https://kitsu.io/anime/{data['data'][0]['id']}"
-                        }
-                #     print(data)
-                # print(response)
+        session = get_session()
+        async with session.get(url) as response:
+            record_status("kitsu", response.status)
+            record_provider_call(response.status)
+            if response.status == 200:
+                data = await response.json()
+                if data['data']:
+                    return ValidateAnime.from_kitsu(data['data'][0])
         return None
     
     @staticmethod
+    @traced("provider", provider="find_my_anime")
     async def search_find_my_anime(anime_title):
         """Search for anime using the find-my-anime API asynchronously."""
-        url = 'https://find-my-anime.dtimur.de/api'
+        url = ValidateAnime.find_my_anime_url
         params = {
             'query': anime_title,
             'provider': 'Kitsu',
@@ -114,22 +133,24 @@ class ValidateAnime(Validator):
             'collectionConsent': 'true'
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
+        session = get_session()
+        async with session.get(url, params=params) as response:
+            record_status("find_my_anime", response.status)
+            record_provider_call(response.status)
                 
-                if response.status == 200:
-                    data = await response.json()
-                    if data and isinstance(data, list) and len(data) > 0:
-                        anime = data[0]  # taking the first result
-
-                        return {
-                            'title': anime.get('title'),
-                            'description': anime.get('synopsis'),
-                            'genres': [genre['name'] for genre in anime.get('genres', [])],
-                            'year': anime.get('year'),
-                            'image_url': anime.get('images', {}).get('jpg', {}).get('image_url'),
-                            'url': anime.get('url')
-                        }
+            if response.status == 200:
+                data = await response.json()
+                if data and isinstance(data, list) and len(data) > 0:
+                    anime = data[0]  # taking the first result
+
+                    return {
+                        'title': anime.get('title'),
+                        'description': anime.get('synopsis'),
+                        'genres': [genre['name'] for genre in anime.get('genres', [])],
+                        'year': anime.get('year'),
+                        'image_url': anime.get('images', {}).get('jpg', {}).get('image_url'),
+                        'url': anime.get('url')
+                    }
 
         return None
     
@@ -138,30 +159,24 @@ class ValidateAnime(Validator):
     async def validate(title):
         """Fetch anime details asynchronously and return the first valid result."""
 
-        tasks = {
-            asyncio.create_task(ValidateAnime.search_anilist(title)): "anilist",
-            asyncio.create_task(ValidateAnime.search_jikan(title)): "jikan",
-        }
-        # see if caching gives enougb results without kitsu
+        # providers in ROUTER_PREFERENCE_ANIME order, hedged past their usual latency
         try:
-            for future in asyncio.as_completed(tasks):
-                result = await future
-                if result:  
-                    return result
-            return await ValidateAnime.search_kitsu(title)
+            with span("validate", content_type="anime"):
+                return await anime_router.route(title)
         except Exception as e:
-            print(f"Error fetching from {title}: {e}") 
-        
-    
-        # try:
-        #     # searcj kitsu doesn't have genres, cant check hentai
-        #     for f in [ValidateAnime.search_jikan, ValidateAnime.search_anilist, ValidateAnime.search_kitsu]:
-        #         response = await f(title)
-        #         if response and 'Hentai' not in response['genres']:
-        #             return response
-        # except Exception as e:
-        #     print(f"Error {e}") 
-            
+            print(f"Error validating anime {title}: {e}")
+            record_provider_call()
+
+
+anime_router = ProviderRouter(
+    {
+        "anilist": ValidateAnime.search_anilist,
+        "jikan": ValidateAnime.search_jikan,
+        "kitsu": ValidateAnime.search_kitsu,
+        "find_my_anime": ValidateAnime.search_find_my_anime,
+    },
+    provider_preference("anime"),
+)
 
 
 # # Example Usage
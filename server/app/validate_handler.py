@@ -4,9 +4,30 @@ from app.redis import cache_results, get_cached_results_with_fallback, map_names
 from app.llm import generate
 from app.constants import FORBIDDEN_GENRES, TO_AVOID
 from app.utils import left_to_right_match
+from app.runner import run_sync, iterate_sync
+from app.singleflight import SingleFlight
+from app.validate import track_provider_calls
+from app.negative_cache import negative_cache, NEGATIVE_CACHE_ENABLED
+from app.resolver import title_resolver, resolutions, ensure_refresh_job, RESOLVER_ENABLED, RESOLVER_MIN_CONFIDENCE
+from app.catalog import catalog
 from time import sleep, time
 # if caching memory  not enough, can always just czche genres and title for kitsu
 import asyncio 
+import os
+
+VALIDATE_SINGLEFLIGHT_TTL = float(os.getenv("VALIDATE_SINGLEFLIGHT_TTL", 10))
+# concurrent requests validating the same title share one provider lookup
+validation_flight = SingleFlight("validate", lock_ttl=VALIDATE_SINGLEFLIGHT_TTL)
+
+
+def clean_result(result, content_type: str):
+    """Drop forbidden results and normalize the rest, also used by app.ingest."""
+    if not result or len(set(result['genres']).intersection(FORBIDDEN_GENRES)) > 0 or result['title'] in TO_AVOID:
+        return None
+    result = {k: ("" if v is None else v) for k, v in result.items()}
+    if content_type == 'anime':
+        result['title'] = result['title'].rstrip('!')
+    return result
 
 class ValidatorHandler:
     def __init__(self, content_type: str):
@@ -16,14 +37,65 @@ class ValidatorHandler:
         else:
             self.validator = ValidateMovies(content_type)
     
-    # dont want to change eevry validate method of diff classes for common processing
-    async def validate_single(self, title: str, to_map: list):
+    async def lookup(self, title: str):
+        calls = track_provider_calls()
         result = await self.validator.validate(title)
-        if not result or len(set(result['genres']).intersection(FORBIDDEN_GENRES)) > 0 or result['title'] in TO_AVOID:
+        return result, calls.calls, calls.failed
+
+    async def resolve_known(self, r, titles: set[str], to_map: list) -> dict:
+        """Results for the titles the fuzzy resolver confidently matches to a known title, no provider call."""
+        if not RESOLVER_ENABLED or not titles:
+            return {}
+        ensure_refresh_job()
+        matches = {
+            title: canonical
+            for title, (canonical, confidence) in title_resolver.resolve_many(self.content_type, titles).items()
+            if confidence >= RESOLVER_MIN_CONFIDENCE
+        }
+        if not matches:
+            resolutions.inc(len(titles), outcome="unresolved")
+            return {}
+        # catalog titles are local, titles learned from validation are in redis
+        canonical = list(set(matches.values()))
+        known = await asyncio.to_thread(catalog.get_many, self.content_type, canonical)
+        missing = [title for title in canonical if title.lower() not in known]
+        if missing:
+            cached = await get_cached_results_with_fallback(r, missing, self.content_type)
+            known.update({title.lower(): result for title, result in cached.items()})
+        resolved = {}
+        for title, canonical_title in matches.items():
+            result = known.get(canonical_title.lower())
+            if result:
+                resolved[title] = result
+                if title.lower() != result['title'].lower():
+                    to_map.append((title, result['title']))
+        resolutions.inc(len(resolved), outcome="resolved")
+        resolutions.inc(len(titles) - len(resolved), outcome="unresolved")
+        return resolved
+
+    def learn(self, results: list, to_map: list):
+        if RESOLVER_ENABLED:
+            title_resolver.add(self.content_type, [result['title'] for result in results], to_map)
+
+    def flight_key(self, title: str) -> str:
+        return f"{self.content_type}:{title.lower()}"
+
+    def start_lookups(self, titles) -> dict:
+        """Single-flight provider lookups of titles, their redis locks taken in one round trip."""
+        return validation_flight.do_many({self.flight_key(title): lambda title=title: self.lookup(title) for title in titles})
+
+    # dont want to change eevry validate method of diff classes for common processing
+    async def validate_single(self, title: str, to_map: list, misses: list = None, lookup=None):
+        if lookup is None:
+            lookup = validation_flight.do(self.flight_key(title), lambda: self.lookup(title))
+        result, calls, failed = await lookup
+        result = clean_result(result, self.content_type)
+        if not result:
+            # misses caused by a provider outage or rate limit aren't remembered
+            if misses is not None and not failed:
+                misses.append((title, calls))
             return {}
-        result = {k: ("" if v is None else v) for k, v in result.items()}
         if self.content_type == 'anime':
-            result['title'] = result['title'].rstrip('!')
             actual_title = result['title']
             # japanese vs english
             if left_to_right_match(title, actual_title) < 0.5:
@@ -34,27 +106,123 @@ class ValidatorHandler:
             
     async def validate_multiple(self, titles: set[str]):
         to_map = []
+        misses = []
         async with redis_client() as r:
             cached_dict = await get_cached_results_with_fallback(r, list(titles), self.content_type)
 
-        cached_titles = set(cached_dict.keys())
+            cached_titles = set(cached_dict.keys())
+            titles -= cached_titles
+            if NEGATIVE_CACHE_ENABLED:
+                titles -= await negative_cache.known_misses(r, self.content_type, titles)
+            resolved = await self.resolve_known(r, titles, to_map)
+            cached_dict.update(resolved)
+            titles -= set(resolved)
+
         cached_results = list(cached_dict.values())
-        titles -= cached_titles
-        coroutines = [self.validate_single(title, to_map) for title in titles]
+        lookups = self.start_lookups(titles)
+        coroutines = [self.validate_single(title, to_map, misses, lookups[self.flight_key(title)]) for title in titles]
         results = await asyncio.gather(*coroutines)
+        if NEGATIVE_CACHE_ENABLED and misses:
+            async with redis_client() as r:
+                await negative_cache.add(r, self.content_type, misses)
         results = list(filter(bool, results))
         final_results = results + cached_results
         # make unique by setting equal to dict keys
         dict_results = {result['title'].lower(): result for result in final_results if result}
         final_results = list(dict_results.values())
+        self.learn(final_results, to_map)
         return final_results, to_map, results
-        
+
+    async def iter_validated(self, titles: set[str], to_map: list, validated: list, sent: set = None):
+        """
+        Streaming form of validate_multiple: yields the cached results as one batch, then
+        each newly validated result as soon as its lookup finishes. Fresh results are also
+        appended to validated so the caller can cache them once the stream ends. Results
+        whose lowercased title is in sent are skipped, the rest are added to it.
+        """
+        async with redis_client() as r:
+            cached_dict = await get_cached_results_with_fallback(r, list(titles), self.content_type)
+            remaining = titles - set(cached_dict)
+            if NEGATIVE_CACHE_ENABLED:
+                remaining -= await negative_cache.known_misses(r, self.content_type, remaining)
+            resolved = await self.resolve_known(r, remaining, to_map)
+            cached_dict.update(resolved)
+            remaining -= set(resolved)
+
+        sent = set() if sent is None else sent
+        cached_results = []
+        for result in cached_dict.values():
+            if result['title'].lower() not in sent:
+                sent.add(result['title'].lower())
+                cached_results.append(result)
+        if cached_results:
+            yield cached_results
+
+        misses = []
+        lookups = self.start_lookups(remaining)
+        coroutines = [self.validate_single(title, to_map, misses, lookups[self.flight_key(title)]) for title in remaining]
+        for future in asyncio.as_completed(coroutines):
+            result = await future
+            if result and result['title'].lower() not in sent:
+                sent.add(result['title'].lower())
+                validated.append(result)
+                yield [result]
+
+        if NEGATIVE_CACHE_ENABLED and misses:
+            async with redis_client() as r:
+                await negative_cache.add(r, self.content_type, misses)
+        self.learn(cached_results + validated, to_map)
+
+    async def iter_validated_batches(self, title_batches, generated: set, to_map: list, validated: list):
+        """
+        iter_validated over titles that arrive in batches (one per LLM call): each batch starts
+        validating as soon as it arrives, alongside the earlier ones, and results are yielded in
+        the order they finish. Every title is added to generated, for the prompt's title cache.
+        """
+        sent = set()
+        batches = asyncio.Queue()
+        finished = object()
+
+        async def validate_batch(titles):
+            async for results in self.iter_validated(titles, to_map, validated, sent):
+                await batches.put(results)
+
+        async def produce():
+            tasks = []
+            try:
+                async for titles in title_batches:
+                    titles = titles - generated
+                    generated.update(titles)
+                    if titles:
+                        tasks.append(asyncio.create_task(validate_batch(titles)))
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await title_batches.aclose()
+                await batches.put(finished)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (results := await batches.get()) is not finished:
+                yield results
+            # raises what failed the producer, if anything
+            await producer
+        finally:
+            producer.cancel()
+
 
 def validate_titles(content_type: str, titles: set[str]):
     validator_handler = ValidatorHandler(content_type)
-    results = asyncio.run(validator_handler.validate_multiple(titles))
+    results = run_sync(validator_handler.validate_multiple(titles))
     return results 
 
+
+def stream_generated_titles(content_type: str, title_batches, generated: set, to_map: list, validated: list):
+    """Sync iterator over result batches from ValidatorHandler.iter_validated_batches."""
+    validator_handler = ValidatorHandler(content_type)
+    return iterate_sync(validator_handler.iter_validated_batches(title_batches, generated, to_map, validated))
+
 if __name__ == "__main__":
 
 
@@ -1,7 +1,9 @@
 import requests
 import os
-import aiohttp
-from app.validate import Validator
+from app.validate import Validator, record_provider_call
+from app.router import ProviderRouter, provider_preference
+from app.http_client import get_session
+from app.metrics import traced, span, record_status
 import asyncio
 from dotenv import load_dotenv
 load_dotenv()
@@ -10,83 +12,83 @@ class ValidateMovies(Validator):
     
     omdb_api_key = os.getenv('OMDB_API_KEY')
     tmdb_api_key = os.getenv('TMDB_API_KEY')
+    omdb_url = os.getenv('OMDB_URL', 'http://www.omdbapi.com/')
+    tmdb_url = os.getenv('TMDB_URL', 'https://api.themoviedb.org/3')
     # same instance only 1 content type
     def __init__(self, content_type):
         self.content_type = content_type
+        self.router = ProviderRouter({"omdb": self.search_omdb, "tmdb": self.search_tmdb}, provider_preference(content_type))
+
+    # normalizers from each provider's record to the result dict, shared with app.ingest
+    @staticmethod
+    def from_omdb(data):
+        return {
+            "title": data["Title"],
+            "description": data["Plot"],
+            "genres": data["Genre"].split(", "),
+            "year": data.get("Year"),
+            "image_url": data.get("Poster"),
+            "url": f"https://www.imdb.com/title/{data['imdbID']}"
+        }
+
+    @staticmethod
+    def from_tmdb(result, media_type):
+        poster_path = result.get("poster_path")
+        poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None
+        date = result.get("release_date") if media_type == "movie" else result.get("first_air_date")
+        return {
+            "title": result["title"] if media_type == "movie" else result["name"],
+            "description": result["overview"],
+            # search results have no genre names (separate API call), detail exports do
+            "genres": [genre["name"] for genre in result.get("genres", [])],
+            "year": int(date[:4]) if date else None,
+            "image_url": poster_url,
+            "url": f"https://www.themoviedb.org/{media_type}/{result['id']}"
+        }
         
+    @traced("provider", provider="omdb")
     async def search_omdb(self, title):
         """Search for a movie or TV show in OMDb asynchronously."""
-        url = f"http://www.omdbapi.com/?t={title}&type={self.content_type}&apikey={ValidateMovies.omdb_api_key}"
+        url = f"{ValidateMovies.omdb_url}?t={title}&type={self.content_type}&apikey={ValidateMovies.omdb_api_key}"
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
+        session = get_session()
+        async with session.get(url) as response:
+            record_status("omdb", response.status)
+            record_provider_call(response.status)
+            if response.status == 200:
+                data = await response.json()
 
-                    if data.get("Response") == "True":
-                        poster_url = data.get("Poster")
-                        return {
-                            "title": data["Title"],
-                            "description": data["Plot"],
-                            "genres": data["Genre"].split(", "),
-                            "year": data.get("Year"),
-                            "image_url": poster_url,
-                            "url": f"https://www.imdb.com/title/{data['imdbID']}"
-                        }
+                if data.get("Response") == "True":
+                    return ValidateMovies.from_omdb(data)
         return None
 
+    @traced("provider", provider="tmdb")
     async def search_tmdb(self, title):
         """Search for a movie or TV show in TMDb asynchronously."""
         media_type = "movie" if self.content_type == "movie" else "tv"
-        url = f"https://api.themoviedb.org/3/search/{media_type}?api_key={ValidateMovies.tmdb_api_key}&query={title}"
+        url = f"{ValidateMovies.tmdb_url}/search/{media_type}?api_key={ValidateMovies.tmdb_api_key}&query={title}"
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data["results"]:
-                        result = data["results"][0]  # Take the first search result
-                        poster_path = result.get("poster_path")
-                        backdrop_path = result.get("backdrop_path")
-                        poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None
-
-                        return {
-                            "title": result["title"] if media_type == "movie" else result["name"],
-                            "description": result["overview"],
-                            "genres": [],  # TMDb genres require a separate API call
-                            "year": int(result.get("release_date")[:4]) if media_type == "movie" else int(result.get("first_air_date")[:4]),
-                            "image_url": poster_url,
-                            "url": f"https://www.themoviedb.org/{media_type}/{result['id']}"
-                        }
+        session = get_session()
+        async with session.get(url) as response:
+            record_status("tmdb", response.status)
+            record_provider_call(response.status)
+            if response.status == 200:
+                data = await response.json()
+                if data["results"]:
+                    # Take the first search result
+                    return ValidateMovies.from_tmdb(data["results"][0], media_type)
         return None
 
     async def validate(self, title):
         """Fetch movie or TV show details from multiple sources and return the first available response."""
 
-        # tasks = {
-        #     asyncio.create_task(self.search_omdb(title)): "omdb",
-        #     asyncio.create_task(self.search_tmdb(title)): "tmdb",
-        # }
-        
-        # for future in asyncio.as_completed(tasks):
-        #     try:
-        #         result = await future
-        #         if result:
-        #             for task in tasks:
-        #                 if not task.done():
-        #                     task.cancel()
-        #             return result 
-        #     except Exception:
-        #         print(f"Error fetching from {title}: {e}") 
-        # need omdb first as it has genres
+        # omdb first as it has genres, tmdb's result is only used when omdb has none
         try:
-            response = await self.search_omdb(title)
-            if response:
-                return response
-            response = await self.search_tmdb(title)
-            return response
+            with span("validate", content_type=self.content_type):
+                return await self.router.route(title)
         except Exception as e:
-            print(f"Error {e}") 
+            print(f"Error validating {self.content_type} {title}: {e}")
+            record_provider_call()
 
 
 
@@ -0,0 +1,211 @@
+import os
+import json
+import fcntl
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import numpy as np
+from pinecone import Pinecone, ServerlessSpec
+from dotenv import load_dotenv
+from app.metrics import traced
+load_dotenv()
+
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")  # "pinecone" or "local"
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "/tmp/shows5u_vectors")
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float32")
+EMBEDDING_DIMENSION = 4096
+
+
+class VectorStore(ABC):
+    """Id -> embedding storage used by recommend.py."""
+
+    @abstractmethod
+    def fetch(self, ids: list[str]) -> dict[str, np.ndarray]:
+        """Return vectors for the ids that exist, missing ids are left out."""
+        pass
+
+    @abstractmethod
+    def upsert(self, ids: list[str], vectors) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, ids: list[str] = None, delete_all: bool = False) -> None:
+        pass
+
+
+class PineconeVectorStore(VectorStore):
+
+    def __init__(self, index_name: str = "embeddings", dimension: int = EMBEDDING_DIMENSION):
+        pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+        if not pc.has_index(index_name):
+            pc.create_index(
+                name=index_name,
+                dimension=dimension,
+                metric='cosine',
+                spec=ServerlessSpec(
+                    cloud='aws',
+                    region='us-east-1'
+                )
+            )
+        self.index = pc.Index(index_name)
+
+    @traced("vector_fetch", backend="pinecone")
+    def fetch(self, ids: list[str]) -> dict[str, np.ndarray]:
+        if not ids:
+            return {}
+        response = self.index.fetch(ids=ids)
+        return {item_id: np.asarray(vector.values, dtype=np.float32) for item_id, vector in response.vectors.items()}
+
+    @traced("vector_upsert", backend="pinecone")
+    def upsert(self, ids: list[str], vectors) -> None:
+        if not ids:
+            return
+        self.index.upsert(vectors=[
+            {"id": item_id, "values": np.asarray(vector, dtype=np.float32).tolist()}
+            for item_id, vector in zip(ids, vectors)
+        ])
+
+    def delete(self, ids: list[str] = None, delete_all: bool = False) -> None:
+        if delete_all:
+            self.index.delete(delete_all=True)
+        elif ids:
+            self.index.delete(ids=ids)
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Vectors live in a memory-mapped vectors.npy with an id -> row map in index.json.
+    Every worker maps the same file read-only, so the page cache is shared and reads
+    are zero-copy. Writers take an flock, write rows in place (or grow the file by
+    doubling), then atomically replace index.json; readers reload it when its mtime moves.
+    """
+
+    def __init__(self, path: str = VECTOR_STORE_PATH, dimension: int = EMBEDDING_DIMENSION, dtype: str = VECTOR_STORE_DTYPE, initial_capacity: int = 1024):
+        self.path = path
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self.initial_capacity = initial_capacity
+        self.vectors_path = os.path.join(path, "vectors.npy")
+        self.index_path = os.path.join(path, "index.json")
+        self.lock_path = os.path.join(path, "lock")
+        os.makedirs(path, exist_ok=True)
+        self._index = None
+        self._index_mtime = None
+        self._vectors = None
+
+    @contextmanager
+    def _write_lock(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _empty_index(self) -> dict:
+        return {"version": 0, "dimension": self.dimension, "dtype": self.dtype.str, "capacity": 0, "next_row": 0, "ids": {}, "free": []}
+
+    def _refresh(self):
+        # a stat per call is all readers pay when nothing changed
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            self._index, self._vectors, self._index_mtime = self._empty_index(), None, None
+            return
+        if mtime == self._index_mtime:
+            return
+        with open(self.index_path) as f:
+            index = json.load(f)
+        # rows are written in place, only a grow replaces the file and needs a remap
+        if index["capacity"] and (self._vectors is None or self._vectors.shape[0] != index["capacity"]):
+            self._vectors = np.load(self.vectors_path, mmap_mode="r")
+        self._index, self._index_mtime = index, mtime
+
+    def _write_index(self, index: dict):
+        index["version"] += 1
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _grow(self, index: dict, needed: int):
+        capacity = max(self.initial_capacity, index["capacity"])
+        while capacity < needed:
+            capacity *= 2
+        if capacity == index["capacity"]:
+            return
+        tmp_path = f"{self.vectors_path}.{os.getpid()}.tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.dtype, shape=(capacity, self.dimension))
+        if index["capacity"]:
+            grown[:index["capacity"]] = np.load(self.vectors_path, mmap_mode="r")
+        grown.flush()
+        del grown
+        os.replace(tmp_path, self.vectors_path)
+        index["capacity"] = capacity
+
+    @traced("vector_fetch", backend="local")
+    def fetch(self, ids: list[str]) -> dict[str, np.ndarray]:
+        self._refresh()
+        rows = self._index["ids"]
+        return {item_id: self._vectors[rows[item_id]] for item_id in ids if item_id in rows}
+
+    @traced("vector_upsert", backend="local")
+    def upsert(self, ids: list[str], vectors) -> None:
+        if not ids:
+            return
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(len(ids), self.dimension)
+        with self._write_lock():
+            self._index_mtime = None
+            self._refresh()
+            index = self._index
+            assigned = []
+            for item_id in ids:
+                row = index["ids"].get(item_id)
+                if row is None:
+                    if index["free"]:
+                        row = index["free"].pop()
+                    else:
+                        row = index["next_row"]
+                        index["next_row"] += 1
+                    index["ids"][item_id] = row
+                assigned.append(row)
+            self._grow(index, index["next_row"])
+            mapped = np.load(self.vectors_path, mmap_mode="r+")
+            mapped[assigned] = vectors
+            mapped.flush()
+            del mapped
+            self._write_index(index)
+            self._index_mtime = None
+
+    def delete(self, ids: list[str] = None, delete_all: bool = False) -> None:
+        with self._write_lock():
+            self._index_mtime = None
+            self._refresh()
+            index = self._index
+            if delete_all:
+                index.update({"ids": {}, "free": [], "next_row": 0})
+            else:
+                for item_id in ids or []:
+                    row = index["ids"].pop(item_id, None)
+                    if row is not None:
+                        index["free"].append(row)
+            self._write_index(index)
+            self._index_mtime = None
+
+
+def create_vector_store(backend: str = VECTOR_STORE) -> VectorStore:
+    if backend == "local":
+        return LocalVectorStore()
+    if backend == "pinecone":
+        return PineconeVectorStore()
+    raise ValueError(f"Vector store '{backend}' is not supported.")
+
+
+_vector_store = None
+
+
+def get_vector_store() -> VectorStore:
+    # created on first use instead of at import so importing the app needs no network
+    global _vector_store
+    if _vector_store is None:
+        _vector_store = create_vector_store()
+    return _vector_store
@@ -0,0 +1,82 @@
+"""
+Single round trip cache lookup (Lua script) vs the three pipelined round trips,
+against fakeredis with a simulated network round trip added to every request.
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.bench_cache_lookup --titles 100 --rtt 2
+"""
+import os
+import random
+import asyncio
+import argparse
+from time import perf_counter
+
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("COHERE_API_KEY", "bench")
+
+import numpy as np
+import fakeredis
+from fakeredis._clients._async import FakeAsyncRedisConnection
+from app.redis import cache_results, map_names, lookup_with_script, lookup_with_pipelines
+from benchmarks.fakes import CATALOG, fake_metadata
+
+
+def simulate_rtt(rtt: float):
+    # every command or pipeline is one packed send, sleep once per send
+    send = FakeAsyncRedisConnection.send_packed_command
+
+    async def delayed(self, command, check_health=True):
+        await asyncio.sleep(rtt)
+        return await send(self, command, check_health)
+    FakeAsyncRedisConnection.send_packed_command = delayed
+
+
+async def populate(r, content_type: str, direct: int, aliased: int):
+    titles = CATALOG[:direct + aliased]
+    await cache_results(r, [fake_metadata(title) for title in titles], content_type)
+    # the LLM's spelling differs from the provider's for the aliased titles
+    await map_names(r, [(f"{title} (alt)", title) for title in titles[direct:]])
+    return titles[:direct], [f"{title} (alt)" for title in titles[direct:]]
+
+
+async def measure(lookup, r, queries: list, content_type: str, iterations: int):
+    timings = []
+    for _ in range(iterations):
+        start = perf_counter()
+        await lookup(r, queries, content_type)
+        timings.append(perf_counter() - start)
+    return timings
+
+
+async def main(args):
+    simulate_rtt(args.rtt / 1000)
+    r = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    direct_hits = int(args.titles * args.hit_rate)
+    alias_hits = int(args.titles * args.alias_rate)
+    direct, aliased = await populate(r, args.content_type, direct_hits, alias_hits)
+    misses = [f"unknown title {i}" for i in range(args.titles - len(direct) - len(aliased))]
+    queries = direct + aliased + misses
+    random.Random(0).shuffle(queries)
+
+    script_results = await lookup_with_script(r, queries, args.content_type)
+    pipeline_results = await lookup_with_pipelines(r, queries, args.content_type)
+    assert script_results == pipeline_results, "script and pipelines disagree"
+
+    print(f"{len(queries)} titles ({len(direct)} direct, {len(aliased)} via alias, {len(misses)} misses), simulated rtt {args.rtt}ms")
+    print(f"{'lookup':>10} {'p50':>9} {'p95':>9} {'mean':>9}")
+    for name, lookup in [("pipelines", lookup_with_pipelines), ("script", lookup_with_script)]:
+        timings = np.array(await measure(lookup, r, queries, args.content_type, args.iterations)) * 1000
+        print(f"{name:>10} {np.percentile(timings, 50):8.2f}ms {np.percentile(timings, 95):8.2f}ms {timings.mean():8.2f}ms")
+    await r.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--titles", type=int, default=100)
+    parser.add_argument("--hit-rate", type=float, default=0.6, help="share of titles cached under their own name")
+    parser.add_argument("--alias-rate", type=float, default=0.2, help="share of titles cached under an alias")
+    parser.add_argument("--rtt", type=float, default=2, help="simulated round trip, ms")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--content-type", default="anime")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+"""
+Shared vs per-call aiohttp sessions against a local Jikan stub.
+
+    python -m benchmarks.bench_http --titles 100 --latency 20 --handshake 60
+
+The stub speaks plain HTTP, so the first request on every new connection is delayed by
+--handshake ms to stand in for the DNS lookup and TCP/TLS handshake a real provider costs.
+"""
+import os
+import asyncio
+import argparse
+from time import perf_counter
+
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("COHERE_API_KEY", "bench")
+
+import aiohttp
+from aiohttp import web
+from app.validate_anime import ValidateAnime
+from app.http_client import close_session
+
+
+def jikan_payload(title):
+    return {"data": [{
+        "title": title,
+        "synopsis": "A stub synopsis.",
+        "genres": [{"name": "Action"}, {"name": "Fantasy"}],
+        "year": 2020,
+        "images": {"jpg": {"image_url": "https://example.com/a.jpg"}},
+        "url": "https://example.com/anime/1",
+    }]}
+
+
+async def start_stub(latency: float, handshake: float):
+    peers = set()
+
+    async def handler(request):
+        peer = request.transport.get_extra_info("peername")
+        if peer not in peers:
+            peers.add(peer)
+            await asyncio.sleep(handshake)
+        await asyncio.sleep(latency)
+        return web.json_response(jikan_payload(request.query.get("q", "")))
+
+    app = web.Application()
+    app.router.add_get("/anime", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/anime", peers
+
+
+async def search_jikan_per_call(url, title):
+    # the old behaviour, one session (and connection) per lookup
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{url}?q={title}&limit=1") as response:
+            return await response.json()
+
+
+async def timed(coro):
+    start = perf_counter()
+    await coro
+    return perf_counter() - start
+
+
+async def run(n_titles: int, latency: float, handshake: float, rounds: int):
+    runner, url, peers = await start_stub(latency, handshake)
+    ValidateAnime.jikan_url = url
+    titles = [f"title {i}" for i in range(n_titles)]
+    report = {}
+    try:
+        for name, search in (
+            ("per-call", lambda t: search_jikan_per_call(url, t)),
+            ("shared", ValidateAnime.search_jikan),
+        ):
+            peers.clear()
+            latencies = []
+            start = perf_counter()
+            for _ in range(rounds):
+                latencies += await asyncio.gather(*(timed(search(t)) for t in titles))
+            total = perf_counter() - start
+            report[name] = (len(peers), total, sum(latencies) / len(latencies))
+    finally:
+        await close_session()
+        await runner.cleanup()
+
+    lookups = n_titles * rounds
+    print(f"{lookups} lookups, {latency * 1000:.0f}ms stub latency, {handshake * 1000:.0f}ms per new connection")
+    for name, (connections, total, mean) in report.items():
+        print(f"{name:>9}: {connections:4d} connections | {total * 1000:8.1f}ms total | {mean * 1000:6.2f}ms per title")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--titles", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=20, help="stub latency in ms")
+    parser.add_argument("--handshake", type=float, default=60, help="simulated connection setup in ms")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.titles, args.latency / 1000, args.handshake / 1000, args.rounds))
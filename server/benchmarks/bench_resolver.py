@@ -0,0 +1,69 @@
+"""
+Fuzzy title resolution: trigram index lookups vs a linear left_to_right_match scan,
+over a synthetic catalog with the kinds of spelling drift LLM titles have.
+
+    python -m benchmarks.bench_resolver --titles 50000 --queries 2000
+"""
+import os
+import random
+import argparse
+from time import perf_counter
+
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("COHERE_API_KEY", "bench")
+
+from app.resolver import TitleResolver, RESOLVER_MIN_CONFIDENCE
+from app.utils import left_to_right_match
+from benchmarks.fakes import drift
+
+SYLLABLES = [c + v for c in "bcdfghjklmnprstvwyz" for v in "aeiou"] + ["the", "of", "and", "an"]
+
+
+def make_titles(rng: random.Random, count: int, vocabulary: int = 3000) -> list[str]:
+    words = list({"".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(vocabulary)})
+    titles = set()
+    while len(titles) < count:
+        words_in_title = rng.sample(words, rng.randint(1, 4))
+        suffix = f" {rng.randint(2, 9)}" if rng.random() < 0.2 else ""
+        titles.add(" ".join(words_in_title).title() + suffix)
+    return sorted(titles)
+
+
+def main(args):
+    rng = random.Random(0)
+    titles = make_titles(rng, args.titles)
+    resolver = TitleResolver(source=None)
+    start = perf_counter()
+    resolver.add("anime", titles)
+    print(f"indexed {len(titles)} titles in {perf_counter() - start:.2f}s")
+
+    known = rng.sample(titles, args.queries)
+    queries = [drift(rng, title) for title in known]
+    unknown = [f"Unlisted Show {i}" for i in range(args.queries // 4)]
+
+    start = perf_counter()
+    matches = resolver.resolve_many("anime", queries + unknown)
+    elapsed = perf_counter() - start
+    confident = {q: m for q, m in matches.items() if m[1] >= RESOLVER_MIN_CONFIDENCE}
+    correct = sum(1 for q, t in zip(queries, known) if confident.get(q, (None,))[0] == t)
+    wrong = sum(1 for q, t in zip(queries, known) if q in confident and confident[q][0] != t)
+    false_positives = sum(1 for q in unknown if q in confident)
+    print(f"trigram index: {elapsed / len(queries + unknown) * 1e6:.1f}us/title, "
+          f"{correct}/{len(queries)} resolved correctly, {wrong} wrong, "
+          f"{false_positives}/{len(unknown)} unknown titles matched (confidence >= {RESOLVER_MIN_CONFIDENCE})")
+
+    sample = queries[:args.scan_sample]
+    start = perf_counter()
+    scan = [max(titles, key=lambda t: left_to_right_match(q, t)) for q in sample]
+    elapsed = perf_counter() - start
+    scan_correct = sum(1 for q, match in zip(sample, scan) if match == known[queries.index(q)])
+    print(f"linear scan:   {elapsed / len(sample) * 1e6:.1f}us/title, {scan_correct}/{len(sample)} resolved correctly")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--titles", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--scan-sample", type=int, default=50, help="queries timed with the linear scan")
+    main(parser.parse_args())
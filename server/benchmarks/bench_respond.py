@@ -0,0 +1,275 @@
+"""
+End-to-end /respond latency with every external service faked in-process
+(provider stub servers, fake Cohere, fakeredis, SQLite, local vector store).
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.bench_respond --requests 30 --provider-latency 80 --llm-latency 800
+
+Prints p50/p95/p99 per stage and writes them, with the run configuration, to a JSON
+file under benchmarks/results/ so runs can be compared over time.
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+from time import perf_counter, time
+from functools import wraps
+
+import numpy as np
+import redis.asyncio
+import fakeredis
+from fakeredis._clients._async import FakeAsyncRedisConnection
+from benchmarks.fakes import ProviderStubs, FakeCohere, FakeAsyncCohere, CATALOG, fake_metadata
+
+STAGES = ["llm_generate", "validation", "ranking", "db_upsert", "background_tasks", "first_result", "total"]
+
+
+def configure_env(stubs: ProviderStubs, workdir: str, client_rate_limit: float = 0):
+    # module level settings are read at import, so this has to run before app is imported
+    os.environ.update(stubs.env())
+    os.environ.update({
+        "SECRET_KEY": "bench",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.sqlite3')}",
+        "COHERE_API_KEY": "bench",
+        "VECTOR_STORE": "local",
+        "VECTOR_STORE_PATH": os.path.join(workdir, "vectors"),
+        "EMBED_CACHE_BACKEND": "disk",
+        "EMBED_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite3"),
+        "PROFILE_STORE": "disk",
+        "PROFILE_STORE_PATH": os.path.join(workdir, "profiles.sqlite3"),
+        "CATALOG_PATH": os.path.join(workdir, "catalog.sqlite3"),
+        # fakeredis has no INFO, so the eviction job can't read memory use
+        "EVICTION_ENABLED": "0",
+        "RATE_LIMIT_ENABLED": "1" if client_rate_limit else "0",
+    })
+    for provider in ("JIKAN", "ANILIST", "KITSU", "FIND_MY_ANIME", "OMDB", "TMDB"):
+        os.environ[f"RATE_LIMIT_{provider}"] = f"{client_rate_limit}/1"
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self.pending = []
+
+    def wrap(self, stage: str, func):
+        @wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.samples[stage].append(perf_counter() - start)
+        return timed
+
+    def wrap_background(self, run_in_background):
+        # background work finishes after the response, time it from submission to completion
+        @wraps(run_in_background)
+        def timed(coro):
+            future = run_in_background(coro)
+            self.pending.append((perf_counter(), future))
+            return future
+        return timed
+
+    def drain_background(self):
+        finished = []
+        for start, future in self.pending:
+            try:
+                future.result(timeout=60)
+            except Exception:
+                pass
+            finished.append(perf_counter() - start)
+        if finished:
+            self.samples["background_tasks"].append(max(finished))
+        self.pending = []
+
+    def summary(self) -> dict:
+        return {
+            stage: {
+                "n": len(values),
+                "p50_ms": float(np.percentile(values, 50) * 1000),
+                "p95_ms": float(np.percentile(values, 95) * 1000),
+                "p99_ms": float(np.percentile(values, 99) * 1000),
+            }
+            for stage, values in self.samples.items() if values
+        }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def run(args):
+    stubs = ProviderStubs(
+        latency=args.provider_latency / 1000, error_rate=args.error_rate,
+        slow={name: 10 for name in args.slow_provider}, failing=set(args.failing_provider),
+        rate_limit=args.provider_rate_limit,
+    ).start()
+    workdir = tempfile.mkdtemp(prefix="bench_respond_")
+    configure_env(stubs, workdir, args.client_rate_limit)
+
+    import app.llm
+    import app.redis
+    import app.routes
+    import app.recommend
+    from app import create_app
+    from app.negative_cache import negative_cache
+    from app.metrics import cache_lookups
+    from app.resolver import resolutions
+    from app.router import router_decisions, _health
+    from app.rate_limit import rate_limit_tokens, rate_limit_waits
+    from app.embed_queue import embedding_queue
+    from app.extensions import db, limiter
+
+    FakeAsyncCohere.latency = args.llm_latency / 1000
+    FakeAsyncCohere.error_rate = args.error_rate
+    FakeAsyncCohere.hallucination_rate = args.hallucination_rate
+    FakeAsyncCohere.drift_rate = args.drift_rate
+    app.llm.cohere.AsyncClient = FakeAsyncCohere
+    fake_cohere = FakeCohere(latency=args.embed_latency / 1000, error_rate=0)
+    app.recommend.co = fake_cohere
+    redis_server = fakeredis.FakeServer()
+    # the app's own metered pool, with in-process fakeredis connections
+    app.redis.get_redis = lambda: redis.asyncio.Redis(connection_pool=app.redis.MeteredConnectionPool(
+        connection_class=FakeAsyncRedisConnection, server=redis_server, max_connections=app.redis.REDIS_MAX_CONNECTIONS,
+        timeout=app.redis.REDIS_POOL_TIMEOUT, decode_responses=True,
+    ))
+
+    timer = StageTimer()
+    routes = app.routes
+    routes.generate = timer.wrap("llm_generate", routes.generate)
+    routes.validate_titles = timer.wrap("validation", routes.validate_titles)
+    routes.give_recommendations = timer.wrap("ranking", routes.give_recommendations)
+    routes.record_popular = timer.wrap("db_upsert", routes.record_popular)
+    routes.run_in_background = timer.wrap_background(routes.run_in_background)
+
+    flask_app = create_app()
+    limiter.enabled = False
+    with flask_app.app_context():
+        db.create_all()
+    client = flask_app.test_client()
+
+    rng = random.Random(args.seed)
+    email = "bench@example.com"
+    preference_times = []
+    for title in rng.sample(CATALOG, args.preferences):
+        meta = fake_metadata(title)
+        start = perf_counter()
+        client.post("/preference", json={
+            "email": email, "title": meta["title"], "description": meta["description"], "content_type": args.content_type,
+            "image_url": meta["image_url"], "genres": ", ".join(meta["genres"]), "url": meta["url"], "rating": rng.randint(1, 5),
+        })
+        preference_times.append(perf_counter() - start)
+    # rank against the same profile whether embeddings are written inline or behind
+    embedding_queue.flush()
+    preference_embed_calls = fake_cohere.embed_calls
+
+    queries = [f"stub query {i}" for i in range(args.distinct_queries)]
+    failures = 0
+    for _ in range(args.requests):
+        start = perf_counter()
+        body = {"query": rng.choice(queries), "content_type": args.content_type, "email": email}
+        if args.stream:
+            response = client.post("/respond/stream", json=body, buffered=False)
+            first = True
+            for chunk in response.response:
+                if first and b"event: results" in chunk:
+                    timer.samples["first_result"].append(perf_counter() - start)
+                    first = False
+        else:
+            response = client.post("/respond", json=body)
+        timer.samples["total"].append(perf_counter() - start)
+        failures += response.status_code != 200
+        timer.drain_background()
+
+    stubs.stop()
+    summary = timer.summary()
+    result = {
+        "benchmark": "respond",
+        "timestamp": time(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "failures": failures,
+        "provider_calls": stubs.calls,
+        "provider_throttled": stubs.throttled,
+        "llm_calls": FakeAsyncCohere.chat_calls,
+        "embed_calls": fake_cohere.embed_calls,
+        "negative_cache": negative_cache.metrics(),
+        "redis_pool": app.redis.pool_metrics(),
+        "cache_lookups": {f"{dict(key)['cache']}_{dict(key)['result']}": value for key, value in cache_lookups.values.items()},
+        "title_resolutions": {dict(key)["outcome"]: value for key, value in resolutions.values.items()},
+        "router_decisions": {f"{dict(key)['provider']}_{dict(key)['decision']}": value for key, value in router_decisions.values.items()},
+        "provider_health": {name: health.metrics() for name, health in _health.items()},
+        "rate_limit": {
+            "tokens": {f"{dict(key)['provider']}_{dict(key)['source']}": value for key, value in rate_limit_tokens.values.items()},
+            "mean_wait_ms": {
+                dict(key)["provider"]: round(state[-1] / sum(state[:-1]) * 1000, 1)
+                for key, state in rate_limit_waits.values.items() if sum(state[:-1])
+            },
+        },
+        "preference": {
+            "n": len(preference_times),
+            "p50_ms": float(np.percentile(preference_times, 50)) * 1000 if preference_times else 0.0,
+            "p95_ms": float(np.percentile(preference_times, 95)) * 1000 if preference_times else 0.0,
+            "embed_calls": preference_embed_calls,
+        },
+        "stages": summary,
+    }
+
+    print(f"{args.requests} requests ({failures} failed), {args.content_type}, rev {result['git_revision']}")
+    print(f"{'stage':>18} {'n':>5} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for stage in STAGES:
+        if stage in summary:
+            s = summary[stage]
+            print(f"{stage:>18} {s['n']:5d} {s['p50_ms']:8.1f}ms {s['p95_ms']:8.1f}ms {s['p99_ms']:8.1f}ms")
+    print(f"/preference: {result['preference']}")
+    print(f"provider calls {stubs.calls}, llm calls {FakeAsyncCohere.chat_calls}, embed calls {fake_cohere.embed_calls}")
+    print(f"redis pool: {result['redis_pool']}")
+    print(f"cache lookups: {result['cache_lookups']}")
+    print(f"title resolver: {result['title_resolutions']}")
+    print(f"router: {dict(sorted(result['router_decisions'].items()))}")
+    print(f"provider 429s: {stubs.throttled}, rate limiter: {result['rate_limit']}")
+    negative = result["negative_cache"]
+    print(f"negative cache: {negative['skipped']} titles skipped, {negative['provider_calls_saved']} provider calls saved, "
+          f"hit rate {negative['hit_rate']:.4f}")
+
+    out = args.out or os.path.join(os.path.dirname(__file__), "results", f"respond_{int(result['timestamp'])}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {out}")
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--content-type", default="anime", choices=["anime", "movie", "series"])
+    parser.add_argument("--distinct-queries", type=int, default=5, help="fewer distinct queries means more cache hits")
+    parser.add_argument("--preferences", type=int, default=10, help="titles the benchmark user has rated")
+    parser.add_argument("--provider-latency", type=float, default=80, help="ms")
+    parser.add_argument("--llm-latency", type=float, default=800, help="ms")
+    parser.add_argument("--embed-latency", type=float, default=150, help="ms")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--slow-provider", action="append", default=[], help="provider answering 10x slower, repeatable")
+    parser.add_argument("--failing-provider", action="append", default=[], help="provider failing every request, repeatable")
+    parser.add_argument("--provider-rate-limit", type=float, default=0, help="requests/s per provider the stubs allow before a 429, 0 for none")
+    parser.add_argument("--client-rate-limit", type=float, default=0, help="requests/s per provider the app's limiter allows, 0 disables it")
+    parser.add_argument("--hallucination-rate", type=float, default=0.1, help="share of LLM titles no provider knows")
+    parser.add_argument("--drift-rate", type=float, default=0.2, help="share of LLM titles misspelled, for the title resolver to match")
+    parser.add_argument("--stream", action="store_true", help="use /respond/stream and time the first results event")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    run(parse_args(sys.argv[1:]))
@@ -0,0 +1,215 @@
+"""
+In-process stand-ins for every external service /respond touches, so the pipeline
+can be measured offline. Each fake takes a latency (seconds) and an error rate.
+
+    stubs = ProviderStubs(latency=0.05, error_rate=0.02).start()
+    os.environ.update(stubs.env())      # before importing app
+"""
+import asyncio
+import hashlib
+import random
+import threading
+from collections import deque
+from types import SimpleNamespace
+from time import sleep, monotonic
+from aiohttp import web
+
+GENRES = ["Action", "Adventure", "Comedy", "Drama", "Fantasy", "Horror", "Mystery", "Romance", "Sci-Fi", "Slice of Life", "Sports", "Supernatural"]
+CATALOG = [f"Stub Title {i:03d}" for i in range(300)]
+# titles the LLM makes up, every provider misses them
+HALLUCINATED = [f"Made Up Title {i:03d}" for i in range(100)]
+
+
+def stable_random(text: str) -> random.Random:
+    return random.Random(int(hashlib.md5(text.encode("utf-8")).hexdigest(), 16))
+
+
+def drift(rng: random.Random, title: str) -> str:
+    """title spelled the way LLM output drifts from the listed title."""
+    kind = rng.choice(["case", "punctuation", "typo", "format", "article", "season"])
+    if kind == "case":
+        return title.upper()
+    if kind == "punctuation":
+        return title.replace(" ", ": ", 1) + "!"
+    if kind == "typo":
+        i = rng.randrange(1, len(title) - 1)
+        return title[:i] + title[i + 1] + title[i] + title[i + 2:]
+    if kind == "format":
+        return f"{title} (TV)"
+    if kind == "article":
+        return f"The {title}"
+    return f"{title} Season 1"
+
+
+def fake_metadata(title: str) -> dict:
+    rng = stable_random(title.lower())
+    return {
+        "title": title.title(),
+        "description": f"{title} synopsis " + " ".join(rng.sample(GENRES, 3)).lower(),
+        "genres": rng.sample(GENRES, rng.randint(1, 4)),
+        "year": rng.randint(1990, 2024),
+        "image_url": f"https://example.com/{abs(hash(title))}.jpg",
+        "url": f"https://example.com/title/{abs(hash(title))}",
+    }
+
+
+class ProviderStubs:
+    """Jikan, AniList, Kitsu, OMDb and TMDb on one local aiohttp server, on its own loop thread."""
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, miss_rate: float = 0.05,
+                 slow: dict = None, failing: set = (), rate_limit: float = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.miss_rate = miss_rate
+        self.slow = slow or {}  # provider -> latency multiplier
+        self.failing = set(failing)  # providers that answer every request with a 500
+        self.rate_limit = rate_limit  # requests per second per provider over that get a 429, 0 for none
+        self.recent = {}  # provider -> deque of request times in the last second
+        self.throttled = {}
+        self.calls = {}
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+
+    async def _respond(self, provider: str, title: str, build, miss_status: int = 200):
+        self.calls[provider] = self.calls.get(provider, 0) + 1
+        if self.rate_limit:
+            now = monotonic()
+            recent = self.recent.setdefault(provider, deque())
+            while recent and now - recent[0] > 1:
+                recent.popleft()
+            recent.append(now)
+            if len(recent) > self.rate_limit:
+                self.throttled[provider] = self.throttled.get(provider, 0) + 1
+                return web.json_response({"error": "rate limited"}, status=429)
+        await asyncio.sleep(self.latency * self.slow.get(provider, 1) * random.uniform(0.5, 1.5))
+        if provider in self.failing or random.random() < self.error_rate:
+            return web.json_response({"error": "stub failure"}, status=500)
+        if title.title() in HALLUCINATED or stable_random(f"{provider}:{title.lower()}").random() < self.miss_rate:
+            return web.json_response(build(None), status=miss_status)
+        return web.json_response(build(fake_metadata(title)))
+
+    async def jikan(self, request):
+        def build(m):
+            return {"data": [{
+                "title": m["title"], "synopsis": m["description"], "genres": [{"name": g} for g in m["genres"]],
+                "year": m["year"], "images": {"jpg": {"image_url": m["image_url"]}}, "url": m["url"],
+            }] if m else []}
+        return await self._respond("jikan", request.query.get("q", ""), build)
+
+    async def anilist(self, request):
+        body = await request.json()
+
+        def build(m):
+            return {"data": {"Media": {
+                "title": {"romaji": m["title"]}, "description": m["description"], "genres": m["genres"],
+                "startDate": {"year": m["year"]}, "coverImage": {"large": m["image_url"]}, "siteUrl": m["url"],
+            }}} if m else {"data": {"Media": None}, "errors": [{"message": "Not Found."}]}
+        # AniList answers a miss with a 404
+        return await self._respond("anilist", body["variables"]["search"], build, miss_status=404)
+
+    async def kitsu(self, request):
+        def build(m):
+            return {"data": [{"id": "1", "attributes": {
+                "canonicalTitle": m["title"], "synopsis": m["description"], "startDate": f"{m['year']}-01-01",
+                "posterImage": {"original": m["image_url"]},
+            }}] if m else []}
+        return await self._respond("kitsu", request.query.get("filter[text]", ""), build)
+
+    async def omdb(self, request):
+        def build(m):
+            return {
+                "Response": "True", "Title": m["title"], "Plot": m["description"], "Genre": ", ".join(m["genres"]),
+                "Year": str(m["year"]), "Poster": m["image_url"], "imdbID": "tt0000001",
+            } if m else {"Response": "False"}
+        return await self._respond("omdb", request.query.get("t", ""), build)
+
+    async def tmdb(self, request):
+        def build(m):
+            return {"results": [{
+                "id": 1, "title": m["title"], "name": m["title"], "overview": m["description"],
+                "release_date": f"{m['year']}-01-01", "first_air_date": f"{m['year']}-01-01", "poster_path": "/p.jpg",
+            }] if m else []}
+        return await self._respond("tmdb", request.query.get("query", ""), build)
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get("/jikan", self.jikan)
+        app.router.add_post("/anilist", self.anilist)
+        app.router.add_get("/kitsu", self.kitsu)
+        app.router.add_get("/omdb", self.omdb)
+        app.router.add_get("/tmdb/search/{media_type}", self.tmdb)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def start(self) -> "ProviderStubs":
+        threading.Thread(target=self.loop.run_forever, name="provider-stubs", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def env(self) -> dict:
+        base = f"http://127.0.0.1:{self.port}"
+        return {
+            "JIKAN_URL": f"{base}/jikan",
+            "ANILIST_URL": f"{base}/anilist",
+            "KITSU_URL": f"{base}/kitsu",
+            "OMDB_URL": f"{base}/omdb",
+            "TMDB_URL": f"{base}/tmdb",
+        }
+
+
+class FakeCohereError(Exception):
+    pass
+
+
+def fake_embedding(text: str, dimension: int = 4096) -> list[float]:
+    rng = stable_random(text or "")
+    return [rng.uniform(-1, 1) for _ in range(dimension)]
+
+
+class FakeCohere:
+    """Sync client with embed(), stands in for cohere.Client in recommend.py."""
+
+    def __init__(self, latency: float = 0.1, error_rate: float = 0.0, dimension: int = 4096):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.dimension = dimension
+        self.embed_calls = 0
+        self.embedded_texts = 0
+
+    def embed(self, texts: list[str], model: str = None, truncate: str = None, **kwargs):
+        self.embed_calls += 1
+        self.embedded_texts += len(texts)
+        sleep(self.latency)
+        if random.random() < self.error_rate:
+            raise FakeCohereError("stub embed failure")
+        return SimpleNamespace(embeddings=[fake_embedding(text, self.dimension) for text in texts])
+
+
+class FakeAsyncCohere:
+    """Async client with chat(), stands in for cohere.AsyncClient in llm.py."""
+
+    latency = 0.8
+    error_rate = 0.0
+    titles_per_call = 12
+    hallucination_rate = 0.0
+    drift_rate = 0.0  # share of real titles returned misspelled, see drift()
+    chat_calls = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def chat(self, message: str, **kwargs):
+        FakeAsyncCohere.chat_calls += 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 2.0))
+        if random.random() < self.error_rate:
+            raise FakeCohereError("stub chat failure")
+        titles = [random.choice(HALLUCINATED) if random.random() < self.hallucination_rate else title for title in random.sample(CATALOG, self.titles_per_call)]
+        titles = [drift(random, title) if title in CATALOG and random.random() < self.drift_rate else title for title in titles]
+        return SimpleNamespace(text="; ".join(titles))